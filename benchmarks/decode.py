@@ -0,0 +1,80 @@
+"""
+Benchmark decoding the getInfo records of WARCs with each available decoder, with and without only keeping the
+fields used for rows.
+
+Decoding is timed on payloads already read into memory, so that reading and decompressing the WARCs isn't
+counted. Iterating over the WARCs is also timed, end to end.
+
+Run from the root of the repo:
+
+    python -m benchmarks.decode [<path to WARC> ...]
+"""
+from __future__ import absolute_import
+import argparse
+import time
+from warcio.archiveiterator import ArchiveIterator
+from flickr_warc_iter import FlickrWarcIter, DECODERS, TYPE_FLICKR_PHOTO, decode_payload
+from flickr_exporter import ROW_FIELDS
+
+DEFAULT_WARCS = (
+    "tests/warcs/1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286-551fcc0ef48b"
+    "-8000.warc.gz",)
+
+
+def read_payloads(filepaths):
+    payloads = []
+    for filepath in filepaths:
+        with open(filepath, "rb") as f:
+            for record in ArchiveIterator(f):
+                url = record.rec_headers.get_header("WARC-Target-URI") or ""
+                if record.rec_type == "response" and "method=flickr.photos.getInfo" in url:
+                    payloads.append(record.content_stream().read())
+    return payloads
+
+
+def best_secs(func, repeat):
+    secs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        secs.append(time.perf_counter() - start)
+    return min(secs)
+
+
+def decode(payloads, decoder, fields):
+    for payload in payloads:
+        photo = decode_payload(payload, decoder)["photo"]
+        if fields:
+            {field: photo[field] for field in fields if field in photo}
+
+
+def iterate(filepaths, decoder, fields):
+    for _ in FlickrWarcIter(filepaths, use_index=False, decoder=decoder, fields=fields).iter(
+            limit_item_types=[TYPE_FLICKR_PHOTO]):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark decoding of Flickr WARC records.")
+    parser.add_argument("filepaths", nargs="*", default=DEFAULT_WARCS, help="WARC files")
+    parser.add_argument("--repeat", type=int, default=5, help="Times to run each benchmark. The best time is "
+                                                              "reported.")
+    parser.add_argument("--decode-loops", type=int, default=50, help="Times to decode the payloads per run.")
+    args = parser.parse_args()
+
+    payloads = read_payloads(args.filepaths)
+    print("{} getInfo payloads, averaging {:.0f} bytes".format(len(payloads),
+                                                               sum(map(len, payloads)) / max(len(payloads), 1)))
+    # Speedups are relative to json without projection, which is how records were decoded before decoders.
+    for name, func, func_args, loops in (
+            ("decode", decode, payloads, args.decode_loops),
+            ("iterate", iterate, args.filepaths, 1)):
+        baseline_secs = None
+        for decoder in sorted(DECODERS):
+            for fields in (None, ROW_FIELDS):
+                secs = best_secs(lambda: [func(func_args, decoder, fields) for _ in range(loops)], args.repeat)
+                if baseline_secs is None:
+                    baseline_secs = secs
+                print("{:<8} {:<8} {:<9} {:>9.4f}s {:>6.2f}x".format(name, decoder,
+                                                                    "projected" if fields else "full", secs,
+                                                                    baseline_secs / secs))
@@ -0,0 +1,281 @@
+"""
+Local stand-in for the Flickr REST API, serving synthetic users for load testing the harvester.
+
+Implements people.findByUsername, people.getInfo, people.getPublicPhotos, photos.getInfo and photos.getSizes for
+synthetic users (see benchmarks.synthetic) named synthetic.user0, synthetic.user1, etc. Credentials and signatures
+are not checked. Latency, errors, throttle responses and a quota can be injected:
+
+  * Latency: each call is delayed by latency_ms, plus up to latency_jitter_ms.
+  * Errors: error_rate of calls get an HTTP 500.
+  * Throttling: throttle_rate of calls get Flickr's "Service currently unavailable" error (code 105).
+  * Quota: beyond quota calls in a second, calls get an HTTP 429.
+
+Counts of calls by method and response, and the time spent, are at /stats.
+
+To run, from the root of the repo:
+
+    python -m benchmarks.flickr_api_server [--port 8080] [--users 10] [--photos 1000] [--latency-ms 50]
+
+Then point the harvester at it:
+
+    FLICKR_REST_URL=http://localhost:8080/services/rest/ python flickr_harvester.py ...
+"""
+from __future__ import absolute_import
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+from benchmarks.synthetic import SyntheticUser, FIRST_PHOTO_ID, PER_PAGE
+
+log = logging.getLogger(__name__)
+
+REST_PATH = "/services/rest/"
+STATS_PATH = "/stats"
+MAX_PER_PAGE = 500
+
+# Flickr API error codes
+CODE_NOT_FOUND = 1
+CODE_SERVICE_UNAVAILABLE = 105
+CODE_METHOD_NOT_FOUND = 112
+
+
+class FlickrStandIn(object):
+    """
+    Answers Flickr API calls for synthetic users, injecting latency, errors and throttling.
+    """
+
+    def __init__(self, user_count=10, photo_count=1000, latency_ms=0, latency_jitter_ms=0, error_rate=0.0,
+                 throttle_rate=0.0, quota=None, seed=0):
+        """
+        :param user_count: Number of synthetic users.
+        :param photo_count: Number of photos of each user.
+        :param latency_ms: Milliseconds to delay each call.
+        :param latency_jitter_ms: Maximum milliseconds to randomly add to the delay.
+        :param error_rate: Fraction of calls that get an HTTP 500.
+        :param throttle_rate: Fraction of calls that get a Flickr "Service currently unavailable" error.
+        :param quota: Calls per second, beyond which calls get an HTTP 429. If None, no quota.
+        :param seed: Seed for the synthetic photos and for injecting errors.
+        """
+        self.users = [SyntheticUser(index, photo_count, user_count=user_count, seed=seed)
+                      for index in range(user_count)]
+        self._users_by_nsid = {user.nsid: user for user in self.users}
+        self._users_by_username = {user.username: user for user in self.users}
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.quota = quota
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+        self._quota_second = None
+        self._quota_count = 0
+        # Counts of calls by method and response (ok, fail, or HTTP status)
+        self.stats = Counter()
+        self.secs = 0.0
+        self.bytes = 0
+
+    def call(self, params):
+        """
+        Answer a call.
+        :param params: Dict of the call's parameters.
+        :return: (HTTP status, JSON response or None)
+        """
+        start = time.monotonic()
+        method = params.get("method")
+        with self._lock:
+            error_draw = self._rand.random()
+            throttle_draw = self._rand.random()
+            delay_secs = (self.latency_ms + self._rand.uniform(0, self.latency_jitter_ms)) / 1000.0
+        if delay_secs:
+            time.sleep(delay_secs)
+
+        status, resp = 200, None
+        if self._over_quota():
+            status = 429
+        elif error_draw < self.error_rate:
+            status = 500
+        elif throttle_draw < self.throttle_rate:
+            resp = _fail(CODE_SERVICE_UNAVAILABLE, "Service currently unavailable")
+        else:
+            resp = self._answer(method, params)
+
+        with self._lock:
+            self.stats[(method, resp["stat"] if resp else status)] += 1
+            self.secs += time.monotonic() - start
+        return status, resp
+
+    def _over_quota(self):
+        if not self.quota:
+            return False
+        second = int(time.monotonic())
+        with self._lock:
+            if second != self._quota_second:
+                self._quota_second = second
+                self._quota_count = 0
+            self._quota_count += 1
+            return self._quota_count > self.quota
+
+    def _answer(self, method, params):
+        if method == "flickr.people.findByUsername":
+            user = self._users_by_username.get(params.get("username"))
+            if user is None:
+                return _fail(CODE_NOT_FOUND, "User not found")
+            return _ok(user={"id": user.nsid, "nsid": user.nsid, "username": {"_content": user.username}})
+        if method == "flickr.people.getInfo":
+            user = self._users_by_nsid.get(params.get("user_id"))
+            if user is None:
+                return _fail(CODE_NOT_FOUND, "User not found")
+            return _ok(person=user.person())
+        if method == "flickr.people.getPublicPhotos":
+            user = self._users_by_nsid.get(params.get("user_id"))
+            if user is None:
+                return _fail(CODE_NOT_FOUND, "User not found")
+            per_page = min(int(params.get("per_page") or PER_PAGE), MAX_PER_PAGE)
+            # Like Flickr, other parameters (e.g., min_upload_date) are ignored.
+            return _ok(photos=user.public_photos(int(params.get("page") or 1), per_page=per_page,
+                                                 extras=params.get("extras")))
+        if method in ("flickr.photos.getInfo", "flickr.photos.getSizes"):
+            user, number = self._photo(params.get("photo_id"))
+            if user is None:
+                return _fail(CODE_NOT_FOUND, "Photo not found")
+            if method == "flickr.photos.getInfo":
+                return _ok(photo=user.photo(number))
+            return _ok(sizes=user.sizes(number))
+        return _fail(CODE_METHOD_NOT_FOUND, "Method \"{}\" not found".format(method))
+
+    def _photo(self, photo_id):
+        """
+        Returns the user and the number of the photo with the id or (None, None) if there is no such photo.
+        """
+        try:
+            user = self.users[(int(photo_id) - FIRST_PHOTO_ID) % len(self.users)]
+        except (TypeError, ValueError):
+            return None, None
+        number = user.photo_number(photo_id)
+        return (user, number) if number is not None else (None, None)
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes += count
+
+    def stats_dict(self):
+        with self._lock:
+            stats = {}
+            for (method, response), count in self.stats.items():
+                stats.setdefault(method or "none", {})[str(response)] = count
+            return {"calls": stats, "calls_total": sum(self.stats.values()), "secs": self.secs,
+                    "bytes": self.bytes}
+
+
+def _ok(**resp):
+    resp["stat"] = "ok"
+    return resp
+
+
+def _fail(code, message):
+    return {"stat": "fail", "code": code, "message": message}
+
+
+class FlickrAPIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which otherwise stalls kept alive connections.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == STATS_PATH:
+            self._send(200, self.server.stand_in.stats_dict())
+        elif url.path == REST_PATH:
+            self._call(dict(parse_qsl(url.query)))
+        else:
+            self._send(404, None)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != REST_PATH:
+            self._send(404, None)
+            return
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update(parse_qsl(self.rfile.read(length).decode("utf-8")))
+        self._call(params)
+
+    def _call(self, params):
+        status, resp = self.server.stand_in.call(params)
+        self._send(status, resp)
+
+    def _send(self, status, resp):
+        body = json.dumps(resp).encode("utf-8") if resp is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stand_in.add_bytes(len(body))
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class FlickrAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, stand_in):
+        ThreadingHTTPServer.__init__(self, server_address, FlickrAPIRequestHandler)
+        self.stand_in = stand_in
+
+    @property
+    def rest_url(self):
+        return "http://{}:{}{}".format(self.server_address[0], self.server_address[1], REST_PATH)
+
+
+def start_server(host="localhost", port=0, **kwargs):
+    """
+    Start a stand-in server in a background thread.
+    :param port: Port to listen on. If 0, a free port is used.
+    :param kwargs: Arguments for FlickrStandIn.
+    :return: The server. Call shutdown() to stop it.
+    """
+    server = FlickrAPIServer((host, port), FlickrStandIn(**kwargs))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a stand-in for the Flickr API.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--users", type=int, default=10, help="Number of synthetic users.")
+    parser.add_argument("--photos", type=int, default=1000, help="Number of photos of each user.")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Milliseconds to delay each call.")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0,
+                        help="Maximum milliseconds to randomly add to the delay.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that get an HTTP 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Fraction of calls that get a Flickr \"Service currently unavailable\" error.")
+    parser.add_argument("--quota", type=int, help="Calls per second, beyond which calls get an HTTP 429.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s: %(name)s --> %(message)s",
+                        level=logging.DEBUG if args.debug else logging.INFO)
+    flickr_server = FlickrAPIServer((args.host, args.port), FlickrStandIn(
+        user_count=args.users, photo_count=args.photos, latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+        quota=args.quota, seed=args.seed))
+    log.info("Serving %s users with %s photos each at %s", args.users, args.photos, flickr_server.rest_url)
+    try:
+        flickr_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.info("Stats: %s", json.dumps(flickr_server.stand_in.stats_dict()))
+        flickr_server.server_close()
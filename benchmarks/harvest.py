@@ -0,0 +1,98 @@
+"""
+Load test harvesting against the local Flickr API stand-in (see benchmarks.flickr_api_server).
+
+Harvests all of the stand-in's synthetic users with each combination of photo and seed concurrency, reporting
+photos/s and calls/s. Injected latency makes the effect of concurrency visible, as with the real API.
+
+The harvester is run directly, without the message queue or warcprox. To record through warcprox, start it and pass
+its address with --proxy.
+
+Run from the root of the repo:
+
+    python -m benchmarks.harvest [--users 4] [--photos 250] [--latency-ms 50] [--concurrency 1 4 8]
+"""
+from __future__ import absolute_import
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+from benchmarks.flickr_api_server import start_server
+
+
+def harvest(rest_url, usernames, concurrency=1, seed_concurrency=1, per_page=None, lite=False, proxy=None):
+    """
+    Harvest the users with a new harvester.
+    :return: (photo count, seconds)
+    """
+    from flickr_harvester import FlickrHarvester
+    from sfmutils.harvester import HarvestResult
+    from sfmutils.state_store import DictHarvestStateStore
+
+    os.environ["FLICKR_REST_URL"] = rest_url
+    if proxy:
+        os.environ["HTTP_PROXY"] = os.environ["HTTPS_PROXY"] = proxy
+    working_path = tempfile.mkdtemp()
+    try:
+        harvester = FlickrHarvester(working_path, per_page=per_page)
+        harvester.state_store = DictHarvestStateStore()
+        harvester.result = HarvestResult()
+        harvester.message = {
+            "id": "benchmark",
+            "type": "flickr_user",
+            "seeds": [{"id": "seed{}".format(idx), "token": username} for idx, username in enumerate(usernames)],
+            "credentials": {"key": "benchmark", "secret": "benchmark"},
+            "options": {"concurrency": concurrency, "seed_concurrency": seed_concurrency, "incremental": False,
+                        "lite": lite}
+        }
+        start = time.perf_counter()
+        harvester.harvest_seeds()
+        return harvester.result.harvest_counter["flickr photos"], time.perf_counter() - start
+    finally:
+        shutil.rmtree(working_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test harvesting against a Flickr API stand-in.")
+    parser.add_argument("--users", type=int, default=4, help="Number of synthetic users.")
+    parser.add_argument("--photos", type=int, default=250, help="Number of photos of each user.")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Milliseconds to delay each call.")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--quota", type=int, help="Calls per second, beyond which calls get an HTTP 429.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="Photo concurrency values.")
+    parser.add_argument("--seed-concurrency", type=int, nargs="+", default=[1], help="Seed concurrency values.")
+    parser.add_argument("--per-page", type=int, help="Photos per listing page. Default is Flickr's.")
+    parser.add_argument("--lite", action="store_true", help="Lite harvests.")
+    parser.add_argument("--proxy", help="Proxy (e.g., warcprox) to record through, e.g., http://localhost:8000.")
+    args = parser.parse_args()
+
+    # Importing the test fixtures turns on debug logging, which would slow the harvest.
+    logging.disable(logging.INFO)
+    server = start_server(user_count=args.users, photo_count=args.photos, latency_ms=args.latency_ms,
+                          latency_jitter_ms=args.latency_jitter_ms, error_rate=args.error_rate,
+                          throttle_rate=args.throttle_rate, quota=args.quota)
+    usernames = [user.username for user in server.stand_in.users]
+    print("{} users with {} photos each, {}ms latency".format(args.users, args.photos, args.latency_ms))
+    print("{:>11} {:>16} {:>8} {:>9} {:>10} {:>9}".format("concurrency", "seed concurrency", "photos", "secs",
+                                                         "photos/s", "calls/s"))
+    try:
+        for seed_concurrency in args.seed_concurrency:
+            for concurrency in args.concurrency:
+                calls_start = server.stand_in.stats_dict()["calls_total"]
+                try:
+                    photo_count, secs = harvest(server.rest_url, usernames, concurrency=concurrency,
+                                                seed_concurrency=seed_concurrency, per_page=args.per_page,
+                                                lite=args.lite, proxy=args.proxy)
+                except Exception as e:
+                    # E.g., an injected error
+                    print("{:>11} {:>16} failed: {}".format(concurrency, seed_concurrency, e))
+                    continue
+                calls = server.stand_in.stats_dict()["calls_total"] - calls_start
+                print("{:>11} {:>16} {:>8} {:>9.2f} {:>10.1f} {:>9.1f}".format(
+                    concurrency, seed_concurrency, photo_count, secs, photo_count / secs, calls / secs))
+    finally:
+        server.shutdown()
+        server.server_close()
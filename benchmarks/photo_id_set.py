@@ -0,0 +1,79 @@
+"""
+Benchmark the memory used by and the throughput of PhotoIdSet, compared to a set of id strings.
+
+Ids are synthetic, random photo ids in the range of current Flickr photo ids. Memory is measured with tracemalloc,
+separately from throughput, since tracing slows allocation.
+
+Run from the root of the repo:
+
+    python -m benchmarks.photo_id_set [--ids 10000000]
+"""
+from __future__ import absolute_import
+import argparse
+import random
+import time
+import tracemalloc
+from photo_id_set import PhotoIdSet
+
+MAX_PHOTO_ID = 60000000000
+
+
+def photo_ids(count, seed=0):
+    rand = random.Random(seed)
+    for _ in range(count):
+        yield str(rand.randrange(1, MAX_PHOTO_ID))
+
+
+def dedupe_set(ids):
+    seen_ids = set()
+    for photo_id in ids:
+        if photo_id not in seen_ids:
+            seen_ids.add(photo_id)
+    return seen_ids
+
+
+def dedupe_photo_id_set(ids, max_memory_containers=None):
+    seen_ids = PhotoIdSet(max_memory_containers=max_memory_containers)
+    for photo_id in ids:
+        seen_ids.add(photo_id)
+    return seen_ids
+
+
+def measure_memory(func, count):
+    tracemalloc.start()
+    seen_ids = func(photo_ids(count))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seen_ids, current, peak
+
+
+def measure_secs(func, count):
+    # Generating the ids is excluded.
+    ids = list(photo_ids(count))
+    start = time.perf_counter()
+    seen_ids = func(ids)
+    add_secs = time.perf_counter() - start
+    start = time.perf_counter()
+    for photo_id in ids:
+        assert photo_id in seen_ids
+    return add_secs, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PhotoIdSet.")
+    parser.add_argument("--ids", type=int, default=10000000, help="Number of ids.")
+    parser.add_argument("--max-memory-containers", type=int,
+                        help="Spill PhotoIdSet containers to disk beyond this many.")
+    args = parser.parse_args()
+
+    for name, func in (("set", dedupe_set),
+                       ("PhotoIdSet", lambda ids: dedupe_photo_id_set(
+        ids, max_memory_containers=args.max_memory_containers))):
+        seen_ids, current, peak = measure_memory(func, args.ids)
+        length = len(seen_ids)
+        del seen_ids
+        add_secs, lookup_secs = measure_secs(func, args.ids)
+        print("{:<10} {:>10} ids {:>8.1f} MB ({:>6.1f} bytes/id, peak {:>8.1f} MB) add {:>7.2f}s "
+              "({:>9.0f} ids/s) lookup {:>7.2f}s ({:>9.0f} ids/s)".format(
+                  name, length, current / 1e6, current / length, peak / 1e6, add_secs, args.ids / add_secs,
+                  lookup_secs, args.ids / lookup_secs))
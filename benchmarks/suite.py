@@ -0,0 +1,204 @@
+"""
+Benchmark iterating over, processing and exporting synthetic Flickr WARCs.
+
+WARCs are written with benchmarks.synthetic and kept in the cache directory for later runs with the same
+arguments. Each benchmark runs in its own process, so that the peak memory (max RSS) reported is for that benchmark
+alone. Throughput is reported as photos/s and as MB/s of (compressed) WARCs read.
+
+Results can be saved and then compared against, e.g., to compare two commits:
+
+    git checkout <base> && python -m benchmarks.suite --photos 100000 --save base.json
+    git checkout <head> && python -m benchmarks.suite --photos 100000 --compare base.json
+
+Run from the root of the repo:
+
+    python -m benchmarks.suite [--photos 10000] [--users 10] [--benchmarks iterate export_csv ...]
+"""
+from __future__ import absolute_import
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import write_warcs
+
+EXPORT_FORMATS = ("csv", "tsv", "json", "xlsx", "parquet")
+BENCHMARKS = ("iterate", "iterate_dedupe", "process_warc") + tuple("export_{}".format(export_format)
+                                                                    for export_format in EXPORT_FORMATS)
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "sfm-flickr-benchmarks")
+
+
+def synthetic_warcs(cache_path, photo_count, user_count, photos_per_warc, seed):
+    """
+    Returns the filepaths of synthetic WARCs, writing them if they aren't already in the cache.
+    """
+    warc_path = os.path.join(cache_path, "{}-{}-{}-{}".format(photo_count, user_count, photos_per_warc, seed))
+    done_filepath = os.path.join(warc_path, "done")
+    if not os.path.exists(done_filepath):
+        shutil.rmtree(warc_path, ignore_errors=True)
+        print("Writing synthetic WARCs for {} photos to {}".format(photo_count, warc_path), file=sys.stderr)
+        write_warcs(warc_path, photo_count, user_count=user_count, photos_per_warc=photos_per_warc, seed=seed)
+        open(done_filepath, "w").close()
+    return sorted(os.path.join(warc_path, filename) for filename in os.listdir(warc_path)
+                  if filename.endswith(".warc.gz"))
+
+
+def iterate(warc_paths, output_path, dedupe=False):
+    from flickr_warc_iter import FlickrWarcIter, TYPE_FLICKR_PHOTO
+
+    count = 0
+    for _ in FlickrWarcIter(warc_paths).iter(limit_item_types=[TYPE_FLICKR_PHOTO], dedupe=dedupe):
+        count += 1
+    return count
+
+
+def process_warc(warc_paths, output_path):
+    from flickr_harvester import FlickrHarvester
+    from sfmutils.harvester import HarvestResult
+    from sfmutils.state_store import DictHarvestStateStore
+
+    harvester = FlickrHarvester(output_path)
+    harvester.state_store = DictHarvestStateStore()
+    harvester.result = HarvestResult()
+    harvester.message = {"options": {"incremental": True}}
+    for warc_path in warc_paths:
+        harvester.process_warc(warc_path)
+    return harvester.result.stats_summary().get("flickr photos", 0)
+
+
+def export(warc_paths, output_path, export_format):
+    """
+    Export as the exporter does, without the message queue.
+    """
+    from flickr_exporter import FlickrPhotoTable
+
+    table = FlickrPhotoTable(warc_paths, False, None, None, None)
+    filepath = os.path.join(output_path, "export.{}".format(export_format))
+    if export_format == "parquet":
+        table.to_parquet(lambda segment: filepath)
+    else:
+        import petl
+
+        # There is no segmenting, so there is a single table.
+        segment_table = petl.wrap(next(iter(table)))
+        if export_format == "csv":
+            petl.tocsv(segment_table, filepath)
+        elif export_format == "tsv":
+            petl.totsv(segment_table, filepath)
+        elif export_format == "json":
+            petl.tojson(segment_table, filepath, default=str)
+        else:
+            petl.toxlsx(segment_table, filepath)
+    return None
+
+
+def run_benchmark(name, warc_paths):
+    """
+    Run a benchmark in this process.
+    :return: Dict of the results.
+    """
+    output_path = tempfile.mkdtemp()
+    try:
+        if name.startswith("export_"):
+            func = lambda: export(warc_paths, output_path, name[len("export_"):])
+        elif name == "iterate_dedupe":
+            func = lambda: iterate(warc_paths, output_path, dedupe=True)
+        else:
+            func = lambda: globals()[name](warc_paths, output_path)
+        start = time.perf_counter()
+        count = func()
+        secs = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_path, ignore_errors=True)
+    # ru_maxrss is KB on Linux, bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {"secs": secs, "count": count, "max_rss": max_rss}
+
+
+def run(name, warc_paths, photo_count):
+    """
+    Run a benchmark in a new process.
+    :return: Dict of the results or None if the benchmark couldn't run (e.g., a dependency is missing).
+    """
+    process = subprocess.run([sys.executable, "-m", "benchmarks.suite", "--run", name] + warc_paths,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        print("{} failed: {}".format(name, (process.stderr.strip().splitlines() or ["unknown error"])[-1]),
+              file=sys.stderr)
+        return None
+    result = json.loads(process.stdout)
+    # Exports don't count rows, so use the number of photos written.
+    if result["count"] is None:
+        result["count"] = photo_count
+    warc_bytes = sum(os.path.getsize(warc_path) for warc_path in warc_paths)
+    result["photos_per_sec"] = result["count"] / result["secs"]
+    result["mb_per_sec"] = warc_bytes / 1e6 / result["secs"]
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print("{:<16} {:>10} {:>9} {:>12} {:>9} {:>11}{}".format("benchmark", "photos", "secs", "photos/s", "MB/s",
+                                                          "max RSS MB", "  vs baseline" if baseline else ""))
+    for name, result in results.items():
+        if result is None:
+            print("{:<16} {:>10}".format(name, "skipped"))
+            continue
+        line = "{:<16} {:>10} {:>9.2f} {:>12.0f} {:>9.2f} {:>11.1f}".format(
+            name, result["count"], result["secs"], result["photos_per_sec"], result["mb_per_sec"],
+            result["max_rss"] / 1e6)
+        baseline_result = (baseline or {}).get(name)
+        if baseline_result:
+            # Greater than 1 is better: faster or less memory.
+            line += "  {:>6.2f}x speed {:>6.2f}x memory".format(
+                result["photos_per_sec"] / baseline_result["photos_per_sec"],
+                baseline_result["max_rss"] / result["max_rss"])
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Flickr WARC iteration, processing and exports.")
+    parser.add_argument("--photos", type=int, default=10000, help="Number of synthetic photos.")
+    parser.add_argument("--users", type=int, default=10, help="Number of synthetic users.")
+    parser.add_argument("--photos-per-warc", type=int, default=100000, help="Number of photos in each WARC.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic photos.")
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS,
+                        help="Benchmarks to run. Default is all.")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="Directory to cache synthetic WARCs in.")
+    parser.add_argument("--save", help="Save the results as JSON to this file.")
+    parser.add_argument("--compare", help="Compare against results saved to this file.")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("warc_paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # Importing the test fixtures turns on debug logging, which would slow the benchmarks.
+        logging.disable(logging.INFO)
+        print(json.dumps(run_benchmark(args.run, args.warc_paths)))
+        sys.exit()
+
+    warc_paths = synthetic_warcs(args.cache_path, args.photos, args.users, args.photos_per_warc, args.seed)
+    results = {name: run(name, warc_paths, args.photos) for name in args.benchmarks}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print("{} photos, commit {}".format(args.photos, git_commit()))
+    print_results(results, baseline=baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"commit": git_commit(), "photos": args.photos, "users": args.users,
+                       "photos_per_warc": args.photos_per_warc, "seed": args.seed, "python": sys.version,
+                       "results": results}, f, indent=2)
@@ -0,0 +1,263 @@
+"""
+Synthetic Flickr users, photos and WARCs for benchmarks and load tests.
+
+Photos and sizes are modeled on the fixtures in tests/photo.py, with ids, owners, dates, titles and descriptions
+varied by a seeded random generator, so the same arguments always produce the same data.
+
+To write synthetic WARCs, run from the root of the repo:
+
+    python -m benchmarks.synthetic <directory> --photos 100000 [--users 10] [--photos-per-warc 100000]
+"""
+from __future__ import absolute_import
+import argparse
+import json
+import os
+import random
+from datetime import datetime
+from io import BytesIO
+from urllib.parse import urlencode
+import pytz
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+from tests.photo import photo1, size1
+
+REST_URL = "https://api.flickr.com/services/rest/"
+# Photo ids are assigned in increasing order, as Flickr does, starting here.
+FIRST_PHOTO_ID = 16000000000
+# Posted dates start here, with photos posted about every 10 minutes.
+FIRST_POSTED = 1426191773
+POSTED_INTERVAL_SECS = 600
+PER_PAGE = 100
+WORDS = ("flickr", "photo", "library", "archive", "campus", "street", "river", "sunset", "portrait", "history",
+         "event", "museum", "garden", "city", "winter", "summer", "parade", "building", "collection", "digital")
+
+_PHOTO_TEMPLATE = json.dumps(photo1)
+_SIZES_TEMPLATE = json.dumps(size1)
+
+
+class SyntheticUser(object):
+    """
+    A synthetic Flickr user with photo_count photos.
+
+    Photos are numbered from 0, oldest first. Photo ids are interleaved across users, so that the photos of all users
+    have distinct ids.
+    """
+
+    def __init__(self, index, photo_count, user_count=1, seed=0):
+        self.index = index
+        self.photo_count = photo_count
+        self.user_count = user_count
+        self.seed = seed
+        self.nsid = "{}@N0{}".format(100000000 + index, index % 10)
+        self.username = "synthetic.user{}".format(index)
+
+    def photo_id(self, number):
+        return str(FIRST_PHOTO_ID + number * self.user_count + self.index)
+
+    def photo_number(self, photo_id):
+        """
+        Returns the number of the photo with the id or None if it isn't one of the user's photos.
+        """
+        offset = int(photo_id) - FIRST_PHOTO_ID - self.index
+        if offset < 0 or offset % self.user_count:
+            return None
+        number = offset // self.user_count
+        return number if number < self.photo_count else None
+
+    def _rand(self, number):
+        return random.Random("{}:{}:{}".format(self.seed, self.index, number))
+
+    def secret(self, number):
+        return "{:010x}".format(self._rand(number).getrandbits(40))
+
+    def posted(self, number):
+        return FIRST_POSTED + number * POSTED_INTERVAL_SECS
+
+    def person(self):
+        """
+        Returns the person, as from people.getInfo.
+        """
+        return {
+            "id": self.nsid,
+            "nsid": self.nsid,
+            "ispro": 0,
+            "iconserver": "0",
+            "iconfarm": 0,
+            "path_alias": None,
+            "username": {"_content": self.username},
+            "realname": {"_content": "Synthetic User {}".format(self.index)},
+            "location": {"_content": ""},
+            "photosurl": {"_content": "https://www.flickr.com/photos/{}/".format(self.nsid)},
+            "profileurl": {"_content": "https://www.flickr.com/people/{}/".format(self.nsid)},
+            "photos": {"firstdate": {"_content": str(self.posted(0))}, "count": {"_content": self.photo_count}}
+        }
+
+    def photo(self, number):
+        """
+        Returns the photo, as from photos.getInfo.
+        """
+        rand = self._rand(number)
+        photo_id = self.photo_id(number)
+        posted = str(self.posted(number))
+        photo = json.loads(_PHOTO_TEMPLATE)
+        photo["id"] = photo_id
+        photo["secret"] = self.secret(number)
+        photo["dateuploaded"] = posted
+        photo["owner"]["nsid"] = self.nsid
+        photo["owner"]["username"] = self.username
+        photo["owner"]["realname"] = "Synthetic User {}".format(self.index)
+        photo["title"]["_content"] = " ".join(rand.choice(WORDS) for _ in range(rand.randint(1, 6)))
+        photo["description"]["_content"] = " ".join(rand.choice(WORDS) for _ in range(rand.randint(0, 60)))
+        photo["tags"]["tag"] = [{"id": "{}-{}".format(photo_id, tag_index), "author": self.nsid, "raw": tag,
+                                 "_content": tag, "machine_tag": 0}
+                                for tag_index, tag in enumerate(rand.sample(WORDS, rand.randint(0, 8)))]
+        photo["views"] = str(rand.randint(0, 10000))
+        photo["license"] = str(rand.randint(0, 10))
+        photo["dates"]["posted"] = posted
+        photo["dates"]["lastupdate"] = str(self.lastupdate(number))
+        photo["dates"]["taken"] = datetime.fromtimestamp(self.posted(number) - rand.randint(0, 86400 * 30),
+                                                         tz=pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
+        photo["urls"]["url"][0]["_content"] = "https://www.flickr.com/photos/{}/{}/".format(self.nsid, photo_id)
+        return photo
+
+    def sizes(self, number):
+        """
+        Returns the sizes of the photo, as from photos.getSizes.
+        """
+        return json.loads(_SIZES_TEMPLATE.replace(photo1["id"], self.photo_id(number)).replace(
+            photo1["secret"], self.secret(number)).replace(photo1["owner"]["nsid"], self.nsid))
+
+    def lastupdate(self, number):
+        return self.posted(number) + random.Random("{}:{}:{}:lastupdate".format(self.seed, self.index,
+                                                                               number)).randint(0, 86400)
+
+    def public_photos(self, page, per_page=PER_PAGE, extras=None):
+        """
+        Returns a page of public photos, most recently posted first, as from people.getPublicPhotos.
+        :param extras: Comma separated extras. last_update adds lastupdate; any other adds the extras used for lite
+        harvests.
+        """
+        pages = (self.photo_count + per_page - 1) // per_page
+        extras = set(extras.split(",")) if extras else set()
+        photos = []
+        for number in range(self.photo_count - 1 - (page - 1) * per_page,
+                            max(self.photo_count - 1 - page * per_page, -1), -1):
+            list_photo = {
+                "id": self.photo_id(number),
+                "owner": self.nsid,
+                "secret": self.secret(number),
+                "server": "8710",
+                "farm": 9,
+                "title": "",
+                "ispublic": 1,
+                "isfriend": 0,
+                "isfamily": 0
+            }
+            if "last_update" in extras:
+                list_photo["lastupdate"] = str(self.lastupdate(number))
+            if extras - {"last_update"}:
+                photo = self.photo(number)
+                list_photo.update({
+                    "title": photo["title"]["_content"],
+                    "license": photo["license"],
+                    "description": photo["description"],
+                    "originalsecret": photo["originalsecret"],
+                    "originalformat": photo["originalformat"],
+                    "dateupload": photo["dateuploaded"],
+                    "lastupdate": photo["dates"]["lastupdate"],
+                    "datetaken": photo["dates"]["taken"],
+                    "datetakengranularity": "0",
+                    "datetakenunknown": "0",
+                    "ownername": self.username,
+                    "media": photo["media"],
+                    "media_status": "ready",
+                    "pathalias": None,
+                    "url_o": "https://farm9.staticflickr.com/8710/{}_{}_o.jpg".format(photo["id"],
+                                                                                      photo["originalsecret"]),
+                    "height_o": "3264",
+                    "width_o": "4928"
+                })
+            photos.append(list_photo)
+        return {"page": page, "pages": pages, "perpage": per_page, "total": self.photo_count, "photo": photos}
+
+
+def rest_url(method, **params):
+    params["method"] = method
+    params["format"] = "json"
+    params["nojsoncallback"] = 1
+    return "{}?{}".format(REST_URL, urlencode(sorted(params.items())))
+
+
+def write_response(writer, url, obj):
+    """
+    Write a response record for a call to the Flickr API.
+    :return: Number of bytes of the payload.
+    """
+    payload = json.dumps(obj).encode("utf-8")
+    http_headers = StatusAndHeaders("200 OK", [("Content-Type", "application/json"),
+                                               ("Content-Length", str(len(payload)))], protocol="HTTP/1.1")
+    record = writer.create_warc_record(url, "response", payload=BytesIO(payload), http_headers=http_headers)
+    writer.write_record(record)
+    return len(payload)
+
+
+def write_warcs(directory, photo_count, user_count=1, photos_per_warc=100000, seed=0, per_page=PER_PAGE):
+    """
+    Write WARCs for a harvest of synthetic users, with photo_count photos split across the users.
+
+    Each user's info and listing pages are followed by a getInfo and a getSizes response for each photo, as
+    recorded by the harvester. A new WARC is started every photos_per_warc photos.
+    :return: List of the WARC filepaths.
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    filepaths = []
+    writer = None
+    f = None
+    warc_photo_count = 0
+    try:
+        for user_index in range(user_count):
+            user = SyntheticUser(user_index, photo_count // user_count + (1 if user_index < photo_count % user_count
+                                                                             else 0), user_count=user_count, seed=seed)
+            for number in range(user.photo_count - 1, -1, -1):
+                if writer is None or warc_photo_count == photos_per_warc:
+                    if f is not None:
+                        f.close()
+                    filepaths.append(os.path.join(directory, "synthetic-{}.warc.gz".format(str(len(filepaths))
+                                                                                          .zfill(5))))
+                    f = open(filepaths[-1], "wb")
+                    writer = WARCWriter(f, gzip=True)
+                    warc_photo_count = 0
+                if number == user.photo_count - 1:
+                    write_response(writer, rest_url("flickr.people.getInfo", user_id=user.nsid),
+                                   {"person": user.person(), "stat": "ok"})
+                if (user.photo_count - 1 - number) % per_page == 0:
+                    page = (user.photo_count - 1 - number) // per_page + 1
+                    write_response(writer, rest_url("flickr.people.getPublicPhotos", user_id=user.nsid, page=page,
+                                                    per_page=per_page),
+                                   {"photos": user.public_photos(page, per_page=per_page), "stat": "ok"})
+                photo_id = user.photo_id(number)
+                write_response(writer, rest_url("flickr.photos.getInfo", photo_id=photo_id,
+                                                secret=user.secret(number)),
+                               {"photo": user.photo(number), "stat": "ok"})
+                write_response(writer, rest_url("flickr.photos.getSizes", photo_id=photo_id),
+                               {"sizes": user.sizes(number), "stat": "ok"})
+                warc_photo_count += 1
+    finally:
+        if f is not None:
+            f.close()
+    return filepaths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic Flickr WARCs.")
+    parser.add_argument("directory", help="Directory to write the WARCs to.")
+    parser.add_argument("--photos", type=int, default=1000, help="Number of photos.")
+    parser.add_argument("--users", type=int, default=1, help="Number of users the photos are split across.")
+    parser.add_argument("--photos-per-warc", type=int, default=100000, help="Number of photos in each WARC.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random values of photos.")
+    args = parser.parse_args()
+
+    for warc_filepath in write_warcs(args.directory, args.photos, user_count=args.users,
+                                     photos_per_warc=args.photos_per_warc, seed=args.seed):
+        print(warc_filepath)
@@ -0,0 +1,384 @@
+from __future__ import absolute_import
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+import flickrapi
+import requests
+from flickrapi.auth import OAuthFlickrInterface
+from flickrapi.exceptions import FlickrError
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+# Flickr API error codes that indicate the call should be retried later.
+# 105 is "Service currently unavailable".
+THROTTLE_ERROR_CODES = (105,)
+# HTTP status codes that indicate the call should be retried later.
+THROTTLE_STATUS_CODES = (429, 503)
+
+INITIAL_BACKOFF_SECS = 1.0
+MAX_BACKOFF_SECS = 60.0
+
+# Upper bounds, in seconds, of the buckets of the call latency histograms
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFAULT_POOL_SIZE = 10
+# Number of times to retry a request when the connection fails or is reset.
+CONNECTION_RETRIES = 3
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, retries=CONNECTION_RETRIES):
+    """
+    Create a requests session that keeps connections alive in a pool.
+    :param pool_size: Maximum number of connections kept per host. Should be at least the number of threads making
+    calls.
+    :param retries: Number of times to retry a request on connection errors and resets.
+    """
+    session = requests.Session()
+    mount_pool(session, pool_size, retries=retries)
+    return session
+
+
+def mount_pool(session, pool_size, retries=CONNECTION_RETRIES):
+    """
+    Mount a connection pool of pool_size on the session, replacing any existing pool.
+    """
+    # Flickr API methods used by the harvester are read-only, so it is safe to retry POSTs.
+    retry = Retry(total=retries, connect=retries, read=retries, status=0, method_whitelist=False,
+                  backoff_factor=0.5)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    for prefix in ("https://", "http://"):
+        old_adapter = session.adapters.get(prefix)
+        session.mount(prefix, adapter)
+        if old_adapter is not None:
+            old_adapter.close()
+    session.pool_size = pool_size
+
+
+class SessionOAuthFlickrInterface(OAuthFlickrInterface):
+    """
+    OAuthFlickrInterface that makes calls with a shared session.
+
+    flickrapi closes the connection after every call; this keeps them alive for reuse.
+    """
+
+    def __init__(self, api_key, api_secret, oauth_token=None, session=None, metrics=None):
+        """
+        :param metrics: ApiMetrics to record calls in. If None, calls are not recorded.
+        """
+        OAuthFlickrInterface.__init__(self, api_key, api_secret, oauth_token)
+        self.session = session or create_session()
+        self.metrics = metrics
+        # Bytes of the last response, by thread
+        self.local = threading.local()
+
+    def do_request(self, url, params=None):
+        start = time.monotonic()
+        try:
+            resp = self.session.post(url, params=params, auth=self.oauth)
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.record((params or {}).get("method"), time.monotonic() - start, 0,
+                                    error=type(e).__name__)
+            raise
+
+        self.local.last_response_bytes = len(resp.content)
+        if self.metrics is not None:
+            self.metrics.record((params or {}).get("method"), time.monotonic() - start, len(resp.content),
+                                error=None if resp.status_code == 200 else "http_{}".format(resp.status_code))
+
+        if resp.status_code != 200:
+            self.log.error("do_request: Status code %i received", resp.status_code)
+            raise FlickrError("do_request: Status code %s received" % resp.status_code)
+
+        return resp.content
+
+
+class ApiMetrics(object):
+    """
+    Thread-safe counts, latencies, response bytes and errors of calls, by API method.
+
+    Latency is the time of the HTTP request (including any proxy, e.g., warcprox), not time spent waiting on the rate
+    limit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Map of method to MethodMetrics
+        self.methods = {}
+
+    def record(self, method, secs, response_bytes, error=None):
+        with self._lock:
+            self._method(method).record(secs, response_bytes, error)
+
+    def record_error(self, method, error):
+        """
+        Record an error returned by the API in a call that has already been recorded, e.g., {"stat": "fail"}.
+        """
+        with self._lock:
+            self._method(method).errors[str(error)] += 1
+
+    def _method(self, method):
+        method_metrics = self.methods.get(method)
+        if method_metrics is None:
+            method_metrics = self.methods[method] = MethodMetrics()
+        return method_metrics
+
+    def merge(self, other):
+        """
+        Add the metrics of another ApiMetrics to these.
+        """
+        with self._lock:
+            for method, other_method_metrics in other.methods.items():
+                self._method(method).merge(other_method_metrics)
+
+    def summary(self):
+        """
+        Returns a dict of method to dict of count, secs, avg_secs, bytes and errors.
+        """
+        with self._lock:
+            return {method: {
+                "count": method_metrics.count,
+                "secs": round(method_metrics.secs, 3),
+                "avg_secs": round(method_metrics.secs / method_metrics.count, 3) if method_metrics.count else 0.0,
+                "bytes": method_metrics.bytes,
+                "errors": dict(method_metrics.errors)
+            } for method, method_metrics in sorted(self.methods.items())}
+
+    def summary_message(self):
+        """
+        Returns a one line summary, e.g., for the harvest result.
+        """
+        return "; ".join("{}: {} calls, {:.0f}ms avg, {:.1f}KB{}".format(
+            method, method_summary["count"], method_summary["avg_secs"] * 1000, method_summary["bytes"] / 1000.0,
+            ", errors {}".format(method_summary["errors"]) if method_summary["errors"] else "")
+            for method, method_summary in self.summary().items())
+
+    def prometheus_text(self, extra_metrics=None):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        :param extra_metrics: List of (name, type, help, value) of other metrics to include.
+        """
+        lines = []
+
+        def header(name, metric_type, help_text):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+
+        with self._lock:
+            methods = sorted(self.methods.items())
+            header("flickr_api_calls_total", "counter", "Calls to the Flickr API.")
+            for method, method_metrics in methods:
+                lines.append('flickr_api_calls_total{{method="{}"}} {}'.format(method, method_metrics.count))
+            header("flickr_api_call_duration_seconds", "histogram", "Latency of calls to the Flickr API.")
+            for method, method_metrics in methods:
+                cumulative_count = 0
+                for le, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), method_metrics.buckets):
+                    cumulative_count += bucket_count
+                    lines.append('flickr_api_call_duration_seconds_bucket{{method="{}",le="{}"}} {}'.format(
+                        method, le, cumulative_count))
+                lines.append('flickr_api_call_duration_seconds_sum{{method="{}"}} {}'.format(
+                    method, method_metrics.secs))
+                lines.append('flickr_api_call_duration_seconds_count{{method="{}"}} {}'.format(
+                    method, method_metrics.count))
+            header("flickr_api_response_bytes_total", "counter", "Bytes of responses from the Flickr API.")
+            for method, method_metrics in methods:
+                lines.append('flickr_api_response_bytes_total{{method="{}"}} {}'.format(method, method_metrics.bytes))
+            header("flickr_api_errors_total", "counter", "Errors from the Flickr API, by Flickr error code or HTTP "
+                                                         "status.")
+            for method, method_metrics in methods:
+                for error, count in sorted(method_metrics.errors.items()):
+                    lines.append('flickr_api_errors_total{{method="{}",code="{}"}} {}'.format(method, error, count))
+        for name, metric_type, help_text, value in extra_metrics or ():
+            header(name, metric_type, help_text)
+            lines.append("{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+
+class MethodMetrics(object):
+    def __init__(self):
+        self.count = 0
+        self.secs = 0.0
+        self.bytes = 0
+        # Counts of calls by latency bucket. The last bucket is for calls slower than all of LATENCY_BUCKETS.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.errors = Counter()
+
+    def record(self, secs, response_bytes, error=None):
+        self.count += 1
+        self.secs += secs
+        self.bytes += response_bytes
+        self.buckets[bisect_left(LATENCY_BUCKETS, secs)] += 1
+        if error:
+            self.errors[error] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.secs += other.secs
+        self.bytes += other.bytes
+        self.buckets = [count + other_count for count, other_count in zip(self.buckets, other.buckets)]
+        self.errors.update(other.errors)
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket for pacing calls.
+
+    Tokens are reserved under a lock, so callers may run the bucket into debt. Each caller then sleeps
+    (outside the lock) until its token would have been added.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: Tokens added per second.
+        :param burst: Maximum number of tokens that may accumulate.
+        """
+        assert rate > 0
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        # Total seconds spent waiting for tokens, across all callers.
+        self.wait_secs = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is available.
+        :return: Seconds waited.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            wait_secs = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.wait_secs += wait_secs
+        if wait_secs:
+            time.sleep(wait_secs)
+        return wait_secs
+
+    def pause(self, secs):
+        """
+        Drain the bucket so that no caller gets a token for at least secs.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0) - secs * self.rate
+
+
+class FlickrAPI(flickrapi.FlickrAPI):
+    """
+    FlickrAPI that paces calls with a token bucket and backs off when Flickr throttles.
+
+    A single instance is shared by all seeds and threads of a harvest, so the limit applies to the API key.
+    """
+
+    def __init__(self, api_key, secret, rate_limit=None, rate_limit_burst=1, throttle_tries=5, session=None,
+                 rest_url=None, **kwargs):
+        """
+        :param rate_limit: Calls per second. If None, calls are not paced.
+        :param rate_limit_burst: Number of calls that may be made at once after being idle.
+        :param throttle_tries: Number of times to try a call that is throttled.
+        :param session: requests session to make calls with. If None, a session is created.
+        :param rest_url: URL of the Flickr REST API, e.g., of a stand-in for load testing. Default is the
+        FLICKR_REST_URL environment variable or Flickr's.
+        """
+        flickrapi.FlickrAPI.__init__(self, api_key, secret, **kwargs)
+        self.REST_URL = rest_url or os.environ.get("FLICKR_REST_URL") or self.REST_URL
+        # Calls since reset_stats()
+        self.metrics = ApiMetrics()
+        self.flickr_oauth = SessionOAuthFlickrInterface(api_key, secret, self.token_cache, session=session,
+                                                        metrics=self.metrics)
+        self.credentials = (api_key, secret)
+        self.bucket = None
+        self.set_rate_limit(rate_limit, rate_limit_burst)
+        self.throttle_tries = throttle_tries
+        self._throttle_lock = threading.Lock()
+        # Seconds spent backing off after throttle responses
+        self.throttle_wait_secs = 0.0
+        self.throttle_count = 0
+
+    def set_rate_limit(self, rate_limit, rate_limit_burst=1):
+        """
+        Change the rate limit. The bucket is kept if the rate limit is unchanged, so that the quota is shared when
+        the API is reused.
+        """
+        if not rate_limit:
+            self.bucket = None
+        elif not self.bucket or self.bucket.rate != rate_limit or self.bucket.burst != rate_limit_burst:
+            self.bucket = TokenBucket(rate_limit, rate_limit_burst)
+
+    def reset_stats(self):
+        """
+        Reset the wait and throttle statistics and the metrics, e.g., before reusing the API for another harvest.
+        """
+        self.metrics = self.flickr_oauth.metrics = ApiMetrics()
+        with self._throttle_lock:
+            self.throttle_wait_secs = 0.0
+            self.throttle_count = 0
+        if self.bucket:
+            self.bucket.wait_secs = 0.0
+
+    @property
+    def last_response_bytes(self):
+        """
+        Bytes of the last response received by the calling thread.
+        """
+        return getattr(self.flickr_oauth.local, "last_response_bytes", 0)
+
+    @property
+    def wait_secs(self):
+        """
+        Total seconds spent waiting on the rate limit and backing off.
+        """
+        # When there is a bucket, backing off is done by pausing the bucket.
+        return self.bucket.wait_secs if self.bucket else self.throttle_wait_secs
+
+    def do_flickr_call(self, method_name, **kwargs):
+        backoff_secs = INITIAL_BACKOFF_SECS
+        for tries in range(1, self.throttle_tries + 1):
+            if self.bucket:
+                self.bucket.acquire()
+            try:
+                resp = flickrapi.FlickrAPI.do_flickr_call(self, method_name, **kwargs)
+                if isinstance(resp, dict) and resp.get("stat") == "fail":
+                    self.metrics.record_error(method_name, resp.get("code"))
+                if not _is_throttle_response(resp) or tries == self.throttle_tries:
+                    return resp
+            except FlickrError as e:
+                if not _is_throttle_error(e) or tries == self.throttle_tries:
+                    raise
+            log.warning("Calling %s was throttled. Backing off for %s seconds.", method_name, backoff_secs)
+            self._backoff(backoff_secs)
+            backoff_secs = min(backoff_secs * 2, MAX_BACKOFF_SECS)
+
+    def _backoff(self, secs):
+        with self._throttle_lock:
+            self.throttle_wait_secs += secs
+            self.throttle_count += 1
+        if self.bucket:
+            # Hold back the other threads as well. The next acquire() waits out the pause.
+            self.bucket.pause(secs)
+        else:
+            time.sleep(secs)
+
+
+def _is_throttle_response(resp):
+    return isinstance(resp, dict) and resp.get("stat") == "fail" and resp.get("code") in THROTTLE_ERROR_CODES
+
+
+def _is_throttle_error(e):
+    if e.code in THROTTLE_ERROR_CODES:
+        return True
+    # flickrapi reports unexpected HTTP status codes only in the message.
+    match = re.search(r"Status code (\d+) received", str(e))
+    return bool(match) and int(match.group(1)) in THROTTLE_STATUS_CODES
@@ -1,52 +1,479 @@
-from sfmutils.exporter import BaseExporter, BaseTable
-from flickr_warc_iter import FlickrWarcIter, TYPE_FLICKR_PHOTO
+from sfmutils.exporter import BaseExporter, BaseTable, ExportResult, CODE_UNSUPPORTED_EXPORT_FORMAT, CODE_NO_WARCS
+from sfmutils.result import Msg, STATUS_SUCCESS, STATUS_FAILURE, STATUS_RUNNING
+from sfmutils.utils import datetime_now
+from flickr_warc_iter import FlickrWarcIter, TYPE_FLICKR_PHOTO, TYPE_FLICKR_PHOTO_LITE
+from profiling import profiled, profile_enabled
+import iso8601
+import itertools
+import json
 import logging
+import multiprocessing
+import os
+import petl
+import re
+import shutil
 import time
+from datetime import datetime
+from functools import lru_cache
 from dateutil.parser import parse as date_parse
 from dateutil.tz import tzutc
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 log = logging.getLogger(__name__)
 
 QUEUE = "flickr_exporter"
 ROUTING_KEY = "export.start.flickr.flickr_user"
 
+# Fields of a getInfo photo that are read by FlickrPhotoTable._row, e.g., for the fields of a FlickrWarcIter
+ROW_FIELDS = ("id", "dates", "license", "safety_level", "originalformat", "owner", "title", "description", "media",
+              "urls")
+
+# Format of date taken, e.g., 2013-03-26 05:50:01
+TAKEN_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})", re.ASCII)
+UTC = tzutc()
+
+PARQUET_FORMAT = "parquet"
+CODE_PARQUET_EXPORT_ERROR = "parquet_export_error"
+CODE_EXPORT_ERROR = "export_error"
+PARQUET_COMPRESSION = "zstd"
+# Number of rows converted to columns at a time
+PARQUET_BATCH_SIZE = 10000
+
+
+@lru_cache(maxsize=4096)
+def posted_date(posted):
+    """
+    Returns the UTC datetime for a date posted, which is gmt epoch time.
+
+    See https://www.flickr.com/services/api/misc.dates.html
+    """
+    return datetime(*time.gmtime(float(posted))[:6], tzinfo=UTC)
+
+
+@lru_cache(maxsize=4096)
+def taken_date(taken):
+    """
+    Returns the datetime for a date taken.
+
+    Dates that aren't in the usual format are parsed with dateutil.
+    """
+    match = TAKEN_RE.fullmatch(taken)
+    if match:
+        try:
+            return datetime(*map(int, match.groups()))
+        except ValueError:
+            pass
+    return date_parse(taken)
+
 
 class FlickrPhotoTable(BaseTable):
     """
     PETL Table for Flickr photos.
     """
 
-    def __init__(self, warc_paths, dedupe, item_date_start, item_date_end, seed_uids, segment_row_size=None):
+    def __init__(self, warc_paths, dedupe, item_date_start, item_date_end, seed_uids, segment_row_size=None,
+                 shard=None, processes=None):
+        """
+        :param shard: Tuple of shard index and number of shards. If provided, only the photos in the shard are rows.
+        :param processes: Number of worker processes for parsing WARC files. Default is the warc iter's default.
+        """
+        self.shard = shard
+        self.processes = processes
         BaseTable.__init__(self, warc_paths, dedupe, item_date_start, item_date_end, seed_uids, FlickrWarcIter,
-                           segment_row_size=segment_row_size, limit_item_types=[TYPE_FLICKR_PHOTO])
+                           segment_row_size=segment_row_size,
+                           limit_item_types=[TYPE_FLICKR_PHOTO, TYPE_FLICKR_PHOTO_LITE])
 
     def _header_row(self):
         return ("photo_id", "date_posted", "date_taken", "license", "safety_level", "original_format", "owner_nsid",
                 "owner_username", "title", "description", "media", "photopage")
 
     def _row(self, item):
+        if "dates" not in item:
+            return self._lite_row(item)
         photopage_url = None
-        for url in item["urls"]["url"]:
+        # Last photopage url wins
+        for url in reversed(item["urls"]["url"]):
             if url["type"] == "photopage":
                 photopage_url = url["_content"]
-        return (item["id"],
-                # date posted is gmt epoch time, convert it to the same format as date taken
-                # detail as https://www.flickr.com/services/api/misc.dates.html
-                date_parse(time.strftime("%Y-%m-%d %H:%M:%S",
-                                         time.gmtime(float(item["dates"]["posted"])))).replace(tzinfo=tzutc()),
-                date_parse(item["dates"]["taken"]), item["license"], item["safety_level"],
-                item.get("originalformat"), item["owner"]["nsid"], item["owner"]["username"],
+                break
+        dates = item["dates"]
+        return (item["id"], posted_date(dates["posted"]), taken_date(dates["taken"]), item["license"],
+                item["safety_level"], item.get("originalformat"), item["owner"]["nsid"], item["owner"]["username"],
                 item["title"]["_content"].replace('\n', ' '),
                 item["description"]["_content"].replace('\n', ' '), item["media"], photopage_url)
 
+    @staticmethod
+    def _lite_row(item):
+        """
+        Row for a photo from a listing page captured by a lite harvest.
+
+        Safety level is not available from listing pages.
+        """
+        return (item["id"], posted_date(item["dateupload"]), taken_date(item["datetaken"]), item["license"], None,
+                item.get("originalformat"), item["owner"], item["ownername"],
+                item["title"].replace('\n', ' '),
+                item["description"]["_content"].replace('\n', ' '), item["media"],
+                "https://www.flickr.com/photos/{}/{}/".format(item.get("pathalias") or item["owner"], item["id"]))
+
     def id_field(self):
         return "photo_id"
 
+    @staticmethod
+    def parquet_schema():
+        """
+        Returns the pyarrow schema for rows, with the same fields as the header row.
+        """
+        return pyarrow.schema([
+            ("photo_id", pyarrow.string()),
+            ("date_posted", pyarrow.timestamp("us", tz="UTC")),
+            # Date taken is in the photographer's local time.
+            ("date_taken", pyarrow.timestamp("us")),
+            ("license", pyarrow.int32()),
+            ("safety_level", pyarrow.int32()),
+            ("original_format", pyarrow.string()),
+            ("owner_nsid", pyarrow.string()),
+            ("owner_username", pyarrow.string()),
+            ("title", pyarrow.string()),
+            ("description", pyarrow.string()),
+            ("media", pyarrow.string()),
+            ("photopage", pyarrow.string())
+        ])
+
+    def rows(self):
+        """
+        Returns the rows, without a header row or segmenting.
+        """
+        warc_iter = FlickrWarcIter(self.warc_paths, self.seed_uids, shard=self.shard, processes=self.processes)
+        for item in warc_iter.iter(dedupe=self.dedupe, item_date_start=self.item_date_start,
+                                   item_date_end=self.item_date_end,
+                                   limit_item_types=[TYPE_FLICKR_PHOTO, TYPE_FLICKR_PHOTO_LITE]):
+            yield self._row(item.item)
+
+    def to_parquet(self, filepath_fn, compression=PARQUET_COMPRESSION, batch_size=PARQUET_BATCH_SIZE,
+                   write_empty=True):
+        """
+        Writes the rows to Parquet files, starting a new file every segment_row_size rows.
+
+        Rows are converted to columns a batch at a time, so memory is bounded by batch_size.
+        :param filepath_fn: Function that returns the filepath for a segment number, starting with 1.
+        :param write_empty: Write a file even if there are no rows.
+        :return: List of the filepaths written.
+        """
+        return write_parquet(self.rows(), self.parquet_schema(), filepath_fn, segment_row_size=self.segment_row_size,
+                             compression=compression, batch_size=batch_size, write_empty=write_empty)
+
+    def to_petl(self, writer, filepath_fn, write_empty=True):
+        """
+        Writes the rows with a petl writer, starting a new file every segment_row_size rows.
+
+        :param writer: Function that writes a petl table to a filepath, e.g., from PETL_WRITERS.
+        :param filepath_fn: Function that returns the filepath for a segment number, starting with 1.
+        :param write_empty: Write a file even if there are no rows.
+        :return: List of the filepaths written.
+        """
+        return write_petl(self.rows(), self._header_row(), writer, filepath_fn,
+                          segment_row_size=self.segment_row_size, write_empty=write_empty)
+
 
 class FlickrExporter(BaseExporter):
-    def __init__(self, api_base_url, working_path, mq_config=None, warc_base_path=None):
+    def __init__(self, api_base_url, working_path, mq_config=None, warc_base_path=None, processes=None):
+        """
+        :param processes: Number of worker processes for writing Parquet, CSV, TSV, Excel and JSON exports in
+        parallel. Default is the FLICKR_EXPORTER_PROCESSES environment variable or 1, which writes serially.
+        """
         BaseExporter.__init__(self, api_base_url, FlickrWarcIter, FlickrPhotoTable, working_path,
-                              mq_config=mq_config, warc_base_path=warc_base_path, limit_item_types=[TYPE_FLICKR_PHOTO])
+                              mq_config=mq_config, warc_base_path=warc_base_path,
+                              limit_item_types=[TYPE_FLICKR_PHOTO, TYPE_FLICKR_PHOTO_LITE])
+        if processes is None:
+            processes = int(os.environ.get("FLICKR_EXPORTER_PROCESSES", 1))
+        self.processes = processes
+
+    def on_message(self):
+        with profiled("{}-export".format(self.message.get("id")), os.path.join(self.working_path, "profiles"),
+                      enabled=profile_enabled(self.message)):
+            export_format = self.message.get("format")
+            if export_format == PARQUET_FORMAT or (export_format in PETL_WRITERS and self.processes > 1):
+                self._export(export_format)
+            else:
+                BaseExporter.on_message(self)
+
+    def _export(self, export_format):
+        """
+        Performs an export to Parquet files or, with worker processes, to files of the other formats of PETL_WRITERS,
+        reporting the result like other export formats.
+        """
+        export_id = self.message["id"]
+        log.info("Performing %s export %s", export_format, export_id)
+
+        self.result = ExportResult()
+        self.result.started = datetime_now()
+        self._send_response_message(STATUS_RUNNING, self.routing_key, export_id, self.result)
+
+        if export_format == PARQUET_FORMAT and pyarrow is None:
+            self.result.success = False
+            self.result.errors.append(Msg(CODE_UNSUPPORTED_EXPORT_FORMAT, "pyarrow is required for parquet"))
+        else:
+            # Written to a temporary directory and then moved, so that a failed export doesn't leave partial files.
+            temp_path = os.path.join(self.working_path, "tmp")
+            try:
+                if os.path.exists(temp_path):
+                    shutil.rmtree(temp_path)
+                os.makedirs(temp_path)
+                filepaths = self._write_export(export_id, temp_path, export_format)
+                if filepaths is None:
+                    self.result.success = False
+                    self.result.errors.append(Msg(CODE_NO_WARCS, "No WARC files from which to export"))
+                else:
+                    log.info("Wrote %s %s files for export %s", len(filepaths), export_format, export_id)
+                    self._move_export(temp_path, self.message["path"])
+            except Exception as e:
+                log.exception("%s export %s failed", export_format, export_id)
+                self.result.success = False
+                self.result.errors.append(Msg(CODE_PARQUET_EXPORT_ERROR if export_format == PARQUET_FORMAT
+                                              else CODE_EXPORT_ERROR, str(e)))
+            finally:
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+        self.result.ended = datetime_now()
+        self._send_response_message(STATUS_SUCCESS if self.result.success else STATUS_FAILURE, self.routing_key,
+                                    export_id, self.result)
+
+    @staticmethod
+    def _move_export(temp_path, export_path):
+        """
+        Replace any earlier export in the export path with the files in the temporary path.
+        """
+        log.info("Moving from %s to %s", temp_path, export_path)
+        if os.path.exists(export_path):
+            shutil.rmtree(export_path)
+        os.makedirs(export_path)
+        for filename in os.listdir(temp_path):
+            shutil.move(os.path.join(temp_path, filename), export_path)
+
+    def _write_export(self, export_id, export_path, export_format):
+        """
+        Writes the files of the export to export_path.
+        :return: List of the filepaths written or None if there are no WARCs to export from.
+        """
+        collection_id = self.message.get("collection", {}).get("id")
+        seed_ids = []
+        seed_uids = []
+        if not collection_id:
+            for seed in self.message.get("seeds", []):
+                seed_ids.append(seed["id"])
+                seed_uids.append(seed["uid"])
+        item_date_start = iso8601.parse_date(
+            self.message["item_date_start"]) if "item_date_start" in self.message else None
+        item_date_end = iso8601.parse_date(
+            self.message["item_date_end"]) if "item_date_end" in self.message else None
+        # Only request seed ids if < 20. If use too many, will cause problems calling API.
+        warc_paths = self._get_warc_paths(collection_id, seed_ids if len(seed_ids) <= 20 else None,
+                                          self.message.get("harvest_date_start"),
+                                          self.message.get("harvest_date_end"))
+
+        if not warc_paths:
+            return None
+        dedupe = self.message.get("dedupe", False)
+        segment_row_size = self.message.get("segment_size")
+
+        def filepath_fn(segment):
+            return os.path.join(export_path, "{}_{}.{}".format(export_id, str(segment).zfill(3), export_format))
+
+        if self.processes > 1:
+            return self._write_parallel(filepath_fn, export_path, export_id, export_format, warc_paths, dedupe,
+                                        item_date_start, item_date_end, seed_uids, segment_row_size)
+        table = self.table_cls(warc_paths, dedupe, item_date_start, item_date_end, seed_uids,
+                               segment_row_size=segment_row_size)
+        return table.to_parquet(filepath_fn)
+
+    def _write_parallel(self, filepath_fn, export_path, export_id, export_format, warc_paths, dedupe, item_date_start,
+                        item_date_end, seed_uids, segment_row_size):
+        """
+        Writes the files of an export with shards of the photos written by worker processes.
+
+        Without dedupe, each worker gets a contiguous run of the WARCs. With dedupe, each worker reads all of the
+        WARCs but only writes the photos in its shard of photo ids, so a photo is only ever deduped within a single
+        worker. Each worker segments its own files, so the last segment of a shard may be short. The segments are
+        then renamed in shard order.
+        """
+        if dedupe:
+            shards = [(warc_paths, (index, self.processes)) for index in range(self.processes)]
+        else:
+            shard_count = min(self.processes, len(warc_paths))
+            shards = [(warc_paths[index * len(warc_paths) // shard_count:(index + 1) * len(warc_paths) // shard_count],
+                       None) for index in range(shard_count)]
+        part_filepath_fmt = os.path.join(export_path, ".{}_{{}}_{{}}.{}.part".format(export_id, export_format))
+        args = [(self.table_cls, shard_warc_paths, dedupe, item_date_start, item_date_end, seed_uids,
+                 segment_row_size, shard, export_format, part_filepath_fmt.format(index, "{}"))
+                for index, (shard_warc_paths, shard) in enumerate(shards)]
+        log.debug("Writing %s shards with %s processes", len(shards), self.processes)
+        part_filepaths = []
+        try:
+            with multiprocessing.Pool(min(self.processes, len(shards))) as pool:
+                for shard_part_filepaths in pool.map(_write_shard, args):
+                    part_filepaths.extend(shard_part_filepaths)
+            filepaths = []
+            for part_filepath in part_filepaths:
+                filepaths.append(filepath_fn(len(filepaths) + 1))
+                os.rename(part_filepath, filepaths[-1])
+            part_filepaths = []
+            if not filepaths:
+                table = self.table_cls(warc_paths, dedupe, item_date_start, item_date_end, seed_uids)
+                if export_format == PARQUET_FORMAT:
+                    filepaths = write_parquet([], table.parquet_schema(), filepath_fn)
+                else:
+                    filepaths = write_petl([], table._header_row(), PETL_WRITERS[export_format], filepath_fn)
+            return filepaths
+        finally:
+            for part_filepath in part_filepaths:
+                if os.path.exists(part_filepath):
+                    os.remove(part_filepath)
+
+
+def _write_shard(args):
+    """
+    Writes the files for a shard in a worker process.
+
+    Pool workers are daemonic and can't start processes of their own, so the WARCs are parsed in the worker.
+    """
+    (table_cls, warc_paths, dedupe, item_date_start, item_date_end, seed_uids, segment_row_size, shard,
+     export_format, part_filepath_fmt) = args
+    table = table_cls(warc_paths, dedupe, item_date_start, item_date_end, seed_uids,
+                      segment_row_size=segment_row_size, shard=shard, processes=1)
+    if export_format == PARQUET_FORMAT:
+        return table.to_parquet(part_filepath_fmt.format, write_empty=False)
+    return table.to_petl(PETL_WRITERS[export_format], part_filepath_fmt.format, write_empty=False)
+
+
+def write_petl(rows, header, writer, filepath_fn, segment_row_size=None, write_empty=True):
+    """
+    Writes rows with a petl writer, starting a new file every segment_row_size rows.
+
+    The rows of a segment are streamed to the writer, rather than held in memory.
+    :param writer: Function that writes a petl table to a filepath, e.g., from PETL_WRITERS.
+    :param write_empty: Write a file with only the header row even if there are no rows.
+    :return: List of the filepaths written.
+    """
+    rows = iter(rows)
+    filepaths = []
+    for row in rows:
+        segment_rows = itertools.chain((row,), itertools.islice(rows, segment_row_size - 1)
+                                       if segment_row_size else rows)
+        filepaths.append(filepath_fn(len(filepaths) + 1))
+        writer(_RowsTable(header, segment_rows), filepaths[-1])
+    if not filepaths and write_empty:
+        filepaths.append(filepath_fn(1))
+        writer(_RowsTable(header, ()), filepaths[-1])
+    return filepaths
+
+
+class _RowsTable(petl.Table):
+    """
+    petl table of a header row and rows that can only be iterated over once.
+    """
+
+    def __init__(self, header, rows):
+        self._header = header
+        self._rows = rows
+
+    def __iter__(self):
+        yield self._header
+        for row in self._rows:
+            yield row
+
+
+def to_xlsx(table, filepath):
+    """
+    Writes a petl table to an Excel file.
+
+    Excel doesn't support time zones, so dates are written without them. Dates posted are in UTC.
+    """
+    petl.toxlsx(petl.convertall(table, lambda value: value.replace(tzinfo=None)
+                                if isinstance(value, datetime) and value.tzinfo else value), filepath)
+
+
+def to_lineoriented_json(table, filepath):
+    """
+    Writes a petl table to a file with a JSON object per row.
+    """
+    rows = iter(table)
+    header = next(rows)
+    with open(filepath, "w") as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(header, row)), default=str))
+            f.write("\n")
+
+
+# Writers of the formats that are written by worker processes when exporting with processes, by format
+PETL_WRITERS = {
+    "csv": petl.tocsv,
+    "tsv": petl.totsv,
+    "xlsx": to_xlsx,
+    "json": to_lineoriented_json
+}
+
+
+def write_parquet(rows, schema, filepath_fn, segment_row_size=None, compression=PARQUET_COMPRESSION,
+                  batch_size=PARQUET_BATCH_SIZE, write_empty=True):
+    """
+    Writes rows to Parquet files with the schema, starting a new file every segment_row_size rows.
+
+    :param write_empty: Write a file even if there are no rows.
+    :return: List of the filepaths written.
+    """
+    if segment_row_size:
+        batch_size = min(batch_size, segment_row_size)
+    filepaths = []
+    writer = None
+    segment_rows = 0
+    columns = [[] for _ in schema.names]
+
+    def write_batch():
+        batch = pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+        writer.write_batch(batch)
+        for column in columns:
+            del column[:]
+
+    try:
+        for row in rows:
+            if writer is None:
+                filepaths.append(filepath_fn(len(filepaths) + 1))
+                writer = pyarrow.parquet.ParquetWriter(filepaths[-1], schema, compression=compression)
+            for column, field, value in zip(columns, schema, row):
+                column.append(_parquet_value(value, field.type))
+            segment_rows += 1
+            if len(columns[0]) == batch_size:
+                write_batch()
+            if segment_rows == segment_row_size:
+                if columns[0]:
+                    write_batch()
+                writer.close()
+                writer = None
+                segment_rows = 0
+        if writer is None and not filepaths and write_empty:
+            filepaths.append(filepath_fn(1))
+            writer = pyarrow.parquet.ParquetWriter(filepaths[-1], schema, compression=compression)
+        if writer is not None and columns[0]:
+            write_batch()
+    finally:
+        if writer is not None:
+            writer.close()
+    return filepaths
+
+
+def _parquet_value(value, value_type):
+    if value is None or not pyarrow.types.is_integer(value_type):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return None
 
 
 if __name__ == "__main__":
@@ -1,50 +1,261 @@
 from __future__ import absolute_import
 import logging
-import flickrapi
-from sfmutils.harvester import BaseHarvester, Msg, CODE_TOKEN_NOT_FOUND, CODE_UID_NOT_FOUND, CODE_UNKNOWN_ERROR
-from flickr_warc_iter import FlickrWarcIter, TYPE_FLICKR_PHOTO
+import os
+import threading
+from collections import Counter
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sfmutils.harvester import BaseHarvester, HarvestResult, Msg, CODE_TOKEN_NOT_FOUND, CODE_UID_NOT_FOUND, \
+    CODE_UNKNOWN_ERROR
+from flickr_warc_iter import FlickrWarcIter, TYPE_FLICKR_PHOTO, TYPE_FLICKR_PHOTO_LITE, photo_owner_nsid, \
+    photo_posted
+from flickr_api import FlickrAPI, ApiMetrics, create_session, mount_pool, DEFAULT_POOL_SIZE
+from photo_id_set import PhotoIdSet
+from profiling import profiled, profile_enabled
+from user_cache import shared_user_cache, DEFAULT_TTL_SECS
 
 log = logging.getLogger(__name__)
 
 QUEUE = "flickr_harvester"
 ROUTING_KEY = "harvest.start.flickr.*"
 
+CODE_RATE_LIMIT_WAIT = "rate_limit_wait"
+CODE_PHOTO_CHANGES = "photo_changes"
+CODE_API_METRICS = "api_metrics"
+CODE_HARVEST_RESUMED = "harvest_resumed"
+CODE_LISTING_CALLS = "listing_calls"
+
+# Extras requested from getPublicPhotos for lite harvests. These provide the photo metadata that is exported.
+LITE_EXTRAS = "description,license,date_upload,date_taken,owner_name,original_format,last_update,media," \
+              "path_alias,url_sq,url_t,url_s,url_m,url_l,url_o"
+# Bounds of the number of photos per getPublicPhotos page. 500 is the most Flickr allows.
+MIN_PER_PAGE = 10
+MAX_PER_PAGE = 500
+# Flickr's default number of photos per getPublicPhotos page
+DEFAULT_PER_PAGE = 100
+# Photos added to the expected number of photos when choosing the page size, so that a few more photos than
+# expected still fit on a page.
+PER_PAGE_MARGIN = 10
+# Number of photos between saves of a seed's checkpoint
+CHECKPOINT_INTERVAL = 500
+
 
 class FlickrHarvester(BaseHarvester):
-    def __init__(self, working_path, mq_config=None, debug=False, per_page=None, debug_warcprox=False, tries=3):
+    def __init__(self, working_path, mq_config=None, debug=False, per_page=None, debug_warcprox=False, tries=3,
+                 metrics_filepath=None, user_cache_ttl=None):
+        """
+        :param metrics_filepath: File to write API metrics to in the Prometheus text format after each harvest,
+        e.g., for node_exporter's textfile collector. Metrics are totals since the harvester started. Default is the
+        FLICKR_HARVESTER_METRICS_FILE environment variable or None, which doesn't write metrics.
+        :param user_cache_ttl: Seconds that looked up nsids and user info are cached for. 0 turns off caching. Default
+        is the FLICKR_USER_CACHE_TTL environment variable or a week.
+        """
         BaseHarvester.__init__(self, working_path, mq_config=mq_config, debug=debug, debug_warcprox=debug_warcprox,
                                tries=tries)
         self.api = None
-        # For testing purposes
+        # Reused across harvests to keep connections alive
+        self.session = None
+        # Photos per getPublicPhotos page. If None, chosen for each seed.
         self.per_page = per_page
+        # Photos may be harvested by multiple threads
+        self._harvest_counter_lock = threading.Lock()
+        # Set to stop harvesting seeds after a seed fails
+        self._stop_seeds = threading.Event()
+        # Seeds may save checkpoints from multiple threads
+        self._state_lock = threading.Lock()
+        # Map of nsid to dict of per_page, calls, bytes and photos of the listing calls for the seed
+        self._listings = {}
+        # Map of nsid to the posted date of the last photo of the previous harvest, for incremental lite seeds. Photos
+        # on a listing page at or past it weren't harvested.
+        self._lite_markers = {}
+        # Ids of the lite photos counted by process_warc in this harvest, since a photo may be listed again
+        self._processed_lite_ids = PhotoIdSet()
+        # API metrics across harvests
+        self.metrics = ApiMetrics()
+        self.metrics_filepath = metrics_filepath or os.environ.get("FLICKR_HARVESTER_METRICS_FILE")
+        self._wait_secs_total = 0.0
+        self._throttle_count_total = 0
+        self._photo_count_total = 0
+        # Usernames and user info, shared by the harvesters of the process and saved in the working path
+        if user_cache_ttl is None:
+            user_cache_ttl = int(os.environ.get("FLICKR_USER_CACHE_TTL", DEFAULT_TTL_SECS))
+        self.user_cache = shared_user_cache(os.path.join(self.working_path, "user_cache.json"),
+                                            ttl_secs=user_cache_ttl)
+        # Hits and misses of the cache when the harvest started, since the cache's are totals
+        self._user_cache_counts = (self.user_cache.hits, self.user_cache.misses)
 
     def harvest_seeds(self):
+        with profiled("{}-harvest".format(self.message.get("id")), self._profile_path(),
+                      enabled=profile_enabled(self.message)):
+            self._harvest_seeds()
+
+    def _profile_path(self):
+        return os.path.join(self.working_path, "profiles")
+
+    def _harvest_seeds(self):
         # Create an API
         self._create_api()
+        self._listings = {}
+        self._lite_markers = {}
+        self._processed_lite_ids = PhotoIdSet()
+        self._user_cache_counts = (self.user_cache.hits, self.user_cache.misses)
 
-        # Dispatch message based on type.
-        harvest_type = self.message.get("type")
-        log.debug("Harvest type is %s", harvest_type)
-        if harvest_type == "flickr_user":
-            self.users()
-        else:
-            raise KeyError
+        try:
+            # Dispatch message based on type.
+            harvest_type = self.message.get("type")
+            log.debug("Harvest type is %s", harvest_type)
+            if harvest_type == "flickr_user":
+                self.users()
+            else:
+                raise KeyError
+
+            if self.api.wait_secs:
+                msg = "Waited {:.1f} seconds for rate limit ({} throttle responses from Flickr)".format(
+                    self.api.wait_secs, self.api.throttle_count)
+                log.info(msg)
+                self.result.infos.append(Msg(CODE_RATE_LIMIT_WAIT, msg))
+        finally:
+            # Also report the calls of failed harvests
+            self._report_listings()
+            self._report_metrics()
+            self._save_user_cache()
+
+    def _save_user_cache(self):
+        log.info("User cache had %s hits and %s misses in this harvest",
+                 self.user_cache.hits - self._user_cache_counts[0], self.user_cache.misses - self._user_cache_counts[1])
+        try:
+            self.user_cache.save()
+        except OSError:
+            # Only a cache, so the harvest doesn't fail.
+            log.exception("Saving user cache failed")
+
+    def _report_listings(self):
+        """
+        Add a summary of the getPublicPhotos calls of the harvest to the result.
+        """
+        if not self._listings:
+            return
+        calls = sum(listing["calls"] for listing in self._listings.values())
+        listing_bytes = sum(listing["bytes"] for listing in self._listings.values())
+        photo_count = sum(listing["photos"] for listing in self._listings.values())
+        msg = "Listed {} photos in {} getPublicPhotos calls ({:.1f} KB)".format(photo_count, calls,
+                                                                               listing_bytes / 1000.0)
+        log.info(msg)
+        self.result.infos.append(Msg(CODE_LISTING_CALLS, msg, calls=calls, bytes=listing_bytes, photos=photo_count,
+                                     seeds=dict(self._listings)))
+
+    def _report_metrics(self):
+        """
+        Add a summary of the harvest's API calls to the result and write the metrics file, if any.
+        """
+        summary = self.api.metrics.summary()
+        if summary:
+            msg = "API calls: {}".format(self.api.metrics.summary_message())
+            log.info(msg)
+            self.result.infos.append(Msg(CODE_API_METRICS, msg, methods=summary))
+        self.metrics.merge(self.api.metrics)
+        self._wait_secs_total += self.api.wait_secs
+        self._throttle_count_total += self.api.throttle_count
+        self._photo_count_total += self.result.harvest_counter["flickr photos"]
+        if self.metrics_filepath:
+            text = self.metrics.prometheus_text(extra_metrics=(
+                ("flickr_api_rate_limit_wait_seconds_total", "counter",
+                 "Seconds spent waiting on the rate limit and backing off.", self._wait_secs_total),
+                ("flickr_api_throttle_responses_total", "counter", "Throttle responses from the Flickr API.",
+                 self._throttle_count_total),
+                ("flickr_harvester_photos_total", "counter", "Photos harvested.", self._photo_count_total)))
+            # Replaced atomically, so that the file is never read partially written.
+            tmp_filepath = "{}.tmp".format(self.metrics_filepath)
+            try:
+                with open(tmp_filepath, "w") as f:
+                    f.write(text)
+                os.replace(tmp_filepath, self.metrics_filepath)
+            except OSError:
+                # Only metrics, so the harvest doesn't fail.
+                log.exception("Writing metrics to %s failed", self.metrics_filepath)
 
     def _create_api(self):
-        self.api = flickrapi.FlickrAPI(self.message["credentials"]["key"],
-                                       self.message["credentials"]["secret"],
-                                       store_token=False)
+        options = self.message.get("options", {})
+
+        # Connections are pooled across harvests. Need a connection for each thread making calls, i.e., the photo
+        # threads plus the listing thread for each seed.
+        pool_size = options.get("pool_size") or max(
+            options.get("seed_concurrency", 1) * (options.get("concurrency", 1) + 1), DEFAULT_POOL_SIZE)
+        if self.session is None:
+            self.session = create_session(pool_size)
+        elif self.session.pool_size != pool_size:
+            mount_pool(self.session, pool_size)
+
+        credentials = (self.message["credentials"]["key"], self.message["credentials"]["secret"])
+        if self.api is None or self.api.credentials != credentials:
+            self.api = FlickrAPI(credentials[0],
+                                 credentials[1],
+                                 store_token=False,
+                                 session=self.session)
+        self.api.set_rate_limit(options.get("rate_limit"), options.get("rate_limit_burst", 1))
+        self.api.reset_stats()
 
     def users(self):
         # Options
-        incremental = self.message.get("options", {}).get("incremental", True)
+        options = self.message.get("options", {})
+        incremental = options.get("incremental", True)
+        seed_concurrency = options.get("seed_concurrency", 1)
+        # When True, stop harvesting the other seeds when a seed fails. Otherwise, finish the other seeds.
+        fail_fast = options.get("fail_fast", True)
+
+        seeds = self.message.get("seeds", [])
+        # Each seed reports to its own result, which are merged in seed order.
+        seed_results = [HarvestResult() for _ in seeds]
+        seed_exceptions = [None] * len(seeds)
+        self._stop_seeds.clear()
+
+        def harvest_seed(idx):
+            if self._stop_seeds.is_set():
+                return
+            seed = seeds[idx]
+            try:
+                self._user(seed.get("id"), seed.get("token"), seed.get("uid"), incremental, seed_results[idx])
+            except Exception as e:
+                log.warning("Harvesting seed %s failed: %s", seed.get("id"), e)
+                seed_exceptions[idx] = e
+                if fail_fast:
+                    self._stop_seeds.set()
+            if fail_fast and not seed_results[idx].success:
+                self._stop_seeds.set()
+
+        try:
+            if seed_concurrency <= 1:
+                for idx in range(len(seeds)):
+                    harvest_seed(idx)
+            else:
+                log.debug("Harvesting seeds with concurrency of %s", seed_concurrency)
+                with ThreadPoolExecutor(max_workers=seed_concurrency) as executor:
+                    list(executor.map(harvest_seed, range(len(seeds))))
+        finally:
+            self._merge_seed_results(seed_results)
 
-        for seed in self.message.get("seeds", []):
-            self._user(seed.get("id"), seed.get("token"), seed.get("uid"), incremental)
-            if not self.result.success:
-                break
+        # Raise the exception from the first seed that failed, so that the harvest may be retried.
+        for e in seed_exceptions:
+            if e is not None:
+                raise e
 
-    def _user(self, seed_id, username, nsid, incremental):
+    def _merge_seed_results(self, seed_results):
+        for seed_result in seed_results:
+            self.result.uids.update(seed_result.uids)
+            self.result.token_updates.update(seed_result.token_updates)
+            self.result.infos.extend(seed_result.infos)
+            self.result.warnings.extend(seed_result.warnings)
+            self.result.errors.extend(seed_result.errors)
+            if not seed_result.success:
+                self.result.success = False
+
+    def _user(self, seed_id, username, nsid, incremental, result=None):
+        """
+        Harvest a user.
+        :param result: HarvestResult for the seed. Default is the harvest's result.
+        """
+        if result is None:
+            result = self.result
         log.info("Harvesting user %s with seed_id %s. Incremental is %s.", username, seed_id, incremental)
         assert username or nsid
         # Lookup nsid
@@ -52,68 +263,306 @@ class FlickrHarvester(BaseHarvester):
             nsid = self._lookup_nsid(username)
             if nsid:
                 # Report back if nsid found
-                self.result.uids[seed_id] = nsid
+                result.uids[seed_id] = nsid
             else:
                 msg = "NSID not found for user {}".format(username)
                 log.exception(msg)
-                self.result.warnings.append(Msg(CODE_TOKEN_NOT_FOUND, msg, seed_id=seed_id))
+                result.warnings.append(Msg(CODE_TOKEN_NOT_FOUND, msg, seed_id=seed_id))
                 return
 
-        # Get info on the user
-        resp = self.api.people.getInfo(user_id=nsid, format="parsed-json")
-        if resp["stat"] != "ok":
-            if resp["code"] == 1:
-                msg = "NSID {} not found".format(nsid)
-                log.warning(msg)
-                self.result.warnings.append(Msg(CODE_UID_NOT_FOUND, msg, seed_id=seed_id))
-            else:
-                msg = "Error returned by API: {}".format(resp["message"])
-                log.error(msg)
-                self.result.errors.append(Msg(CODE_UNKNOWN_ERROR, msg))
-                self.result.success = False
-            return
+        # Get info on the user. A change of username is detected once the cached info expires.
+        person = self.user_cache.get_person(nsid)
+        person_cached = person is not None
+        if not person_cached:
+            resp = self.api.people.getInfo(user_id=nsid, format="parsed-json")
+            if resp["stat"] != "ok":
+                if resp["code"] == 1:
+                    msg = "NSID {} not found".format(nsid)
+                    log.warning(msg)
+                    result.warnings.append(Msg(CODE_UID_NOT_FOUND, msg, seed_id=seed_id))
+                else:
+                    msg = "Error returned by API: {}".format(resp["message"])
+                    log.error(msg)
+                    result.errors.append(Msg(CODE_UNKNOWN_ERROR, msg))
+                    result.success = False
+                return
+            person = resp["person"]
+            self.user_cache.set_person(nsid, person)
 
         # Extract username
-        new_username = resp["person"]["username"]["_content"]
+        new_username = person["username"]["_content"]
         if new_username != username:
-            self.result.token_updates[seed_id] = new_username
-
-        page = 0
-        # This is a dummy value. Will get actual value when call getPublicPhotos()
-        total_pages = 1
-        photo_ids = []
-        while page < total_pages:
-            page += 1
-            log.debug("Fetching %s of %s pages.", page, total_pages)
-            resp = self.api.people.getPublicPhotos(user_id=nsid, format='parsed-json', page=page,
-                                                   per_page=self.per_page)
-            # Get a valid value for total_pages
-            total_pages = resp["photos"]["pages"]
-
-            # Loop through photos on page
-            for photo in resp["photos"]["photo"]:
-                photo_ids.append((photo["id"], photo["secret"]))
-
-        # Determine which photos should harvest
-        to_harvest_photo_ids = photo_ids
+            result.token_updates[seed_id] = new_username
+
+        last_photo_id = None
+        last_posted = None
         if incremental:
             last_photo_id = self.state_store.get_state(__name__, "{}.last_photo_id".format(nsid))
-            if last_photo_id:
-                # Photos are in most recently posted first order
-                photo_id_subset = []
-                for photo_id, secret in photo_ids:
-                    if last_photo_id == photo_id:
+            last_posted = self.state_store.get_state(__name__, "{}.last_posted".format(nsid))
+
+        options = self.message.get("options", {})
+        lite = options.get("lite", False)
+        # For full harvests, only fetch photos that are new or updated since last harvested.
+        skip_unchanged = not incremental and not lite and options.get("skip_unchanged", True)
+        extras = None
+        if lite:
+            extras = LITE_EXTRAS
+        elif skip_unchanged:
+            extras = "last_update"
+
+        # Resume from the checkpoint of a previous try of this harvest, if any
+        checkpoint = SeedCheckpoint(self.state_store, self._state_lock, nsid, self.message.get("id"))
+        if checkpoint.resumed:
+            log.info("Resuming harvest of %s after page %s, with %s photos already captured", nsid, checkpoint.page,
+                     len(checkpoint.captured_ids))
+            # Pages are numbered by the page size, so keep the checkpoint's.
+            per_page = checkpoint.per_page
+            # Processing the WARCs of the failed try may have moved the marker to a photo that won't be listed again.
+            last_photo_id = checkpoint.last_photo_id
+            last_posted = checkpoint.last_posted
+        else:
+            per_page = self._per_page(nsid, person, incremental, person_cached=person_cached)
+            checkpoint.per_page = per_page
+            checkpoint.last_photo_id = last_photo_id
+            checkpoint.last_posted = last_posted
+            checkpoint.save()
+        if lite and last_posted:
+            self._lite_markers[nsid] = int(last_posted)
+        # A cached photo count is out of date, so the count is refreshed from the listing.
+        photo_count = None if person_cached else _person_photo_count(person)
+        try:
+            # Harvest photos as they are listed
+            with closing(self._public_photos(nsid, last_photo_id, extras=extras,
+                                             checkpoint=checkpoint, per_page=per_page)) as photos:
+                if lite:
+                    # The listing pages capture the photo metadata, so no calls are made per photo.
+                    for photo in photos:
+                        self._increment_photo_count()
+                        checkpoint.done(photo["id"])
+                elif skip_unchanged:
+                    change_counter = Counter()
+                    self._photos(((photo["id"], photo["secret"]) for photo in
+                                  self._changed_photos(nsid, photos, change_counter, checkpoint)), result,
+                                 checkpoint)
+                    msg = "{} new, {} changed, and {} unchanged photos for {}".format(
+                        change_counter["new"], change_counter["changed"], change_counter["unchanged"], nsid)
+                    log.info(msg)
+                    result.infos.append(Msg(CODE_PHOTO_CHANGES, msg, seed_id=seed_id, **change_counter))
+                else:
+                    self._photos(((photo["id"], photo["secret"]) for photo in photos), result, checkpoint)
+        finally:
+            # Keep the checkpoint until the seed is complete, e.g., when the harvest fails or is stopped.
+            if checkpoint.complete and result.success:
+                checkpoint.clear()
+                listed_count = self._listings.get(nsid, {}).get("total")
+                if listed_count is not None:
+                    photo_count = listed_count
+                if photo_count is not None:
+                    self._set_photo_count(nsid, photo_count)
+            else:
+                checkpoint.save()
+            if checkpoint.resumed:
+                self._report_resumed(checkpoint, seed_id, nsid, lite, result)
+
+    def _set_photo_count(self, nsid, photo_count):
+        """
+        Record the photo count of a user and the photos added since the last recorded count, for choosing the page size
+        of the next harvest.
+        """
+        with self._state_lock:
+            last_photo_count = self.state_store.get_state(__name__, "{}.photo_count".format(nsid))
+            if last_photo_count is not None:
+                self.state_store.set_state(__name__, "{}.photo_delta".format(nsid),
+                                           photo_count - int(last_photo_count))
+            self.state_store.set_state(__name__, "{}.photo_count".format(nsid), photo_count)
+
+    def _per_page(self, nsid, person, incremental, person_cached=False):
+        """
+        Choose the number of photos per getPublicPhotos page for a seed.
+
+        The fewer pages, the fewer calls, but pages that are larger than needed waste bytes when not every listed
+        photo is harvested (e.g., when stopping at the last photo of an incremental harvest). So pages are sized to
+        the photos expected to be listed: for incremental harvests, the photos added since the last harvest (by the
+        user's photo count, as of the last harvest); otherwise, all of the user's photos. When no photos are expected
+        to have been added (e.g., photos were added and others deleted), the expected photos aren't known, so pages
+        aren't made smaller than Flickr's default.
+
+        The photo count of cached user info is out of date, so for cached users the count as of the last harvest plus
+        the photos added between the last two harvests is expected instead.
+        :param person_cached: True if the person is from the user cache.
+        :return: Photos per page or None for Flickr's default (100).
+        """
+        if self.per_page:
+            return self.per_page
+        last_photo_count = self.state_store.get_state(__name__, "{}.photo_count".format(nsid))
+        if person_cached and last_photo_count is not None:
+            last_photo_delta = self.state_store.get_state(__name__, "{}.photo_delta".format(nsid))
+            photo_count = int(last_photo_count) + max(int(last_photo_delta or 0), 0)
+        else:
+            photo_count = _person_photo_count(person)
+        if photo_count is None:
+            return None
+        expected_count = photo_count
+        if incremental:
+            if last_photo_count is not None:
+                expected_count = photo_count - int(last_photo_count)
+                if expected_count <= 0:
+                    log.debug("Expecting no photos for %s, so listing %s per page", nsid, DEFAULT_PER_PAGE)
+                    return DEFAULT_PER_PAGE
+        per_page = min(max(expected_count + PER_PAGE_MARGIN, MIN_PER_PAGE), MAX_PER_PAGE)
+        log.debug("Expecting %s photos for %s, so listing %s per page", expected_count, nsid, per_page)
+        return per_page
+
+    def _report_resumed(self, checkpoint, seed_id, nsid, lite, result):
+        resumed_count = checkpoint.resumed_count
+        fresh_count = checkpoint.done_count
+        # Listing calls for the skipped pages, plus getInfo and getSizes calls for each photo, unless lite
+        saved_calls = checkpoint.resumed_page + (0 if lite else 2 * resumed_count)
+        msg = "Resumed harvest of {} after page {}: {} photos were already captured and {} were not, " \
+              "saving about {} calls".format(nsid, checkpoint.resumed_page, resumed_count, fresh_count, saved_calls)
+        log.info(msg)
+        result.infos.append(Msg(CODE_HARVEST_RESUMED, msg, seed_id=seed_id, resumed_page=checkpoint.resumed_page,
+                                resumed_photos=resumed_count, fresh_photos=fresh_count, saved_calls=saved_calls))
+
+    def _changed_photos(self, nsid, photos, change_counter, checkpoint=None):
+        """
+        Filter listed photos to those that are new or have been updated since last harvested.
+        :param photos: Photos from getPublicPhotos, with the last_update extra.
+        :param change_counter: Counter that is incremented for new, changed, and unchanged photos.
+        :param checkpoint: SeedCheckpoint that unchanged photos are marked done in.
+        :return: Generator of new and changed photos.
+        """
+        photo_updates = self.state_store.get_state(__name__, "{}.photo_updates".format(nsid)) or {}
+        for photo in photos:
+            last_update = photo_updates.get(photo["id"])
+            if last_update is None:
+                change_counter["new"] += 1
+            elif last_update == photo["lastupdate"]:
+                change_counter["unchanged"] += 1
+                if checkpoint is not None:
+                    checkpoint.done(photo["id"])
+                continue
+            else:
+                change_counter["changed"] += 1
+            yield photo
+
+    def _public_photos(self, nsid, last_photo_id=None, extras=None, checkpoint=None, per_page=None):
+        """
+        Iterate over a user's public photos, most recently posted first.
+
+        While the photos from a page are being harvested, the next page is fetched. Photos that are listed again
+        (e.g., when uploads during the harvest shift the pages) are skipped.
+        :param nsid: The user's nsid.
+        :param last_photo_id: If provided, stop when reaching this photo.
+        :param extras: If provided, extra fields to include for each photo.
+        :param checkpoint: If provided, SeedCheckpoint to resume from and to record listed pages in. Listing starts
+        after the checkpoint's last completed page and photos that it has captured are skipped.
+        :param per_page: Photos per page. Default is the harvester's per_page.
+        :return: Generator of photos from getPublicPhotos.
+        """
+        listed_ids = PhotoIdSet()
+        per_page = per_page or self.per_page
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = checkpoint.page + 1 if checkpoint is not None else 1
+            future = executor.submit(self._public_photos_page, nsid, page, extras, per_page)
+            while future:
+                resp = future.result()
+                listed_page = page
+                total_pages = resp["photos"]["pages"]
+                log.debug("Fetched %s of %s pages.", page, total_pages)
+                photos = resp["photos"]["photo"]
+
+                # Photos are in most recently posted first order, so stop at the last photo from previous harvest.
+                for idx, photo in enumerate(photos):
+                    if last_photo_id and last_photo_id == photo["id"]:
+                        log.debug("Reached last photo %s on page %s", last_photo_id, page)
+                        photos = photos[:idx]
+                        total_pages = page
                         break
-                    photo_id_subset.append((photo_id, secret))
-                to_harvest_photo_ids = photo_id_subset
 
-        log.debug("Harvesting %s of %s photos", len(to_harvest_photo_ids), len(photo_ids))
+                future = None
+                if page < total_pages:
+                    page += 1
+                    future = executor.submit(self._public_photos_page, nsid, page, extras, per_page)
+
+                new_photos = []
+                for photo in photos:
+                    if not listed_ids.add(photo["id"]):
+                        log.debug("Skipping photo %s, which was already listed", photo["id"])
+                    elif checkpoint is not None and photo["id"] in checkpoint.captured_ids:
+                        log.debug("Skipping photo %s, which was captured before resuming", photo["id"])
+                    else:
+                        new_photos.append(photo)
+                if checkpoint is not None:
+                    checkpoint.listed(listed_page, [photo["id"] for photo in new_photos])
+                for photo in new_photos:
+                    yield photo
+            if checkpoint is not None:
+                checkpoint.listing_complete = True
+
+    def _public_photos_page(self, nsid, page, extras=None, per_page=None):
+        # getPublicPhotos can't be limited by upload date, so incremental harvests stop at the last photo instead.
+        resp = self.api.people.getPublicPhotos(user_id=nsid, format='parsed-json', page=page, per_page=per_page,
+                                               extras=extras)
+        # Each seed lists in its own thread, so the last response of the thread is this one.
+        response_bytes = self.api.last_response_bytes
+        with self._harvest_counter_lock:
+            listing = self._listings.setdefault(nsid, {"per_page": per_page, "calls": 0, "bytes": 0, "photos": 0})
+            listing["calls"] += 1
+            listing["bytes"] += response_bytes
+            listing["photos"] += len(resp.get("photos", {}).get("photo", []))
+            # The current photo count, since the user's info may be cached
+            total = resp.get("photos", {}).get("total")
+            if total is not None:
+                listing["total"] = int(total)
+        return resp
 
-        # Harvest photos
-        for (photo_id, secret) in to_harvest_photo_ids:
+    def _photos(self, photo_ids, result=None, checkpoint=None):
+        """
+        Harvest photos, fanning out to a bounded pool of threads when the concurrency option is greater than 1.
+        :param photo_ids: Iterable of (photo_id, secret).
+        :param result: HarvestResult for the seed. Default is the harvest's result.
+        :param checkpoint: SeedCheckpoint that harvested photos are marked done in.
+        """
+        if result is None:
+            result = self.result
+
+        def harvest_photo(photo_id, secret):
             self._photo(photo_id, secret)
-            if not self.result.success:
-                break
+            if checkpoint is not None:
+                checkpoint.done(photo_id)
+
+        def stopped():
+            return not result.success or self._stop_seeds.is_set()
+
+        concurrency = self.message.get("options", {}).get("concurrency", 1)
+        if concurrency <= 1:
+            for (photo_id, secret) in photo_ids:
+                harvest_photo(photo_id, secret)
+                if stopped():
+                    break
+            return
+
+        log.debug("Harvesting photos with concurrency of %s", concurrency)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Limit the number of queued photos so that the pool doesn't run ahead of the iterable.
+            futures = set()
+            try:
+                for (photo_id, secret) in photo_ids:
+                    if len(futures) >= concurrency * 2:
+                        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            # Raises any exception from _photo()
+                            future.result()
+                    if stopped():
+                        break
+                    futures.add(executor.submit(harvest_photo, photo_id, secret))
+                for future in futures:
+                    future.result()
+            finally:
+                # On failure, don't start photos that are still queued.
+                for future in futures:
+                    future.cancel()
 
     def _photo(self, photo_id, secret):
         log.info("Harvesting photo %s.", photo_id)
@@ -124,39 +573,198 @@ class FlickrHarvester(BaseHarvester):
         # Get sizes
         self.api.photos.getSizes(photo_id=photo_id, format='parsed-json')
 
-        self.result.harvest_counter["flickr photos"] += 1
+        self._increment_photo_count()
+
+    def _increment_photo_count(self):
+        with self._harvest_counter_lock:
+            self.result.harvest_counter["flickr photos"] += 1
 
     def _lookup_nsid(self, username):
         """
         Lookup a user's nsid.
+
+        Found nsids are cached. Usernames that aren't found are not, since they may be registered later.
         :param username: Username to lookup.
         :return: The nsid or None if not found.
         """
+        nsid = self.user_cache.get_nsid(username)
+        if nsid:
+            log.debug("Found username %s in user cache: %s", username, nsid)
+            return nsid
         find_resp = self.api.people.findByUsername(username=username, format="parsed-json")
-        nsid = None
         if find_resp["stat"] == "ok":
             nsid = find_resp["user"]["nsid"]
+            self.user_cache.set_nsid(username, nsid)
         log.debug("Looking up username %s returned %s", username, nsid)
         return nsid
 
     def process_warc(self, warc_filepath):
-        incremental = self.message.get("options", {}).get("incremental", True)
+        with profiled("{}-process-{}".format(self.message.get("id"), os.path.basename(warc_filepath)),
+                      self._profile_path(), enabled=profile_enabled(self.message)):
+            self._process_warc(warc_filepath)
+
+    def _process_warc(self, warc_filepath):
+        options = self.message.get("options", {})
+        incremental = options.get("incremental", True)
+        # Index of lastupdate by photo for skipping unchanged photos in full harvests
+        track_updates = not incremental and options.get("skip_unchanged", True)
 
         warc_iter = FlickrWarcIter(warc_filepath)
         count = 0
+        # State is collected by owner nsid and written once at the end.
+        # Map of nsid to (posted, photo id) of the most recently posted photo
+        last_photos = {}
+        # Map of nsid to map of photo id to lastupdate
+        photo_updates = {}
         for item in warc_iter:
-            if item.type == TYPE_FLICKR_PHOTO:
+            if item.type == TYPE_FLICKR_PHOTO_LITE and self._skip_lite_photo(item.item):
+                continue
+            if item.type in (TYPE_FLICKR_PHOTO, TYPE_FLICKR_PHOTO_LITE):
                 count += 1
                 if not count % 10:
                     log.debug("Processing %s photos", count)
 
-                # Increment summary
-                self.result.increment_stats("flickr photos")
+                nsid = photo_owner_nsid(item.item)
+                if track_updates and item.type == TYPE_FLICKR_PHOTO:
+                    photo_updates.setdefault(nsid, {})[item.item["id"]] = item.item["dates"]["lastupdate"]
 
-                # Update state
                 if incremental:
-                    photo = item.item
-                    self.state_store.set_state(__name__, "{}.last_photo_id".format(photo["owner"]["nsid"]), photo["id"])
+                    posted = int(photo_posted(item.item))
+                    # Photos are harvested most recently posted first, so keep the first on ties.
+                    if nsid not in last_photos or posted > last_photos[nsid][0]:
+                        last_photos[nsid] = (posted, item.item["id"])
+
+        # Increment summary
+        if count:
+            self.result.increment_stats("flickr photos", count=count)
+
+        # Update state
+        for nsid, (posted, photo_id) in last_photos.items():
+            # The posted date is a high-water mark, so that processing an older WARC doesn't move the marker back.
+            last_posted_key = "{}.last_posted".format(nsid)
+            last_posted = self.state_store.get_state(__name__, last_posted_key)
+            if not last_posted or posted >= int(last_posted):
+                self.state_store.set_state(__name__, "{}.last_photo_id".format(nsid), photo_id)
+                self.state_store.set_state(__name__, last_posted_key, str(posted))
+
+        for nsid, updates in photo_updates.items():
+            photo_updates_key = "{}.photo_updates".format(nsid)
+            stored_updates = self.state_store.get_state(__name__, photo_updates_key) or {}
+            stored_updates.update(updates)
+            self.state_store.set_state(__name__, photo_updates_key, stored_updates)
+
+    def _skip_lite_photo(self, photo):
+        """
+        Returns True if a photo from a lite harvest's listing page wasn't harvested: it is at or past the last photo
+        of the previous harvest or it was already listed.
+        """
+        marker = self._lite_markers.get(photo_owner_nsid(photo))
+        if marker is not None and int(photo_posted(photo)) <= marker:
+            return True
+        return not self._processed_lite_ids.add(photo["id"])
+
+
+def _person_photo_count(person):
+    """
+    Returns the number of photos of a person from people.getInfo or None if not provided.
+    """
+    try:
+        return int(person["photos"]["count"]["_content"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class SeedCheckpoint(object):
+    """
+    Progress of harvesting a seed's photos, kept in the state store so that a retried or restarted harvest can resume.
+
+    Records the last listing page whose photos have all been harvested and the ids of the photos harvested, along
+    with the page size and the incremental marker the seed started with. A checkpoint is only resumed by the same
+    harvest (by harvest id). It is saved when the seed starts, every CHECKPOINT_INTERVAL photos and when the seed
+    stops, and cleared once the seed is complete.
+    """
+
+    def __init__(self, state_store, state_lock, nsid, harvest_id, interval=CHECKPOINT_INTERVAL):
+        self.state_store = state_store
+        self.state_lock = state_lock
+        self.key = "{}.checkpoint".format(nsid)
+        self.harvest_id = harvest_id
+        self.interval = interval
+        self._lock = threading.Lock()
+        state = state_store.get_state(__name__, self.key)
+        self.resumed = bool(state) and harvest_id is not None and state.get("harvest_id") == harvest_id
+        # Last page whose photos have all been harvested
+        self.page = state["page"] if self.resumed else 0
+        self.captured_ids = PhotoIdSet(state["photo_ids"] if self.resumed else None)
+        self.resumed_page = self.page
+        # Photos per listing page
+        self.per_page = state.get("per_page") if self.resumed else None
+        # Last photo of the previous harvest and its posted date, as of when the seed started
+        self.last_photo_id = state.get("last_photo_id") if self.resumed else None
+        self.last_posted = state.get("last_posted") if self.resumed else None
+        self.resumed_count = len(self.captured_ids)
+        # Set when all pages have been listed
+        self.listing_complete = False
+        # Map of page to number of photos listed on it that haven't been harvested
+        self._page_pending = {}
+        # Map of photo id to the page it was listed on, for photos that haven't been harvested
+        self._photo_pages = {}
+        self._unsaved_count = 0
+        # Number of photos done since created
+        self.done_count = 0
+
+    def listed(self, page, photo_ids):
+        """
+        Record the photos to be harvested from a listing page.
+        """
+        with self._lock:
+            self._page_pending[page] = len(photo_ids)
+            for photo_id in photo_ids:
+                self._photo_pages[photo_id] = page
+            self._advance()
+
+    def done(self, photo_id):
+        """
+        Record that a photo has been harvested (or doesn't need to be).
+        """
+        with self._lock:
+            self.captured_ids.add(photo_id)
+            self.done_count += 1
+            page = self._photo_pages.pop(photo_id, None)
+            if page is not None:
+                self._page_pending[page] -= 1
+                self._advance()
+            self._unsaved_count += 1
+            save = self._unsaved_count >= self.interval
+        if save:
+            self.save()
+
+    def _advance(self):
+        while self._page_pending.get(self.page + 1) == 0:
+            del self._page_pending[self.page + 1]
+            self.page += 1
+
+    @property
+    def complete(self):
+        return self.listing_complete and not self._photo_pages
+
+    def save(self):
+        if self.harvest_id is None:
+            return
+        with self._lock:
+            state = {"harvest_id": self.harvest_id, "page": self.page, "per_page": self.per_page,
+                     "last_photo_id": self.last_photo_id, "last_posted": self.last_posted,
+                     "photo_ids": list(self.captured_ids)}
+            self._unsaved_count = 0
+        log.debug("Saving checkpoint for %s at page %s with %s photos", self.key, state["page"],
+                  len(state["photo_ids"]))
+        with self.state_lock:
+            self.state_store.set_state(__name__, self.key, state)
+
+    def clear(self):
+        with self.state_lock:
+            if self.state_store.get_state(__name__, self.key) is not None:
+                self.state_store.set_state(__name__, self.key, None)
 
 
 if __name__ == "__main__":
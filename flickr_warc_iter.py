@@ -1,26 +1,542 @@
 #!/usr/bin/env python3
 
 from __future__ import absolute_import
-from sfmutils.warc_iter import BaseWarcIter
+from sfmutils.warc_iter import BaseWarcIter, IterItem
+from photo_id_set import PhotoIdSet
+from warcio.archiveiterator import ArchiveIterator
 from datetime import datetime
+import json
+import logging
+import multiprocessing
+import os
 import pytz
+import re
+import sys
+import zlib
+from collections import Counter, OrderedDict, deque
 from urllib.parse import urlparse, parse_qs
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+log = logging.getLogger(__name__)
+
 TYPE_FLICKR_PHOTO = "flickr_photo"
 TYPE_FLICKR_SIZES = "flickr_sizes"
+# Photo from a getPublicPhotos listing page with extras, as captured by lite harvests.
+TYPE_FLICKR_PHOTO_LITE = "flickr_photo_lite"
+
+METHOD_PHOTO_INFO = "flickr.photos.getInfo"
+METHOD_PHOTO_SIZES = "flickr.photos.getSizes"
+METHOD_PUBLIC_PHOTOS = "flickr.people.getPublicPhotos"
+# Extra only requested by lite harvests. Other listing pages (e.g., with only last_update) don't have photo metadata.
+LITE_EXTRA = "date_upload"
+METHOD_ITEM_TYPES = {
+    METHOD_PHOTO_INFO: TYPE_FLICKR_PHOTO,
+    METHOD_PHOTO_SIZES: TYPE_FLICKR_SIZES,
+    METHOD_PUBLIC_PHOTOS: TYPE_FLICKR_PHOTO_LITE
+}
+
+# Records of calls to these URLs are Flickr API calls. FLICKR_REST_URL is a stand-in for Flickr, e.g., for load testing.
+REST_URLS = tuple(url for url in ("https://api.flickr.com/services/rest/", os.environ.get("FLICKR_REST_URL")) if url)
+
+# For checking getInfo payloads before decoding
+OWNER_NSID_RE = re.compile(rb'"owner":\s*\{\s*"nsid":\s*"([^"]+)"')
+POSTED_RE = re.compile(rb'"dates":\s*\{\s*"posted":\s*"(\d+)"')
+# For getting the photo id of getInfo and getSizes records from the url
+PHOTO_ID_RE = re.compile(r"[?&]photo_id=([^&]+)")
+
+# Sidecar index of the Flickr records in a WARC, written next to the WARC.
+INDEX_EXT = ".flickr-idx.json"
+INDEX_VERSION = 2
+
+# Number of unmatched photo and sizes items held while joining. The harvester writes the getInfo and getSizes
+# records for a photo back to back, so they are close together even when photos are fetched concurrently.
+JOIN_BUFFER_SIZE = 100
+
+# Number of items that a worker process sends back at a time when parsing in parallel
+PARALLEL_CHUNK_SIZE = 1000
+# Number of chunks of items that a worker process can send back ahead of being iterated over. When they haven't been
+# iterated over, the worker waits.
+PARALLEL_QUEUE_CHUNKS = 2
+
+
+def _json_loads(payload):
+    return json.loads(payload.decode("utf-8"))
+
+
+# Decoders for JSON payloads, by name. A decoder takes the bytes of a payload and raises ValueError for bad JSON.
+DECODERS = {"json": _json_loads}
+if orjson is not None:
+    DECODERS["orjson"] = orjson.loads
+if ujson is not None:
+    DECODERS["ujson"] = ujson.loads
+# Prefer a decoder that decodes payloads faster than json. Decoding is only part of iterating, so this doesn't
+# make iterating noticeably faster; see benchmarks/decode.py.
+DEFAULT_DECODER = "orjson" if orjson is not None else "ujson" if ujson is not None else "json"
+
+
+def decode_payload(payload, decoder=DEFAULT_DECODER):
+    """
+    Decode a JSON payload with the named decoder, falling back to json for anything the decoder rejects.
+    """
+    if decoder != "json":
+        try:
+            return DECODERS[decoder](payload)
+        except ValueError:
+            pass
+    return _json_loads(payload)
+
+
+def photo_owner_nsid(photo):
+    """
+    Returns the owner nsid of a photo from getInfo or from a listing page.
+    """
+    owner = photo.get("owner")
+    return owner.get("nsid") if isinstance(owner, dict) else owner
+
+
+def photo_posted(photo):
+    """
+    Returns the posted epoch time of a photo from getInfo or from a listing page.
+    """
+    if "dates" in photo:
+        return photo["dates"]["posted"]
+    return photo["dateupload"]
+
+
+def in_shard(item_id, shard):
+    """
+    Returns True if the item belongs to the shard.
+
+    Items are assigned to shards by a stable hash of their id, so each item belongs to the same shard in every
+    process.
+    :param shard: Tuple of shard index and number of shards, or None for all items.
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    return (zlib.crc32(item_id.encode("utf-8")) if item_id else 0) % count == index
+
+
+def index_filepath(warc_filepath):
+    return warc_filepath + INDEX_EXT
+
+
+def build_index(warc_filepath):
+    """
+    Build the sidecar index for a WARC.
+
+    The index maps the offset of each Flickr API response record that is selected for iterating to its method, photo
+    id, owner nsid, and posted epoch time, so that iterating can seek straight to the relevant records.
+    :return: The index.
+    """
+    log.info("Building index for %s", warc_filepath)
+    records = []
+    # getSizes responses don't have an owner, so use the owner from getInfo response.
+    photo_owners = {}
+    with open(warc_filepath, "rb") as f:
+        archive_iter = ArchiveIterator(f)
+        for record in archive_iter:
+            if record.rec_type != "response":
+                continue
+            url = record.rec_headers.get_header("WARC-Target-URI")
+            # Same records as a full scan, e.g., only listing pages with the extras of lite harvests
+            if not FlickrWarcIter._select_record(url):
+                continue
+            params = parse_qs(urlparse(url).query)
+            method = params["method"][0]
+            photo_id = params.get("photo_id", [None])[0]
+            owner_nsid = params.get("user_id", [None])[0]
+            posted = None
+            if method == METHOD_PHOTO_INFO:
+                try:
+                    photo = decode_payload(record.content_stream().read()).get("photo")
+                except ValueError:
+                    photo = None
+                if photo:
+                    owner_nsid = photo_owner_nsid(photo)
+                    posted = int(photo_posted(photo))
+                    photo_owners[photo_id] = owner_nsid
+            elif method == METHOD_PHOTO_SIZES:
+                owner_nsid = photo_owners.get(photo_id)
+            records.append([archive_iter.get_record_offset(), method, photo_id, owner_nsid, posted])
+
+    stat = os.stat(warc_filepath)
+    index = {
+        "version": INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "records": records
+    }
+    with open(index_filepath(warc_filepath), "w") as f:
+        json.dump(index, f)
+    return index
+
+
+def load_index(warc_filepath):
+    """
+    Load the sidecar index for a WARC.
+    :return: The index or None if it is missing or stale.
+    """
+    try:
+        with open(index_filepath(warc_filepath)) as f:
+            index = json.load(f)
+    except (IOError, ValueError):
+        return None
+    stat = os.stat(warc_filepath)
+    if index.get("version") != INDEX_VERSION or index.get("size") != stat.st_size \
+            or index.get("mtime") != stat.st_mtime:
+        log.warning("Index for %s is stale", warc_filepath)
+        return None
+    return index
 
 
 class FlickrWarcIter(BaseWarcIter):
-    def __init__(self, filepaths, limit_owner_nsids=None):
+    def __init__(self, filepaths, limit_owner_nsids=None, processes=None, use_index=True, build_missing_index=None,
+                 join_sizes=False, join_buffer_size=JOIN_BUFFER_SIZE, decoder=None, fields=None, shard=None,
+                 dedupe_max_memory_containers=None):
+        """
+        :param processes: Number of worker processes for parsing WARC files in parallel. Default is the
+        FLICKR_WARC_ITER_PROCESSES environment variable or 1, which parses serially.
+        :param use_index: Use the sidecar index of a WARC when available. Otherwise, the WARC is fully scanned.
+        :param build_missing_index: Build the sidecar index of a WARC when it is missing or stale. Default is the
+        FLICKR_WARC_ITER_BUILD_INDEX environment variable or False.
+        :param join_sizes: Pair each photo with its sizes. Photo items then have a "sizes" entry, which is None if
+        the sizes weren't found within join_buffer_size items. Unmatched sizes are still returned as sizes items,
+        except when limiting by owner.
+        :param join_buffer_size: Maximum number of unmatched photo and sizes items to hold while joining.
+        :param decoder: Name of the decoder from DECODERS for JSON payloads. Default is the
+        FLICKR_WARC_ITER_DECODER environment variable or DEFAULT_DECODER.
+        :param fields: If provided, photo items only have these top-level fields. Other items are unchanged. Payloads
+        are still fully decoded, so this doesn't make iterating faster.
+        :param shard: Tuple of shard index and number of shards. If provided, only items whose ids belong to the
+        shard are returned. See in_shard().
+        :param dedupe_max_memory_containers: When deduping, the maximum number of containers of ids kept in memory
+        before spilling to disk. See PhotoIdSet. Default is the FLICKR_WARC_ITER_DEDUPE_MAX_CONTAINERS environment
+        variable or None, which keeps all ids in memory.
+        """
         BaseWarcIter.__init__(self, filepaths)
         self.limit_owner_nsids = limit_owner_nsids
+        if processes is None:
+            processes = int(os.environ.get("FLICKR_WARC_ITER_PROCESSES", 1))
+        self.processes = processes
+        self.use_index = use_index
+        if build_missing_index is None:
+            build_missing_index = os.environ.get("FLICKR_WARC_ITER_BUILD_INDEX", "").lower() in ("true", "1")
+        self.build_missing_index = build_missing_index
+        self.join_sizes = join_sizes
+        self.join_buffer_size = join_buffer_size
+        if decoder is None:
+            decoder = os.environ.get("FLICKR_WARC_ITER_DECODER", DEFAULT_DECODER)
+        if decoder not in DECODERS:
+            log.warning("Decoder %s is not available, so using json", decoder)
+            decoder = "json"
+        self.decoder = decoder
+        self.fields = fields
+        self.shard = shard
+        if dedupe_max_memory_containers is None and os.environ.get("FLICKR_WARC_ITER_DEDUPE_MAX_CONTAINERS"):
+            dedupe_max_memory_containers = int(os.environ["FLICKR_WARC_ITER_DEDUPE_MAX_CONTAINERS"])
+        self.dedupe_max_memory_containers = dedupe_max_memory_containers
+        # Counts of records rejected before decoding, by reason
+        self.rejected = Counter()
 
-    def _select_record(self, url):
-        return url.startswith("https://api.flickr.com/services/rest/") \
-               and ("method=flickr.photos.getInfo" in url or "method=flickr.photos.getSizes" in url)
+    @staticmethod
+    def is_flickr_url(url):
+        return url.startswith(REST_URLS)
 
-    def _item_iter(self, url, json_obj):
+    def iter(self, dedupe=False, **kwargs):
+        limit_item_types = kwargs.get("limit_item_types")
+        if self.join_sizes and limit_item_types and TYPE_FLICKR_PHOTO in limit_item_types \
+                and TYPE_FLICKR_SIZES not in limit_item_types:
+            kwargs["limit_item_types"] = list(limit_item_types) + [TYPE_FLICKR_SIZES]
+        if self.processes <= 1 or len(self.filepaths) <= 1:
+            items = self._serial_iter(kwargs)
+        else:
+            items = self._parallel_iter(kwargs)
+        if self.join_sizes:
+            items = self._join(items, limit_item_types)
+        if dedupe:
+            items = self._dedupe(items)
+        return items
+
+    def _dedupe(self, items):
+        with PhotoIdSet(max_memory_containers=self.dedupe_max_memory_containers) as seen_ids:
+            for item in items:
+                if seen_ids.add(item.id):
+                    yield item
+
+    def _join(self, items, limit_item_types=None):
+        """
+        Pair photo items with the sizes items for the same photo.
+
+        Unmatched items are held in a buffer of at most join_buffer_size items, oldest first, so memory doesn't
+        grow with the size of the WARCs.
+        """
+        pending = OrderedDict()
+        for item in items:
+            if item.type == TYPE_FLICKR_PHOTO:
+                other_type = TYPE_FLICKR_SIZES
+            elif item.type == TYPE_FLICKR_SIZES:
+                other_type = TYPE_FLICKR_PHOTO
+            else:
+                yield item
+                continue
+
+            match = pending.pop((other_type, item.id), None)
+            if match is not None:
+                if item.type == TYPE_FLICKR_PHOTO:
+                    yield self._joined_item(item, match)
+                else:
+                    yield self._joined_item(match, item)
+                continue
+
+            key = (item.type, item.id)
+            if key in pending:
+                # A repeated photo or sizes, e.g., from a retried harvest.
+                for unmatched_item in self._unmatched_item(pending.pop(key), limit_item_types):
+                    yield unmatched_item
+            pending[key] = item
+            if len(pending) > self.join_buffer_size:
+                for unmatched_item in self._unmatched_item(pending.popitem(last=False)[1], limit_item_types):
+                    yield unmatched_item
+        for item in pending.values():
+            for unmatched_item in self._unmatched_item(item, limit_item_types):
+                yield unmatched_item
+
+    @staticmethod
+    def _joined_item(photo_item, sizes_item):
+        return IterItem(photo_item.type, photo_item.id, photo_item.date, photo_item.url,
+                        dict(photo_item.item, sizes=sizes_item.item if sizes_item else None))
+
+    def _unmatched_item(self, item, limit_item_types):
+        if item.type == TYPE_FLICKR_PHOTO:
+            yield self._joined_item(item, None)
+        # Sizes don't have an owner, so can only be selected by their photo when limiting by owner.
+        elif not self.limit_owner_nsids and (not limit_item_types or TYPE_FLICKR_SIZES in limit_item_types):
+            yield item
+
+    def _serial_iter(self, iter_kwargs):
+        for filepath in self.filepaths:
+            for item in self._iter_file(filepath, iter_kwargs):
+                yield item
+
+    def _iter_file(self, filepath, iter_kwargs):
+        index = None
+        if self.use_index:
+            index = load_index(filepath)
+            if index is None and self.build_missing_index:
+                try:
+                    index = build_index(filepath)
+                except IOError as e:
+                    log.warning("Unable to build index for %s: %s", filepath, e)
+        rejected_count = sum(self.rejected.values())
+        if index is not None:
+            log.debug("Using index for %s", filepath)
+            for item in self._iter_indexed_file(filepath, index, **iter_kwargs):
+                yield item
+        else:
+            for item in self._iter_scanned_file(filepath, **iter_kwargs):
+                yield item
+        log.info("Rejected %s records from %s before decoding", sum(self.rejected.values()) - rejected_count,
+                 filepath)
+
+    def _iter_scanned_file(self, filepath, limit_item_types=None, item_date_start=None, item_date_end=None):
+        """
+        Iterate over all of the records in a WARC, rejecting records that won't produce items before decoding.
+        """
+        with open(filepath, "rb") as f:
+            for record in ArchiveIterator(f):
+                if record.rec_type != "response":
+                    continue
+                url = record.rec_headers.get_header("WARC-Target-URI")
+                if not self._select_record(url):
+                    continue
+                if limit_item_types and self._record_item_type(url) not in limit_item_types:
+                    self.rejected["item_type"] += 1
+                    continue
+                if self.shard:
+                    match = PHOTO_ID_RE.search(url)
+                    if match and not in_shard(match.group(1), self.shard):
+                        self.rejected["shard"] += 1
+                        continue
+                payload = record.content_stream().read()
+                reason = self._prefilter(url, payload, item_date_start, item_date_end)
+                if reason:
+                    self.rejected[reason] += 1
+                    continue
+                for item in self._record_items(record, url, payload, limit_item_types, item_date_start,
+                                               item_date_end):
+                    yield item
+
+    def _iter_indexed_file(self, filepath, index, limit_item_types=None, item_date_start=None, item_date_end=None):
+        """
+        Iterate over the records in a WARC that are selected by its index.
+        """
+        with open(filepath, "rb") as f:
+            for offset, method, photo_id, owner_nsid, posted in index["records"]:
+                if limit_item_types and METHOD_ITEM_TYPES[method] not in limit_item_types:
+                    self.rejected["item_type"] += 1
+                    continue
+                if self.limit_owner_nsids and owner_nsid not in self.limit_owner_nsids \
+                        and not self._select_sizes(method):
+                    self.rejected["owner"] += 1
+                    continue
+                if posted is not None and not self._in_date_range(posted, item_date_start, item_date_end):
+                    self.rejected["date"] += 1
+                    continue
+                if photo_id is not None and not in_shard(photo_id, self.shard):
+                    self.rejected["shard"] += 1
+                    continue
+
+                f.seek(offset)
+                record = next(iter(ArchiveIterator(f)))
+                url = record.rec_headers.get_header("WARC-Target-URI")
+                for item in self._record_items(record, url, record.content_stream().read(), limit_item_types,
+                                               item_date_start, item_date_end):
+                    yield item
+
+    @staticmethod
+    def _record_item_type(url):
+        for method, item_type in METHOD_ITEM_TYPES.items():
+            if "method=" + method in url:
+                return item_type
+        return None
+
+    def _prefilter(self, url, payload, item_date_start, item_date_end):
+        """
+        Cheaply check the raw payload of a record against the owner and date filters.
+
+        Only rejects when the value can be found in the payload; otherwise, the record is decoded and filtered as
+        usual.
+        :return: The reason that the record is rejected or None.
+        """
         if "method=flickr.photos.getInfo" in url:
+            if self.limit_owner_nsids:
+                match = OWNER_NSID_RE.search(payload)
+                if match and match.group(1).decode("utf-8") not in self.limit_owner_nsids:
+                    return "owner"
+            if item_date_start or item_date_end:
+                match = POSTED_RE.search(payload)
+                if match and not self._in_date_range(int(match.group(1)), item_date_start, item_date_end):
+                    return "date"
+        elif "method=flickr.photos.getSizes" in url and self.limit_owner_nsids and not self._select_sizes(
+                METHOD_PHOTO_SIZES):
+            # Sizes don't have an owner, so are never selected when limiting by owner.
+            return "owner"
+        return None
+
+    def _select_sizes(self, method):
+        """
+        When joining, sizes are selected by the owner of their photo, so aren't rejected by owner until joined.
+        """
+        return self.join_sizes and method == METHOD_PHOTO_SIZES
+
+    @staticmethod
+    def _in_date_range(posted, item_date_start, item_date_end):
+        posted_date = datetime.fromtimestamp(posted, tz=pytz.utc)
+        return not ((item_date_start and posted_date < item_date_start)
+                    or (item_date_end and posted_date > item_date_end))
+
+    def _record_items(self, record, url, payload, limit_item_types, item_date_start, item_date_end):
+        """
+        Decode a record's payload and yield the items that pass the filters.
+        """
+        record_id = record.rec_headers.get_header("WARC-Record-ID")
+        try:
+            json_obj = decode_payload(payload, self.decoder)
+        except ValueError:
+            log.warning("Bad json in record %s", record_id)
+            return
+        for item_type, item_id, item_date, item in self._item_iter(url, json_obj):
+            if limit_item_types and item_type not in limit_item_types:
+                continue
+            if item_date_start and item_date and item_date < item_date_start:
+                continue
+            if item_date_end and item_date and item_date > item_date_end:
+                continue
+            if item is None:
+                log.warning("Bad response in record %s", record_id)
+                continue
+            if not in_shard(item_id, self.shard):
+                continue
+            if not (item_type == TYPE_FLICKR_SIZES and self.join_sizes) and not self._select_item(item):
+                continue
+            if self.fields and item_type == TYPE_FLICKR_PHOTO:
+                item = {field: item[field] for field in self.fields if field in item}
+            yield IterItem(item_type, item_id, item_date, url, item)
+
+    def _parallel_iter(self, iter_kwargs):
+        """
+        Parse each WARC file in a worker process, yielding the items in file order.
+
+        At most processes files are parsed at once. A worker sends back the items of its file in chunks of
+        PARALLEL_CHUNK_SIZE and waits when PARALLEL_QUEUE_CHUNKS chunks haven't been iterated over yet, so memory is
+        bounded by about processes * (PARALLEL_QUEUE_CHUNKS + 1) chunks of items, however large the files. Joining
+        and dedupe are performed here, since they span files.
+        """
+        processes = min(self.processes, len(self.filepaths))
+        log.debug("Iterating over %s files with %s processes", len(self.filepaths), processes)
+        init_kwargs = {
+            "limit_owner_nsids": self.limit_owner_nsids,
+            "use_index": self.use_index,
+            "build_missing_index": self.build_missing_index,
+            "join_sizes": self.join_sizes,
+            "decoder": self.decoder,
+            "fields": self.fields,
+            "shard": self.shard
+        }
+        # A queue per process. File n is sent back on queue n % processes, which is free once file n - processes
+        # has been iterated over.
+        queues = [multiprocessing.Queue(PARALLEL_QUEUE_CHUNKS) for _ in range(processes)]
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(queues,)) as pool:
+            results = deque()
+
+            def submit(file_index):
+                results.append(pool.apply_async(_iter_file, ((self.__class__, self.filepaths[file_index],
+                                                              init_kwargs, iter_kwargs, file_index % processes),)))
+
+            for file_index in range(processes):
+                submit(file_index)
+            for file_index in range(len(self.filepaths)):
+                queue = queues[file_index % processes]
+                while True:
+                    items = queue.get()
+                    if items is None:
+                        break
+                    for item in items:
+                        yield item
+                # Raises the worker's exception, if any.
+                self.rejected.update(results.popleft().get())
+                if file_index + processes < len(self.filepaths):
+                    submit(file_index + processes)
+
+    @staticmethod
+    def _select_record(url):
+        """
+        Returns True if the record of the url is iterated over.
+        """
+        return FlickrWarcIter.is_flickr_url(url) \
+               and ("method=flickr.photos.getInfo" in url or "method=flickr.photos.getSizes" in url
+                    or ("method=flickr.people.getPublicPhotos" in url and "extras=" in url and LITE_EXTRA in url))
+
+    def _item_iter(self, url, json_obj):
+        if "method=flickr.people.getPublicPhotos" in url:
+            if json_obj["stat"] == "ok":
+                for photo in json_obj["photos"]["photo"]:
+                    # Only listing pages from lite harvests have the extras needed for a photo.
+                    if "dateupload" in photo:
+                        yield TYPE_FLICKR_PHOTO_LITE, photo["id"], datetime.fromtimestamp(
+                            int(photo["dateupload"]), tz=pytz.utc), photo
+            else:
+                yield TYPE_FLICKR_PHOTO_LITE, None, None, None
+        elif "method=flickr.photos.getInfo" in url:
             if json_obj["stat"] == "ok":
                 yield TYPE_FLICKR_PHOTO, json_obj["photo"]["id"], datetime.fromtimestamp(
                     int(json_obj["photo"]["dates"]["posted"]), tz=pytz.utc), json_obj["photo"]
@@ -36,13 +552,49 @@ class FlickrWarcIter(BaseWarcIter):
 
     @staticmethod
     def item_types():
-        return [TYPE_FLICKR_PHOTO, TYPE_FLICKR_SIZES]
+        return [TYPE_FLICKR_PHOTO, TYPE_FLICKR_SIZES, TYPE_FLICKR_PHOTO_LITE]
 
     def _select_item(self, item):
-        if not self.limit_owner_nsids or item.get("owner", {}).get("nsid") in self.limit_owner_nsids:
+        if not self.limit_owner_nsids or photo_owner_nsid(item) in self.limit_owner_nsids:
             return True
         return False
 
 
+# Queues that worker processes send items back on, set by _init_worker
+_worker_queues = None
+
+
+def _init_worker(queues):
+    global _worker_queues
+    _worker_queues = queues
+
+
+def _iter_file(args):
+    """
+    Parse a single WARC file in a worker process, sending the items back in chunks on a queue, followed by None.
+    :return: The counts of rejected records.
+    """
+    warc_iter_cls, filepath, init_kwargs, iter_kwargs, queue_index = args
+    queue = _worker_queues[queue_index]
+    try:
+        warc_iter = warc_iter_cls(filepath, processes=1, **init_kwargs)
+        items = []
+        for item in warc_iter._iter_file(filepath, iter_kwargs):
+            items.append(item)
+            if len(items) == PARALLEL_CHUNK_SIZE:
+                queue.put(items)
+                items = []
+        if items:
+            queue.put(items)
+    finally:
+        # Sent even when parsing fails, so that the items of the file aren't waited for.
+        queue.put(None)
+    return warc_iter.rejected
+
+
 if __name__ == "__main__":
-    FlickrWarcIter.main(FlickrWarcIter)
+    if len(sys.argv) > 1 and sys.argv[1] == "index":
+        for warc_filepath in sys.argv[2:]:
+            build_index(warc_filepath)
+    else:
+        FlickrWarcIter.main(FlickrWarcIter)
@@ -0,0 +1,224 @@
+from __future__ import absolute_import
+import logging
+import os
+import re
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Ids are split into a high key and the low CONTAINER_BITS bits. The low bits of the ids with the same key are kept
+# in a container.
+CONTAINER_BITS = 20
+LOW_MASK = (1 << CONTAINER_BITS) - 1
+# Low bits are stored as unsigned 32 bit integers.
+LOW_TYPECODE = "I"
+# A container is a sorted array of low bits until it has more than this many ids. Then it is a bitmap, which is
+# smaller.
+BITMAP_THRESHOLD = (1 << CONTAINER_BITS) // 32
+BITMAP_BYTES = (1 << CONTAINER_BITS) // 8
+# Ids are at most 64 bits.
+MAX_ID = 2 ** 64 - 1
+# Ids stored as integers: ASCII digits without leading zeros, so that they don't collide with the id without them
+NUMERIC_ID_RE = re.compile(r"0|[1-9][0-9]*")
+
+
+class PhotoIdSet(object):
+    """
+    Compact set of photo ids.
+
+    Flickr photo ids are numeric, so rather than keeping strings in a set, ids are stored as integers: the ids with
+    the same high bits share a container of their low bits. A container is a sorted array of 4 byte integers or, once
+    it is dense enough, a bitmap. For a large collection, this is about 4 to 5 bytes per id instead of about 100.
+
+    Optionally, only max_memory_containers containers are kept in memory. The least recently used containers are
+    spilled to a temporary file and read back as needed.
+
+    Ids that aren't numeric (e.g., None) are kept in a regular set.
+    """
+
+    def __init__(self, ids=None, max_memory_containers=None, spill_dir=None):
+        """
+        :param ids: Ids to add.
+        :param max_memory_containers: Maximum number of containers kept in memory. If None, all containers are kept
+        in memory. Each container has at most 128KB of ids.
+        :param spill_dir: Directory for the spill file. Default is the system's temporary directory.
+        """
+        self.max_memory_containers = max_memory_containers
+        self.spill_dir = spill_dir
+        self._containers = OrderedDict() if max_memory_containers else {}
+        # Map of key to (offset, length, is bitmap) of containers in the spill file
+        self._spill_index = {}
+        # Keys of containers that have changed since they were spilled
+        self._dirty_keys = set()
+        self._spill_file = None
+        self._other_ids = set()
+        self._len = 0
+        if ids is not None:
+            for photo_id in ids:
+                self.add(photo_id)
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, photo_id):
+        value = _id_value(photo_id)
+        if value is None:
+            return photo_id in self._other_ids
+        if self.max_memory_containers:
+            container = self._container(value >> CONTAINER_BITS)
+        else:
+            container = self._containers.get(value >> CONTAINER_BITS)
+        if container is None:
+            return False
+        low = value & LOW_MASK
+        if type(container) is bytearray:
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        index = bisect_left(container, low)
+        return index != len(container) and container[index] == low
+
+    def __iter__(self):
+        """
+        Iterate over the numeric ids (as strings), in order, followed by the other ids.
+        """
+        for key in sorted(set(self._containers) | set(self._spill_index)):
+            high = key << CONTAINER_BITS
+            container = self._container(key)
+            if type(container) is bytearray:
+                for byte_index, byte in enumerate(container):
+                    if byte:
+                        for bit in range(8):
+                            if byte & (1 << bit):
+                                yield str(high | (byte_index << 3) | bit)
+            else:
+                for low in container:
+                    yield str(high | low)
+        for photo_id in self._other_ids:
+            yield photo_id
+
+    def add(self, photo_id):
+        """
+        Add a photo id.
+        :return: True if the id was added, False if it was already in the set.
+        """
+        value = _id_value(photo_id)
+        if value is None:
+            if photo_id in self._other_ids:
+                return False
+            self._other_ids.add(photo_id)
+            self._len += 1
+            return True
+
+        key = value >> CONTAINER_BITS
+        low = value & LOW_MASK
+        container = self._container(key) if self.max_memory_containers else self._containers.get(key)
+        if container is None:
+            self._put_container(key, array(LOW_TYPECODE, (low,)))
+        elif type(container) is bytearray:
+            byte_index = low >> 3
+            bit = 1 << (low & 7)
+            if container[byte_index] & bit:
+                return False
+            container[byte_index] |= bit
+        else:
+            index = bisect_left(container, low)
+            if index != len(container) and container[index] == low:
+                return False
+            container.insert(index, low)
+            if len(container) > BITMAP_THRESHOLD:
+                self._put_container(key, _to_bitmap(container))
+        if self.max_memory_containers:
+            self._dirty_keys.add(key)
+        self._len += 1
+        return True
+
+    def _container(self, key):
+        container = self._containers.get(key)
+        if not self.max_memory_containers:
+            return container
+        if container is not None:
+            self._containers.move_to_end(key)
+            return container
+        location = self._spill_index.get(key)
+        if location is None:
+            return None
+        offset, length, is_bitmap = location
+        data = os.pread(self._spill_file.fileno(), length, offset)
+        if is_bitmap:
+            container = bytearray(data)
+        else:
+            container = array(LOW_TYPECODE)
+            container.frombytes(data)
+        self._put_container(key, container, dirty=False)
+        return container
+
+    def _put_container(self, key, container, dirty=True):
+        self._containers[key] = container
+        if not self.max_memory_containers:
+            return
+        if dirty:
+            self._dirty_keys.add(key)
+        while len(self._containers) > self.max_memory_containers:
+            self._spill(*self._containers.popitem(last=False))
+
+    def _spill(self, key, container):
+        """
+        Write a container to the spill file, unless it is unchanged since it was last written.
+        """
+        if key not in self._dirty_keys:
+            return
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(dir=self.spill_dir)
+            log.debug("Spilling photo ids to disk")
+        is_bitmap = type(container) is bytearray
+        data = container if is_bitmap else container.tobytes()
+        # Containers are appended, so changed containers leave their old version behind.
+        offset = self._spill_file.seek(0, os.SEEK_END)
+        self._spill_file.write(data)
+        self._spill_file.flush()
+        self._spill_index[key] = (offset, len(data), is_bitmap)
+        self._dirty_keys.discard(key)
+
+    def close(self):
+        """
+        Remove the spill file, if any.
+        """
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._containers.clear()
+        self._spill_index = {}
+        self._dirty_keys = set()
+        self._other_ids = set()
+        self._len = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _to_bitmap(container):
+    bitmap = bytearray(BITMAP_BYTES)
+    for low in container:
+        bitmap[low >> 3] |= 1 << (low & 7)
+    return bitmap
+
+
+def _id_value(photo_id):
+    """
+    Returns the integer value of a numeric photo id or None if it can't be stored as an integer.
+
+    Ids with leading zeros aren't stored as integers, so that they don't collide with the id without them.
+    """
+    if type(photo_id) is str:
+        if NUMERIC_ID_RE.fullmatch(photo_id):
+            value = int(photo_id)
+            return value if value <= MAX_ID else None
+        return None
+    if type(photo_id) is int and 0 <= photo_id <= MAX_ID:
+        return photo_id
+    return None
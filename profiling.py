@@ -0,0 +1,155 @@
+from __future__ import absolute_import
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Number of functions and allocations in the summaries
+TOP_COUNT = 20
+# Number of frames kept for each allocation. More frames is slower, but shows where allocations come from.
+TRACEMALLOC_FRAMES = 1
+
+# Profiled blocks may overlap (e.g., processing a WARC while harvesting), but tracemalloc and the thread profile hook
+# are process-wide. So they are started by the first active block and stopped by the last. Each active block is a list
+# of its profilers.
+_active_blocks = []
+_active_lock = threading.Lock()
+_started_tracemalloc = False
+
+
+def profile_enabled(message):
+    """
+    Returns True if profiling is turned on by the profile option of the message or the FLICKR_PROFILE environment
+    variable.
+    """
+    if (message or {}).get("options", {}).get("profile"):
+        return True
+    return os.environ.get("FLICKR_PROFILE", "").lower() in ("true", "1")
+
+
+@contextmanager
+def profiled(name, output_path, enabled=True, top=TOP_COUNT):
+    """
+    Record a CPU profile (with cProfile) and the top memory allocations (with tracemalloc) of the block.
+
+    Threads started in the block are profiled as well. Writes to output_path:
+      * <name>.prof: The CPU profile, for pstats, snakeviz, etc.
+      * <name>.txt: The functions with the most cumulative time and the top memory allocations.
+    A short summary is logged.
+
+    When not enabled, nothing is done.
+    :param name: Name of the run, e.g., the harvest id. Characters that aren't safe in filenames are replaced.
+    :param output_path: Directory to write to.
+    """
+    if not enabled:
+        yield
+        return
+
+    profilers = [cProfile.Profile()]
+    _start_block(profilers)
+    profilers[0].enable()
+    try:
+        yield
+    finally:
+        profilers[0].disable()
+        try:
+            try:
+                snapshot = tracemalloc.take_snapshot()
+                peak_bytes = tracemalloc.get_traced_memory()[1]
+            finally:
+                _end_block(profilers)
+            _write_profile(re.sub(r"[^\w.-]", "_", name), output_path, profilers, snapshot, peak_bytes, top)
+        except Exception:
+            # Profiling shouldn't fail the run.
+            log.exception("Writing profile of %s failed", name)
+
+
+def _start_block(profilers):
+    global _started_tracemalloc
+    with _active_lock:
+        if not _active_blocks:
+            _started_tracemalloc = not tracemalloc.is_tracing()
+            if _started_tracemalloc:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            threading.setprofile(_profile_thread)
+        _active_blocks.append(profilers)
+
+
+def _end_block(profilers):
+    with _active_lock:
+        _active_blocks[:] = [block_profilers for block_profilers in _active_blocks
+                             if block_profilers is not profilers]
+        if not _active_blocks:
+            threading.setprofile(None)
+            if _started_tracemalloc:
+                tracemalloc.stop()
+
+
+def _profile_thread(frame, event, arg):
+    # Called once in each new thread. Enabling a profiler replaces this hook. The thread belongs to every active block.
+    profiler = cProfile.Profile()
+    with _active_lock:
+        for block_profilers in _active_blocks:
+            block_profilers.append(profiler)
+    profiler.enable()
+
+
+def _write_profile(name, output_path, profilers, snapshot, peak_bytes, top):
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    stats = _profilers_stats(profilers)
+    stats.dump_stats(os.path.join(output_path, "{}.prof".format(name)))
+    stats_text = io.StringIO()
+    stats.stream = stats_text
+    stats.sort_stats("cumulative").print_stats(top)
+    hot_text = io.StringIO()
+    stats.stream = hot_text
+    stats.sort_stats("tottime").print_stats(5)
+
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")))
+    allocations = snapshot.statistics("lineno")[:top]
+    allocations_text = "\n".join(str(allocation) for allocation in allocations)
+
+    profile_filepath = os.path.join(output_path, "{}.txt".format(name))
+    with open(profile_filepath, "w") as f:
+        f.write(stats_text.getvalue())
+        f.write("\nPeak traced memory: {:.1f} MB\nTop memory allocations:\n".format(peak_bytes / 1e6))
+        f.write(allocations_text)
+        f.write("\n")
+
+    log.info("Profile of %s written to %s. Peak traced memory %.1f MB. Hot path:\n%s\nTop allocations:\n%s",
+             name, profile_filepath, peak_bytes / 1e6, _stats_table(hot_text.getvalue()),
+             "\n".join(str(allocation) for allocation in allocations[:5]))
+
+
+def _profilers_stats(profilers):
+    """
+    Returns the stats of the profilers combined.
+    """
+    stats = pstats.Stats(profilers[0], stream=io.StringIO())
+    for profiler in profilers[1:]:
+        try:
+            stats.add(profiler)
+        except TypeError:
+            # A thread that made no calls has no stats.
+            pass
+    return stats
+
+
+def _stats_table(text):
+    """
+    Returns the table of functions from pstats output, without the header.
+    """
+    lines = text.splitlines()
+    for idx, line in enumerate(lines):
+        if line.lstrip().startswith("ncalls"):
+            return "\n".join(lines[idx:]).rstrip()
+    return text.strip()
@@ -178,3 +178,34 @@ size1 = {
     "candownload": 1,
     "canprint": 0
 }
+
+# photo1 as listed by getPublicPhotos with extras for a lite harvest
+photo_lite1 = {
+    "id": "16609036938",
+    "owner": "131866249@N02",
+    "secret": "6ed7e2331e",
+    "server": "8710",
+    "farm": 9,
+    "title": "DSC_0173",
+    "ispublic": 1,
+    "isfriend": 0,
+    "isfamily": 0,
+    "license": "0",
+    "description": {
+        "_content": ""
+    },
+    "originalsecret": "c43658236e",
+    "originalformat": "jpg",
+    "dateupload": "1426191773",
+    "lastupdate": "1426251618",
+    "datetaken": "2013-03-26 05:50:01",
+    "datetakengranularity": "0",
+    "datetakenunknown": "0",
+    "ownername": "justin.littman",
+    "media": "photo",
+    "media_status": "ready",
+    "pathalias": None,
+    "url_o": "https://farm9.staticflickr.com/8710/16609036938_c43658236e_o.jpg",
+    "height_o": "3264",
+    "width_o": "4928"
+}
@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+import tests
+import flickrapi
+from flickrapi.exceptions import FlickrError
+from mock import patch, MagicMock
+from flickr_api import FlickrAPI, TokenBucket, create_session, mount_pool
+
+
+class TestTokenBucket(tests.TestCase):
+    def test_burst(self):
+        bucket = TokenBucket(1, burst=3)
+        for _ in range(3):
+            self.assertEqual(0.0, bucket.acquire())
+        self.assertEqual(0.0, bucket.wait_secs)
+
+    @patch("flickr_api.time.sleep")
+    def test_wait(self, mock_sleep):
+        bucket = TokenBucket(10, burst=1)
+        bucket.acquire()
+        wait_secs = bucket.acquire()
+        self.assertAlmostEqual(0.1, wait_secs, places=2)
+        mock_sleep.assert_called_once_with(wait_secs)
+        self.assertEqual(wait_secs, bucket.wait_secs)
+
+    @patch("flickr_api.time.sleep")
+    def test_pause(self, mock_sleep):
+        bucket = TokenBucket(10, burst=5)
+        bucket.pause(2)
+        self.assertGreater(bucket.acquire(), 2)
+
+
+class TestFlickrAPI(tests.TestCase):
+    def setUp(self):
+        self.api = FlickrAPI("fake key", "fake secret", store_token=False, rate_limit=100, rate_limit_burst=10)
+
+    @patch("flickr_api.time.sleep")
+    @patch.object(flickrapi.FlickrAPI, "do_flickr_call")
+    def test_throttle_response(self, mock_call, mock_sleep):
+        mock_call.side_effect = [{"stat": "fail", "code": 105, "message": "Service currently unavailable"},
+                                 {"stat": "ok"}]
+        self.assertEqual({"stat": "ok"}, self.api.photos.getInfo(photo_id="1", format="parsed-json"))
+        self.assertEqual(2, mock_call.call_count)
+        self.assertEqual(1, self.api.throttle_count)
+        self.assertGreaterEqual(self.api.wait_secs, 1.0)
+
+    @patch("flickr_api.time.sleep")
+    @patch.object(flickrapi.FlickrAPI, "do_flickr_call")
+    def test_throttle_status_code(self, mock_call, mock_sleep):
+        mock_call.side_effect = FlickrError("do_request: Status code 429 received")
+        self.assertRaises(FlickrError, self.api.photos.getInfo, photo_id="1", format="parsed-json")
+        self.assertEqual(5, mock_call.call_count)
+        self.assertEqual(4, self.api.throttle_count)
+
+    @patch.object(flickrapi.FlickrAPI, "do_flickr_call")
+    def test_other_error(self, mock_call):
+        mock_call.side_effect = FlickrError("do_request: Status code 500 received")
+        self.assertRaises(FlickrError, self.api.photos.getInfo, photo_id="1", format="parsed-json")
+        self.assertEqual(1, mock_call.call_count)
+        self.assertEqual(0, self.api.throttle_count)
+
+    def test_session(self):
+        session = MagicMock()
+        session.post.return_value.status_code = 200
+        session.post.return_value.content = b'{"stat": "ok"}'
+        api = FlickrAPI("fake key", "fake secret", store_token=False, session=session)
+
+        self.assertEqual({"stat": "ok"}, api.photos.getInfo(photo_id="1", format="parsed-json"))
+        self.assertEqual(1, session.post.call_count)
+        self.assertEqual("flickr.photos.getInfo", session.post.call_args[1]["params"]["method"])
+
+    def test_session_error(self):
+        session = MagicMock()
+        session.post.return_value.status_code = 500
+        api = FlickrAPI("fake key", "fake secret", store_token=False, session=session)
+
+        self.assertRaises(FlickrError, api.photos.getInfo, photo_id="1", format="parsed-json")
+
+    def test_metrics(self):
+        session = MagicMock()
+        ok_resp = MagicMock(status_code=200, content=b'{"stat": "ok"}')
+        fail_resp = MagicMock(status_code=200, content=b'{"stat": "fail", "code": 1, "message": "Photo not found"}')
+        error_resp = MagicMock(status_code=500, content=b"")
+        session.post.side_effect = [ok_resp, fail_resp, error_resp]
+        api = FlickrAPI("fake key", "fake secret", store_token=False, session=session)
+
+        api.photos.getInfo(photo_id="1", format="parsed-json")
+        api.photos.getInfo(photo_id="2", format="parsed-json")
+        self.assertRaises(FlickrError, api.photos.getSizes, photo_id="1", format="parsed-json")
+
+        summary = api.metrics.summary()
+        self.assertEqual(2, summary["flickr.photos.getInfo"]["count"])
+        self.assertEqual(len(ok_resp.content) + len(fail_resp.content), summary["flickr.photos.getInfo"]["bytes"])
+        self.assertEqual({"1": 1}, summary["flickr.photos.getInfo"]["errors"])
+        self.assertEqual({"http_500": 1}, summary["flickr.photos.getSizes"]["errors"])
+
+        text = api.metrics.prometheus_text()
+        self.assertIn('flickr_api_calls_total{method="flickr.photos.getInfo"} 2', text)
+        self.assertIn('flickr_api_call_duration_seconds_bucket{method="flickr.photos.getInfo",le="0.01"} 2', text)
+        self.assertIn('flickr_api_errors_total{method="flickr.photos.getSizes",code="http_500"} 1', text)
+
+        api.reset_stats()
+        self.assertEqual({}, api.metrics.summary())
+
+    def test_rest_url(self):
+        session = MagicMock()
+        session.post.return_value.status_code = 200
+        session.post.return_value.content = b'{"stat": "ok"}'
+        api = FlickrAPI("fake key", "fake secret", store_token=False, session=session)
+        api.photos.getInfo(photo_id="1", format="parsed-json")
+        self.assertEqual("https://api.flickr.com/services/rest/", session.post.call_args[0][0])
+
+        with patch.dict("os.environ", {"FLICKR_REST_URL": "http://localhost:8080/services/rest/"}):
+            api = FlickrAPI("fake key", "fake secret", store_token=False, session=session)
+        api.photos.getInfo(photo_id="1", format="parsed-json")
+        self.assertEqual("http://localhost:8080/services/rest/", session.post.call_args[0][0])
+
+
+class TestSession(tests.TestCase):
+    def test_pool(self):
+        session = create_session(pool_size=5)
+        self.assertEqual(5, session.get_adapter("https://api.flickr.com/").poolmanager.connection_pool_kw["maxsize"])
+
+        mount_pool(session, 20)
+        self.assertEqual(20, session.pool_size)
+        self.assertEqual(20, session.get_adapter("https://api.flickr.com/").poolmanager.connection_pool_kw["maxsize"])
@@ -1,10 +1,20 @@
 import tests
+import unittest
 import vcr as base_vcr
-from flickr_exporter import FlickrExporter, FlickrPhotoTable
+from mock import patch
+from flickr_exporter import FlickrExporter, FlickrPhotoTable, ROW_FIELDS, posted_date, taken_date, pyarrow, \
+    CODE_PARQUET_EXPORT_ERROR
+from sfmutils.exporter import CODE_NO_WARCS
+import json
 import os
+import petl
+import time
 import tempfile
 import shutil
 from datetime import datetime
+from dateutil.parser import parse as date_parse
+from dateutil.tz import tzutc
+from tests.photo import photo1, photo_lite1
 
 vcr = base_vcr.VCR(
     cassette_library_dir='tests/fixtures',
@@ -87,6 +97,215 @@ class TestFlickrExporter(tests.TestCase):
             lines = f.readlines()
         self.assertEqual(50, len(lines))
 
+    @unittest.skipIf(pyarrow is None, "Skipping because pyarrow not installed")
+    @patch("flickr_exporter.FlickrExporter._send_response_message")
+    @patch("flickr_exporter.FlickrExporter._get_warc_paths")
+    def test_export_parquet(self, mock_get_warc_paths, mock_send_response_message):
+        mock_get_warc_paths.return_value = [os.path.join(
+            self.warc_base_path, "1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                                 "-551fcc0ef48b-8000.warc.gz")]
+        export_message = {
+            "id": "test6",
+            "type": "flickr_user",
+            "collection": {
+                "id": "005b131f5f854402afa2b08a4b7ba960"
+            },
+            "format": "parquet",
+            "segment_size": 20,
+            "path": self.export_path
+        }
+        self.exporter.message = export_message
+        # An earlier export
+        with open(os.path.join(self.export_path, "test6_003.parquet"), "w") as f:
+            f.write("earlier")
+        self.exporter.on_message()
+
+        self.assertTrue(self.exporter.result.success)
+        self.assertEqual(["test6_001.parquet", "test6_002.parquet"], sorted(os.listdir(self.export_path)))
+        self.assertEqual(2, mock_send_response_message.call_count)
+
+    @unittest.skipIf(pyarrow is None, "Skipping because pyarrow not installed")
+    @patch("flickr_exporter.FlickrExporter._send_response_message")
+    @patch("flickr_exporter.FlickrExporter._get_warc_paths")
+    def test_export_parquet_no_warcs(self, mock_get_warc_paths, mock_send_response_message):
+        mock_get_warc_paths.return_value = []
+        self.exporter.message = {
+            "id": "test6",
+            "type": "flickr_user",
+            "collection": {
+                "id": "005b131f5f854402afa2b08a4b7ba960"
+            },
+            "format": "parquet",
+            "path": self.export_path
+        }
+        self.exporter.on_message()
+
+        self.assertFalse(self.exporter.result.success)
+        self.assertEqual(CODE_NO_WARCS, self.exporter.result.errors[0].code)
+        self.assertEqual([], os.listdir(self.export_path))
+
+    @unittest.skipIf(pyarrow is None, "Skipping because pyarrow not installed")
+    @patch("flickr_exporter.FlickrExporter._send_response_message")
+    @patch("flickr_exporter.FlickrExporter._get_warc_paths")
+    def test_export_parquet_failure(self, mock_get_warc_paths, mock_send_response_message):
+        mock_get_warc_paths.return_value = [os.path.join(
+            self.warc_base_path, "1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                                 "-551fcc0ef48b-8000.warc.gz")]
+        self.exporter.message = {
+            "id": "test6",
+            "type": "flickr_user",
+            "collection": {
+                "id": "005b131f5f854402afa2b08a4b7ba960"
+            },
+            "format": "parquet",
+            "segment_size": 20,
+            "path": self.export_path
+        }
+        # Fails after the first segment has been written
+        row = ("1", None, None, None, None, None, None, None, None, None, None, None)
+        with patch("flickr_exporter.FlickrPhotoTable._row", side_effect=[row] * 20 + [Exception("Bad photo")]):
+            self.exporter.on_message()
+
+        self.assertFalse(self.exporter.result.success)
+        self.assertEqual(CODE_PARQUET_EXPORT_ERROR, self.exporter.result.errors[0].code)
+        # No partial export
+        self.assertEqual([], os.listdir(self.export_path))
+
+    @unittest.skipIf(pyarrow is None, "Skipping because pyarrow not installed")
+    @patch("flickr_exporter.FlickrExporter._send_response_message")
+    @patch("flickr_exporter.FlickrExporter._get_warc_paths")
+    def test_export_parquet_parallel(self, mock_get_warc_paths, mock_send_response_message):
+        warc_path = os.path.join(self.warc_base_path,
+                                 "1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                                 "-551fcc0ef48b-8000.warc.gz")
+        mock_get_warc_paths.return_value = [
+            os.path.join(self.warc_base_path, "1/2016/02/22/14/612bc180ec8346c4bbc5aa2c52dcc952-20160222143621927"
+                                              "-00000-37-551fcc0ef48b-8000.warc.gz"),
+            warc_path, warc_path]
+        self.exporter.processes = 2
+        for dedupe, segment_count, row_count in ((False, 4, 70), (True, 3, 41)):
+            export_path = os.path.join(self.export_path, str(dedupe))
+            self.exporter.message = {
+                "id": "test7",
+                "type": "flickr_user",
+                "collection": {
+                    "id": "005b131f5f854402afa2b08a4b7ba960"
+                },
+                "format": "parquet",
+                "segment_size": 20,
+                "dedupe": dedupe,
+                "path": export_path
+            }
+            self.exporter.on_message()
+
+            self.assertTrue(self.exporter.result.success)
+            filenames = sorted(os.listdir(export_path))
+            self.assertEqual(["test7_{}.parquet".format(str(segment).zfill(3)) for segment in
+                              range(1, segment_count + 1)], filenames)
+            photo_ids = []
+            for filename in filenames:
+                photo_ids.extend(pyarrow.parquet.read_table(os.path.join(export_path, filename)).column(
+                    "photo_id").to_pylist())
+            self.assertEqual(row_count, len(photo_ids))
+            if dedupe:
+                self.assertEqual(len(photo_ids), len(set(photo_ids)))
+
+    @unittest.skipIf(pyarrow is None, "Skipping because pyarrow not installed")
+    @patch("flickr_exporter.FlickrExporter._send_response_message")
+    @patch("flickr_exporter.FlickrExporter._get_warc_paths")
+    def test_export_parquet_parallel_warc_iter_processes(self, mock_get_warc_paths, mock_send_response_message):
+        warc_path = os.path.join(self.warc_base_path,
+                                 "1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                                 "-551fcc0ef48b-8000.warc.gz")
+        mock_get_warc_paths.return_value = [warc_path, warc_path]
+        self.exporter.processes = 2
+        self.exporter.message = {
+            "id": "test8",
+            "type": "flickr_user",
+            "collection": {
+                "id": "005b131f5f854402afa2b08a4b7ba960"
+            },
+            "format": "parquet",
+            "dedupe": True,
+            "path": self.export_path
+        }
+        # Workers can't parse WARCs with processes of their own.
+        with patch.dict("os.environ", {"FLICKR_WARC_ITER_PROCESSES": "2"}):
+            self.exporter.on_message()
+
+        self.assertTrue(self.exporter.result.success)
+        filenames = sorted(os.listdir(self.export_path))
+        self.assertEqual(["test8_001.parquet", "test8_002.parquet"], filenames)
+        photo_ids = []
+        for filename in filenames:
+            photo_ids.extend(pyarrow.parquet.read_table(os.path.join(self.export_path, filename)).column(
+                "photo_id").to_pylist())
+        self.assertEqual(len(set(photo_ids)), len(photo_ids))
+
+    @patch("flickr_exporter.FlickrExporter._send_response_message")
+    @patch("flickr_exporter.FlickrExporter._get_warc_paths")
+    def test_export_csv_parallel(self, mock_get_warc_paths, mock_send_response_message):
+        warc_path = os.path.join(self.warc_base_path,
+                                 "1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                                 "-551fcc0ef48b-8000.warc.gz")
+        mock_get_warc_paths.return_value = [
+            os.path.join(self.warc_base_path, "1/2016/02/22/14/612bc180ec8346c4bbc5aa2c52dcc952-20160222143621927"
+                                              "-00000-37-551fcc0ef48b-8000.warc.gz"),
+            warc_path, warc_path]
+        self.exporter.processes = 2
+        for export_format, dedupe, segment_count, row_count in (("csv", False, 4, 70), ("csv", True, 3, 41),
+                                                                ("json", True, 3, 41)):
+            export_path = os.path.join(self.export_path, export_format + str(dedupe))
+            self.exporter.message = {
+                "id": "test9",
+                "type": "flickr_user",
+                "collection": {
+                    "id": "005b131f5f854402afa2b08a4b7ba960"
+                },
+                "format": export_format,
+                "segment_size": 20,
+                "dedupe": dedupe,
+                "path": export_path
+            }
+            self.exporter.on_message()
+
+            self.assertTrue(self.exporter.result.success)
+            filenames = sorted(os.listdir(export_path))
+            self.assertEqual(["test9_{}.{}".format(str(segment).zfill(3), export_format) for segment in
+                              range(1, segment_count + 1)], filenames)
+            photo_ids = []
+            for filename in filenames:
+                filepath = os.path.join(export_path, filename)
+                if export_format == "csv":
+                    photo_ids.extend(petl.values(petl.fromcsv(filepath), "photo_id"))
+                else:
+                    with open(filepath) as f:
+                        photo_ids.extend(json.loads(line)["photo_id"] for line in f)
+            self.assertEqual(row_count, len(photo_ids))
+            if dedupe:
+                self.assertEqual(len(photo_ids), len(set(photo_ids)))
+
+    @patch("flickr_exporter.FlickrExporter._send_response_message")
+    @patch("flickr_exporter.FlickrExporter._get_warc_paths")
+    def test_export_csv_parallel_empty(self, mock_get_warc_paths, mock_send_response_message):
+        mock_get_warc_paths.return_value = [os.path.join(
+            self.warc_base_path, "1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                                 "-551fcc0ef48b-8000.warc.gz")]
+        self.exporter.processes = 2
+        self.exporter.message = {
+            "id": "test10",
+            "type": "flickr_user",
+            "seeds": [{"id": "1", "uid": "missing@N00"}],
+            "format": "csv",
+            "path": self.export_path
+        }
+        self.exporter.on_message()
+
+        self.assertTrue(self.exporter.result.success)
+        # Only a header row
+        self.assertEqual([FlickrPhotoTable._header_row(None)],
+                         list(petl.fromcsv(os.path.join(self.export_path, "test10_001.csv"))))
+
 
 class TestFlickrPhotoTable(tests.TestCase):
     def setUp(self):
@@ -122,3 +341,80 @@ class TestFlickrPhotoTable(tests.TestCase):
         self.assertEqual(3, chunk_count)
         # 1+20, 1+20, 1+1 with total rows 41 and 3 head in each files
         self.assertEqual(44, total_count)
+
+    def test_lite_row(self):
+        table = FlickrPhotoTable(self.warc_paths, False, None, None, None)
+        row = table._row(photo1)
+        lite_row = table._row(photo_lite1)
+        self.assertEqual(len(table._header_row()), len(lite_row))
+        # Safety level isn't available from listing pages
+        self.assertIsNone(lite_row[4])
+        self.assertEqual(row[:4] + row[5:], lite_row[:4] + lite_row[5:])
+
+    def test_to_petl(self):
+        table = FlickrPhotoTable(self.warc_paths, False, None, None, None, segment_row_size=20)
+        export_path = tempfile.mkdtemp()
+        try:
+            filepaths = table.to_petl(petl.tocsv,
+                                      lambda segment: os.path.join(export_path, "test_{}.csv".format(segment)))
+            self.assertEqual([os.path.join(export_path, "test_{}.csv".format(segment)) for segment in (1, 2, 3)],
+                             filepaths)
+            # Same as the segments of the table
+            self.assertEqual([[tuple(map(str, row)) for row in segment] for segment in table],
+                             [list(petl.fromcsv(filepath)) for filepath in filepaths])
+        finally:
+            shutil.rmtree(export_path)
+
+    def test_row_fields(self):
+        table = FlickrPhotoTable(self.warc_paths, False, None, None, None)
+        projected_photo = {field: photo1[field] for field in ROW_FIELDS if field in photo1}
+        self.assertEqual(table._row(photo1), table._row(projected_photo))
+
+    @unittest.skipIf(pyarrow is None, "Skipping because pyarrow not installed")
+    def test_parquet(self):
+        table = FlickrPhotoTable(self.warc_paths, False, None, None, None, segment_row_size=20)
+        export_path = tempfile.mkdtemp()
+        try:
+            filepaths = table.to_parquet(lambda segment: os.path.join(export_path, "test_{}.parquet".format(segment)),
+                                         batch_size=7)
+            self.assertEqual([os.path.join(export_path, "test_{}.parquet".format(segment)) for segment in (1, 2, 3)],
+                             filepaths)
+            parquet_tables = [pyarrow.parquet.read_table(filepath) for filepath in filepaths]
+            self.assertEqual([20, 20, 1], [parquet_table.num_rows for parquet_table in parquet_tables])
+            parquet_table = parquet_tables[0]
+            self.assertEqual(list(table._header_row()), parquet_table.schema.names)
+            self.assertEqual(pyarrow.timestamp("us", tz="UTC"), parquet_table.schema.field("date_posted").type)
+            self.assertEqual(pyarrow.int32(), parquet_table.schema.field("license").type)
+
+            rows = list(table.rows())
+            self.assertEqual(41, len(rows))
+            row = parquet_table.slice(0, 1).to_pylist()[0]
+            self.assertEqual("16610484049", row["photo_id"])
+            self.assertEqual(rows[0][1], row["date_posted"])
+            self.assertEqual(rows[0][2], row["date_taken"])
+            self.assertEqual(int(rows[0][3]), row["license"])
+            self.assertEqual(rows[0][-1], row["photopage"])
+
+            # An empty export still has a file.
+            empty_table = FlickrPhotoTable(self.warc_paths, False, None, None, ["unknown"])
+            filepaths = empty_table.to_parquet(lambda segment: os.path.join(export_path, "empty.parquet"))
+            self.assertEqual(0, pyarrow.parquet.read_table(filepaths[0]).num_rows)
+        finally:
+            shutil.rmtree(export_path)
+
+    def test_dates(self):
+        for posted in ("1426191773", "0", "1426191773.9"):
+            expected = date_parse(time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(float(posted)))).replace(
+                tzinfo=tzutc())
+            self.assertEqual(expected, posted_date(posted))
+            self.assertEqual(str(expected), str(posted_date(posted)))
+        for taken in ("2013-03-26 05:50:01", "2013-03-26", "2013-03-26 5:50:01", "2013-03-26T05:50:01"):
+            self.assertEqual(date_parse(taken), taken_date(taken))
+        self.assertRaises(ValueError, taken_date, "2013-02-30 05:50:01")
+
+    def test_photopage(self):
+        table = FlickrPhotoTable(self.warc_paths, False, None, None, None)
+        photo = dict(photo1, urls={"url": [{"type": "photopage", "_content": "https://example.com/1"},
+                                           {"type": "other", "_content": "https://example.com/2"},
+                                           {"type": "photopage", "_content": "https://example.com/3"}]})
+        self.assertEqual("https://example.com/3", table._row(photo)[-1])
@@ -1,11 +1,12 @@
 import tests
 import vcr as base_vcr
-from flickr_harvester import FlickrHarvester
+from flickr_harvester import FlickrHarvester, LITE_EXTRAS, CODE_PHOTO_CHANGES, CODE_API_METRICS, \
+    CODE_HARVEST_RESUMED, MAX_PER_PAGE, PER_PAGE_MARGIN, DEFAULT_PER_PAGE
 from sfmutils.state_store import DictHarvestStateStore
-from sfmutils.harvester import HarvestResult, CODE_TOKEN_NOT_FOUND, CODE_UID_NOT_FOUND, EXCHANGE, STATUS_RUNNING, \
-    STATUS_SUCCESS
+from sfmutils.harvester import HarvestResult, Msg, CODE_TOKEN_NOT_FOUND, CODE_UID_NOT_FOUND, CODE_UNKNOWN_ERROR, \
+    EXCHANGE, STATUS_RUNNING, STATUS_SUCCESS
 from sfmutils.warc_iter import IterItem
-from flickr_warc_iter import FlickrWarcIter, TYPE_FLICKR_PHOTO, TYPE_FLICKR_SIZES
+from flickr_warc_iter import FlickrWarcIter, TYPE_FLICKR_PHOTO, TYPE_FLICKR_SIZES, TYPE_FLICKR_PHOTO_LITE
 from mock import patch, call, MagicMock
 import unittest
 import time
@@ -15,7 +16,8 @@ import tempfile
 from datetime import datetime, date
 import copy
 import os
-from tests.photo import photo1, size1
+from tests.photo import photo1, size1, photo_lite1
+from user_cache import UserCache
 
 vcr = base_vcr.VCR(
     cassette_library_dir='tests/fixtures',
@@ -41,6 +43,15 @@ base_message = {
 }
 
 
+def mock_api(response_bytes=0):
+    """
+    Returns a mock FlickrAPI.
+    """
+    api = MagicMock()
+    api.last_response_bytes = response_bytes
+    return api
+
+
 class TestFlickrHarvester(tests.TestCase):
     def setUp(self):
         self.working_path = tempfile.mkdtemp()
@@ -68,6 +79,41 @@ class TestFlickrHarvester(tests.TestCase):
         self.assertEqual("justin.littman", self.harvester.result.token_updates["1"])
         self.assertEqual(0, len(self.harvester.result.uids))
 
+    @vcr.use_cassette("test_harvest_nsid")
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_metrics(self, mock_photo_method):
+        metrics_filepath = os.path.join(self.working_path, "metrics.prom")
+        self.harvester.metrics_filepath = metrics_filepath
+        message = copy.deepcopy(base_message)
+        message["seeds"].append({"uid": "131866249@N02", "id": "1"})
+        self.harvester.message = message
+        self.harvester.harvest_seeds()
+
+        metrics_msgs = [msg for msg in self.harvester.result.infos if msg.code == CODE_API_METRICS]
+        self.assertEqual(1, len(metrics_msgs))
+        summary = metrics_msgs[0].extras["methods"]
+        self.assertEqual(["flickr.people.getInfo", "flickr.people.getPublicPhotos"], sorted(summary))
+        self.assertEqual(1, summary["flickr.people.getInfo"]["count"])
+        self.assertEqual(2, summary["flickr.people.getPublicPhotos"]["count"])
+        self.assertGreater(summary["flickr.people.getPublicPhotos"]["bytes"], 0)
+
+        with open(metrics_filepath) as f:
+            metrics = f.read()
+        self.assertIn('flickr_api_calls_total{method="flickr.people.getPublicPhotos"} 2', metrics)
+        self.assertIn('flickr_api_call_duration_seconds_bucket{method="flickr.people.getInfo",le="+Inf"} 1',
+                      metrics)
+
+    @patch.object(FlickrHarvester, "users")
+    def test_harvest_metrics_file_failure(self, mock_users_method):
+        self.harvester.metrics_filepath = os.path.join(self.working_path, "missing", "metrics.prom")
+        self.harvester.message = base_message
+        mock_users_method.side_effect = Exception("Harvest failed")
+
+        # The harvest's exception isn't hidden and the user cache is still saved.
+        with patch.object(FlickrHarvester, "_save_user_cache") as mock_save_user_cache_method:
+            self.assertRaisesRegex(Exception, "Harvest failed", self.harvester.harvest_seeds)
+        mock_save_user_cache_method.assert_called_once_with()
+
     @vcr.use_cassette()
     @patch.object(FlickrHarvester, "_photo")
     def test_harvest_username(self, mock_photo_method):
@@ -194,6 +240,341 @@ class TestFlickrHarvester(tests.TestCase):
         self.assertEqual(1, len(self.harvester.result.warnings))
         self.assertEqual(CODE_UID_NOT_FOUND, self.harvester.result.warnings[0].code)
 
+    @vcr.use_cassette("test_harvest_nsid")
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_concurrency(self, mock_photo_method):
+        message = copy.deepcopy(base_message)
+        message["seeds"].append({"uid": "131866249@N02", "id": "1"})
+        message["options"]["concurrency"] = 4
+        self.harvester.message = message
+        self.harvester.harvest_seeds()
+
+        # Calls to _photo have been mocked out. Check mock.
+        self.assertEqual(12, mock_photo_method.call_count)
+        self.assertIn(call(u'16610484049', u'ee80d9ecdc'), mock_photo_method.mock_calls)
+
+        # Check harvest result
+        self.assertTrue(self.harvester.result.success)
+        self.assertEqual("justin.littman", self.harvester.result.token_updates["1"])
+
+    @patch.object(FlickrHarvester, "_photo")
+    def test_photos_concurrency_failure(self, mock_photo_method):
+        message = copy.deepcopy(base_message)
+        message["options"]["concurrency"] = 2
+        self.harvester.message = message
+        mock_photo_method.side_effect = Exception("Connection reset")
+
+        photo_ids = [(str(photo_id), "secret") for photo_id in range(100)]
+        self.assertRaises(Exception, self.harvester._photos, photo_ids)
+        # Stopped early rather than harvesting every photo
+        self.assertLess(mock_photo_method.call_count, 100)
+
+    @patch.object(FlickrHarvester, "_user")
+    def test_harvest_seed_concurrency(self, mock_user_method):
+        message = copy.deepcopy(base_message)
+        message["seeds"].extend([{"token": "user{}".format(idx), "id": str(idx)} for idx in range(1, 6)])
+        message["options"]["seed_concurrency"] = 3
+        message["options"]["fail_fast"] = False
+        self.harvester.message = message
+
+        def harvest_user(seed_id, username, nsid, incremental, result):
+            if seed_id == "2":
+                result.errors.append(Msg(CODE_UNKNOWN_ERROR, "Error returned by API"))
+                result.success = False
+            else:
+                result.uids[seed_id] = "nsid{}".format(seed_id)
+                result.warnings.append(Msg(CODE_UID_NOT_FOUND, "Warning", seed_id=seed_id))
+
+        mock_user_method.side_effect = harvest_user
+
+        self.harvester.harvest_seeds()
+
+        # Other seeds were finished
+        self.assertEqual(5, mock_user_method.call_count)
+        self.assertFalse(self.harvester.result.success)
+        self.assertEqual(1, len(self.harvester.result.errors))
+        self.assertEqual({"1": "nsid1", "3": "nsid3", "4": "nsid4", "5": "nsid5"}, self.harvester.result.uids)
+        # Merged in seed order
+        self.assertEqual(["1", "3", "4", "5"], [msg.extras["seed_id"] for msg in self.harvester.result.warnings])
+
+    @patch.object(FlickrHarvester, "_user")
+    def test_harvest_seed_fail_fast(self, mock_user_method):
+        message = copy.deepcopy(base_message)
+        message["seeds"].extend([{"token": "user{}".format(idx), "id": str(idx)} for idx in range(1, 6)])
+        self.harvester.message = message
+        mock_user_method.side_effect = Exception("Connection reset")
+
+        self.assertRaises(Exception, self.harvester.harvest_seeds)
+        self.assertEqual(1, mock_user_method.call_count)
+
+    def test_public_photos(self):
+        self.harvester.message = base_message
+        self.harvester.api = mock_api()
+        self.harvester.api.people.getPublicPhotos.side_effect = [
+            {"photos": {"pages": 3, "photo": [{"id": "6", "secret": "f"}, {"id": "5", "secret": "e"}]}},
+            {"photos": {"pages": 3, "photo": [{"id": "4", "secret": "d"}, {"id": "3", "secret": "c"}]}},
+            {"photos": {"pages": 3, "photo": [{"id": "2", "secret": "b"}, {"id": "1", "secret": "a"}]}}
+        ]
+
+        photos = self.harvester._public_photos("131866249@N02", last_photo_id="3")
+        self.assertEqual(["6", "5", "4"], [photo["id"] for photo in photos])
+        # Stopped paging when reached last photo
+        self.assertEqual(2, self.harvester.api.people.getPublicPhotos.call_count)
+
+    def test_public_photos_relisted(self):
+        self.harvester.message = base_message
+        self.harvester.api = mock_api()
+        # Photo 7 was uploaded during the harvest, so photo 4 is listed again.
+        self.harvester.api.people.getPublicPhotos.side_effect = [
+            {"photos": {"pages": 2, "photo": [{"id": "6", "secret": "f"}, {"id": "5", "secret": "e"},
+                                              {"id": "4", "secret": "d"}]}},
+            {"photos": {"pages": 2, "photo": [{"id": "4", "secret": "d"}, {"id": "3", "secret": "c"},
+                                              {"id": "2", "secret": "b"}]}}
+        ]
+
+        photos = self.harvester._public_photos("131866249@N02")
+        self.assertEqual(["6", "5", "4", "3", "2"], [photo["id"] for photo in photos])
+
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_resume(self, mock_photo_method):
+        message = copy.deepcopy(base_message)
+        message["options"]["incremental"] = False
+        message["options"]["skip_unchanged"] = False
+        self.harvester.message = message
+        self.harvester.api = mock_api()
+        self.harvester.api.people.getInfo.return_value = {"stat": "ok",
+                                                          "person": {"username": {"_content": "justin.littman"}}}
+        pages = {1: [{"id": "6", "secret": "f"}, {"id": "5", "secret": "e"}],
+                 2: [{"id": "4", "secret": "d"}, {"id": "3", "secret": "c"}],
+                 3: [{"id": "2", "secret": "b"}, {"id": "1", "secret": "a"}]}
+        self.harvester.api.people.getPublicPhotos.side_effect = lambda page, **kwargs: {
+            "photos": {"pages": 3, "photo": pages[page]}}
+        # Harvesting photo 4 fails the first time.
+        mock_photo_method.side_effect = [None, None, Exception("Connection reset")]
+
+        self.assertRaises(Exception, self.harvester._user, "1", "justin.littman", "131866249@N02", False)
+        checkpoint = self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.checkpoint")
+        self.assertEqual({"harvest_id": "test:1", "page": 1, "per_page": 6, "last_photo_id": None,
+                          "last_posted": None, "photo_ids": ["5", "6"]},
+                         checkpoint)
+
+        # Retry
+        mock_photo_method.reset_mock()
+        mock_photo_method.side_effect = None
+        self.harvester.api.people.getPublicPhotos.reset_mock()
+        self.harvester._user("1", "justin.littman", "131866249@N02", False)
+
+        self.assertEqual(2, self.harvester.api.people.getPublicPhotos.call_args_list[0][1]["page"])
+        self.assertEqual([call("4", "d"), call("3", "c"), call("2", "b"), call("1", "a")],
+                         mock_photo_method.mock_calls)
+        self.assertIsNone(self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.checkpoint"))
+        resumed_msg = self.harvester.result.infos[-1]
+        self.assertEqual(CODE_HARVEST_RESUMED, resumed_msg.code)
+        self.assertEqual({"seed_id": "1", "resumed_page": 1, "resumed_photos": 2, "fresh_photos": 4,
+                          "saved_calls": 5}, resumed_msg.extras)
+
+        # A checkpoint from another harvest is not resumed.
+        self.harvester.state_store.set_state("flickr_harvester", "131866249@N02.checkpoint", checkpoint)
+        self.harvester.message = dict(message, id="test:2")
+        mock_photo_method.reset_mock()
+        self.harvester._user("1", "justin.littman", "131866249@N02", False)
+        self.assertEqual(6, mock_photo_method.call_count)
+
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_resume_incremental(self, mock_photo_method):
+        self.harvester.message = base_message
+        self.harvester.api = mock_api()
+        self.harvester.api.people.getInfo.return_value = {"stat": "ok",
+                                                          "person": {"username": {"_content": "justin.littman"}}}
+        pages = {1: [{"id": "6", "secret": "f"}, {"id": "5", "secret": "e"}],
+                 2: [{"id": "4", "secret": "d"}, {"id": "3", "secret": "c"}],
+                 3: [{"id": "2", "secret": "b"}, {"id": "1", "secret": "a"}]}
+        self.harvester.api.people.getPublicPhotos.side_effect = lambda page, **kwargs: {
+            "photos": {"pages": 3, "photo": pages[page]}}
+        self.harvester.state_store.set_state("flickr_harvester", "131866249@N02.last_photo_id", "3")
+        # Harvesting photo 4 fails the first time.
+        mock_photo_method.side_effect = [None, None, Exception("Connection reset")]
+        self.assertRaises(Exception, self.harvester._user, "1", "justin.littman", "131866249@N02", True)
+
+        # Processing the WARCs of the failed try moves the marker.
+        self.harvester.state_store.set_state("flickr_harvester", "131866249@N02.last_photo_id", "6")
+
+        # Retry stops at the marker the seed started with.
+        mock_photo_method.reset_mock()
+        mock_photo_method.side_effect = None
+        self.harvester._user("1", "justin.littman", "131866249@N02", True)
+        self.assertEqual([call("4", "d")], mock_photo_method.mock_calls)
+
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_incremental_last_photo(self, mock_photo_method):
+        self.harvester.message = base_message
+        self.harvester.api = mock_api()
+        self.harvester.api.people.getInfo.return_value = {"stat": "ok",
+                                                          "person": {"username": {"_content": "justin.littman"}}}
+        self.harvester.api.people.getPublicPhotos.return_value = {
+            "photos": {"pages": 1, "photo": [{"id": "16610484049", "secret": "ee80d9ecdc"},
+                                             {"id": "16609036938", "secret": "6ed7e2331e"}]}}
+
+        # Set state
+        self.harvester.state_store.set_state("flickr_harvester", "131866249@N02.last_photo_id", "16609036938")
+        self.harvester.state_store.set_state("flickr_harvester", "131866249@N02.last_posted", "1426191773")
+
+        self.harvester._user("1", "justin.littman", "131866249@N02", True)
+
+        self.harvester.api.people.getPublicPhotos.assert_called_once_with(user_id="131866249@N02",
+                                                                          format="parsed-json", page=1, per_page=6,
+                                                                          extras=None)
+        mock_photo_method.assert_called_once_with("16610484049", "ee80d9ecdc")
+
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_user_cache(self, mock_photo_method):
+        self.harvester.message = base_message
+        self.harvester.api = mock_api()
+        self.harvester.api.people.findByUsername.return_value = {"stat": "ok", "user": {"nsid": "131866249@N02"}}
+        self.harvester.api.people.getInfo.return_value = {"stat": "ok",
+                                                          "person": {"username": {"_content": "justin.littman"}}}
+        self.harvester.api.people.getPublicPhotos.return_value = {"photos": {"pages": 1, "photo": []}}
+
+        self.harvester._user("1", "justin.littman", None, True)
+        self.harvester._user("1", "justin.littman", None, True)
+
+        # Looked up once
+        self.harvester.api.people.findByUsername.assert_called_once_with(username="justin.littman",
+                                                                         format="parsed-json")
+        self.harvester.api.people.getInfo.assert_called_once_with(user_id="131866249@N02", format="parsed-json")
+        self.assertEqual({"1": "131866249@N02"}, self.harvester.result.uids)
+        self.assertEqual({}, self.harvester.result.token_updates)
+
+        # Username change is detected once the cache expires.
+        self.harvester.api.people.getInfo.return_value = {"stat": "ok",
+                                                          "person": {"username": {"_content": "new.littman"}}}
+        with patch("user_cache.time.time", return_value=time.time() + self.harvester.user_cache.ttl_secs):
+            self.harvester._user("1", "justin.littman", None, True)
+        self.assertEqual(2, self.harvester.api.people.findByUsername.call_count)
+        self.assertEqual(2, self.harvester.api.people.getInfo.call_count)
+        self.assertEqual({"1": "new.littman"}, self.harvester.result.token_updates)
+
+        # Saved with the harvest and shared with other harvesters of the working path
+        self.harvester._save_user_cache()
+        self.assertTrue(os.path.exists(os.path.join(self.working_path, "user_cache.json")))
+        self.assertIs(self.harvester.user_cache, FlickrHarvester(self.working_path).user_cache)
+
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_adaptive_per_page(self, mock_photo_method):
+        self.harvester.per_page = None
+        # Photo counts are from getInfo, not the cache.
+        self.harvester.user_cache = UserCache(ttl_secs=0)
+        self.harvester.message = base_message
+        self.harvester.api = mock_api(response_bytes=1000)
+        self.harvester.api.people.getInfo.return_value = {
+            "stat": "ok", "person": {"username": {"_content": "justin.littman"}, "photos": {"count": {"_content": 42}}}}
+        self.harvester.api.people.getPublicPhotos.return_value = {
+            "photos": {"pages": 1, "photo": [{"id": "16610484049", "secret": "ee80d9ecdc"}]}}
+
+        # First harvest lists all of the photos.
+        self.harvester._user("1", "justin.littman", "131866249@N02", True)
+        self.assertEqual(42 + PER_PAGE_MARGIN, self.harvester.api.people.getPublicPhotos.call_args[1]["per_page"])
+        self.assertEqual(42, self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.photo_count"))
+        self.assertEqual({"131866249@N02": {"per_page": 42 + PER_PAGE_MARGIN, "calls": 1, "bytes": 1000, "photos": 1}},
+                         self.harvester._listings)
+
+        # Incremental harvest lists the photos added since.
+        self.harvester.api.people.getInfo.return_value["person"]["photos"]["count"]["_content"] = 45
+        self.harvester._user("1", "justin.littman", "131866249@N02", True)
+        self.assertEqual(3 + PER_PAGE_MARGIN, self.harvester.api.people.getPublicPhotos.call_args[1]["per_page"])
+
+        # When no photos are expected (e.g., as many deleted as added), Flickr's default is the smallest page.
+        self.harvester._user("1", "justin.littman", "131866249@N02", True)
+        self.assertEqual(DEFAULT_PER_PAGE, self.harvester.api.people.getPublicPhotos.call_args[1]["per_page"])
+
+        # Not incremental lists at most the maximum.
+        self.harvester.api.people.getInfo.return_value["person"]["photos"]["count"]["_content"] = 5000
+        self.harvester._user("1", "justin.littman", "131866249@N02", False)
+        self.assertEqual(MAX_PER_PAGE, self.harvester.api.people.getPublicPhotos.call_args[1]["per_page"])
+
+        # Configured page size is always used.
+        self.harvester.per_page = 6
+        self.harvester._user("1", "justin.littman", "131866249@N02", False)
+        self.assertEqual(6, self.harvester.api.people.getPublicPhotos.call_args[1]["per_page"])
+
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_cached_per_page(self, mock_photo_method):
+        self.harvester.per_page = None
+        self.harvester.message = base_message
+        self.harvester.api = mock_api()
+        self.harvester.api.people.getInfo.return_value = {
+            "stat": "ok", "person": {"username": {"_content": "justin.littman"}, "photos": {"count": {"_content": 42}}}}
+        self.harvester.api.people.getPublicPhotos.return_value = {
+            "photos": {"pages": 1, "total": "42", "photo": [{"id": "16610484049", "secret": "ee80d9ecdc"}]}}
+        self.harvester._user("1", "justin.littman", "131866249@N02", True)
+        self.assertEqual(42 + PER_PAGE_MARGIN, self.harvester.api.people.getPublicPhotos.call_args[1]["per_page"])
+
+        # The cached count is out of date, so the count is refreshed from the listing.
+        self.harvester.api.people.getPublicPhotos.return_value["photos"]["total"] = "47"
+        self.harvester._user("1", "justin.littman", "131866249@N02", True)
+        self.harvester.api.people.getInfo.assert_called_once_with(user_id="131866249@N02", format="parsed-json")
+        # Without photos added between harvests to go by, Flickr's default is used.
+        self.assertEqual(DEFAULT_PER_PAGE, self.harvester.api.people.getPublicPhotos.call_args[1]["per_page"])
+        self.assertEqual(47, self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.photo_count"))
+        self.assertEqual(5, self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.photo_delta"))
+
+        # Then as many photos are expected as were added between the last two harvests.
+        self.harvester._user("1", "justin.littman", "131866249@N02", True)
+        self.assertEqual(5 + PER_PAGE_MARGIN, self.harvester.api.people.getPublicPhotos.call_args[1]["per_page"])
+
+        # Not incremental expects all of the photos, as of the last harvest.
+        self.harvester._user("1", "justin.littman", "131866249@N02", False)
+        self.assertEqual(47 + PER_PAGE_MARGIN, self.harvester.api.people.getPublicPhotos.call_args[1]["per_page"])
+        self.harvester.api.people.getInfo.assert_called_once_with(user_id="131866249@N02", format="parsed-json")
+
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_lite(self, mock_photo_method):
+        message = copy.deepcopy(base_message)
+        message["options"]["lite"] = True
+        self.harvester.message = message
+        self.harvester.api = mock_api()
+        self.harvester.api.people.getInfo.return_value = {"stat": "ok",
+                                                          "person": {"username": {"_content": "justin.littman"}}}
+        self.harvester.api.people.getPublicPhotos.return_value = {"photos": {"pages": 1, "photo": [photo_lite1]}}
+
+        self.harvester._user("1", "justin.littman", "131866249@N02", False)
+
+        self.assertEqual(LITE_EXTRAS, self.harvester.api.people.getPublicPhotos.call_args[1]["extras"])
+        # No calls per photo
+        mock_photo_method.assert_not_called()
+        self.assertEqual(1, self.harvester.result.harvest_counter["flickr photos"])
+
+        # Incremental harvests record the last photo of the previous harvest for processing the listing pages.
+        self.harvester.state_store.set_state("flickr_harvester", "131866249@N02.last_posted", "1426191700")
+        self.harvester._user("1", "justin.littman", "131866249@N02", True)
+        self.assertEqual({"131866249@N02": 1426191700}, self.harvester._lite_markers)
+
+    @patch.object(FlickrHarvester, "_photo")
+    def test_harvest_skip_unchanged(self, mock_photo_method):
+        message = copy.deepcopy(base_message)
+        message["options"]["incremental"] = False
+        self.harvester.message = message
+        self.harvester.api = mock_api()
+        self.harvester.api.people.getInfo.return_value = {"stat": "ok",
+                                                          "person": {"username": {"_content": "justin.littman"}}}
+        self.harvester.api.people.getPublicPhotos.return_value = {"photos": {"pages": 1, "photo": [
+            {"id": "3", "secret": "c", "lastupdate": "1426251618"},
+            {"id": "2", "secret": "b", "lastupdate": "1426251618"},
+            {"id": "1", "secret": "a", "lastupdate": "1426251618"}]}}
+
+        # Set state
+        self.harvester.state_store.set_state("flickr_harvester", "131866249@N02.photo_updates",
+                                             {"2": "1426251600", "1": "1426251618"})
+
+        self.harvester._user("1", "justin.littman", "131866249@N02", False)
+
+        self.assertEqual("last_update", self.harvester.api.people.getPublicPhotos.call_args[1]["extras"])
+        self.assertEqual([call("3", "c"), call("2", "b")], mock_photo_method.mock_calls)
+        self.assertEqual(1, len(self.harvester.result.infos))
+        self.assertEqual(CODE_PHOTO_CHANGES, self.harvester.result.infos[0].code)
+        self.assertEqual("1 new, 1 changed, and 1 unchanged photos for 131866249@N02",
+                         self.harvester.result.infos[0].message)
+
     @vcr.use_cassette()
     def test_photo(self):
         self.harvester.message = base_message
@@ -204,6 +585,24 @@ class TestFlickrHarvester(tests.TestCase):
         self.assertTrue(self.harvester.result.success)
         self.assertEqual(1, self.harvester.result.harvest_counter["flickr photos"])
 
+    def test_create_api(self):
+        message = copy.deepcopy(base_message)
+        message["options"]["concurrency"] = 8
+        message["options"]["seed_concurrency"] = 2
+        self.harvester.message = message
+        self.harvester._create_api()
+        api = self.harvester.api
+        self.assertEqual(18, self.harvester.session.pool_size)
+
+        # API and session are reused for the next harvest
+        message = copy.deepcopy(base_message)
+        message["options"]["rate_limit"] = 1
+        self.harvester.message = message
+        self.harvester._create_api()
+        self.assertIs(api, self.harvester.api)
+        self.assertIs(self.harvester.session, self.harvester.api.flickr_oauth.session)
+        self.assertEqual(1, self.harvester.api.bucket.rate)
+
     @patch("flickr_harvester.FlickrWarcIter", autospec=True)
     def test_process(self, iter_class):
         message = copy.deepcopy(base_message)
@@ -223,6 +622,92 @@ class TestFlickrHarvester(tests.TestCase):
         # Check state store
         self.assertEqual("16609036938",
                          self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.last_photo_id"))
+        self.assertEqual("1426191773",
+                         self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.last_posted"))
+
+    @patch("flickr_harvester.FlickrWarcIter", autospec=True)
+    def test_process_newest(self, iter_class):
+        self.harvester.message = base_message
+        self.harvester.state_store = MagicMock(spec=DictHarvestStateStore)
+        self.harvester.state_store.get_state.return_value = None
+
+        newer_photo = copy.deepcopy(photo1)
+        newer_photo["id"] = "16610484049"
+        newer_photo["dates"]["posted"] = "1426191780"
+        older_photo = copy.deepcopy(photo1)
+        older_photo["id"] = "16609036937"
+        older_photo["dates"]["posted"] = "1426191700"
+
+        mock_iter = MagicMock(spec=FlickrWarcIter)
+        mock_iter.__iter__.side_effect = [[IterItem(TYPE_FLICKR_PHOTO, None, None, None, photo1),
+                                           IterItem(TYPE_FLICKR_PHOTO, None, None, None, newer_photo),
+                                           IterItem(TYPE_FLICKR_SIZES, None, None, None, size1),
+                                           IterItem(TYPE_FLICKR_PHOTO, None, None, None, older_photo)].__iter__()]
+        iter_class.side_effect = [mock_iter]
+
+        self.harvester.process_warc("test.warc.gz")
+
+        self.assertEqual(3, self.harvester.result.stats_summary()["flickr photos"])
+        # State written once, for the most recently posted photo
+        self.assertEqual([call("flickr_harvester", "131866249@N02.last_photo_id", "16610484049"),
+                          call("flickr_harvester", "131866249@N02.last_posted", "1426191780")],
+                         self.harvester.state_store.set_state.mock_calls)
+
+    @patch("flickr_harvester.FlickrWarcIter", autospec=True)
+    def test_process_photo_updates(self, iter_class):
+        message = copy.deepcopy(base_message)
+        message["options"]["incremental"] = False
+        self.harvester.message = message
+
+        mock_iter = MagicMock(spec=FlickrWarcIter)
+        mock_iter.__iter__.side_effect = [[IterItem(TYPE_FLICKR_PHOTO, None, None, None, photo1)].__iter__()]
+        iter_class.side_effect = [mock_iter]
+
+        # Set state
+        self.harvester.state_store.set_state("flickr_harvester", "131866249@N02.photo_updates", {"1": "1426251600"})
+
+        self.harvester.process_warc("test.warc.gz")
+
+        self.assertEqual({"1": "1426251600", "16609036938": "1426251618"},
+                         self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.photo_updates"))
+        # Incremental state isn't updated
+        self.assertIsNone(self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.last_photo_id"))
+
+    @patch("flickr_harvester.FlickrWarcIter", autospec=True)
+    def test_process_lite(self, iter_class):
+        self.harvester.message = base_message
+
+        mock_iter = MagicMock(spec=FlickrWarcIter)
+        mock_iter.__iter__.side_effect = [[IterItem(TYPE_FLICKR_PHOTO_LITE, None, None, None, photo_lite1)].__iter__()]
+        iter_class.side_effect = [mock_iter]
+
+        self.harvester.process_warc("test.warc.gz")
+
+        self.assertEqual(1, self.harvester.result.stats_summary()["flickr photos"])
+        self.assertEqual("16609036938",
+                         self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.last_photo_id"))
+        self.assertEqual("1426191773",
+                         self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.last_posted"))
+
+    @patch("flickr_harvester.FlickrWarcIter", autospec=True)
+    def test_process_lite_not_harvested(self, iter_class):
+        self.harvester.message = base_message
+        # The last photo of the previous harvest
+        self.harvester._lite_markers["131866249@N02"] = 1426191773
+
+        new_photo = dict(photo_lite1, id="16610484049", dateupload="1426191780")
+        older_photo = dict(photo_lite1, id="16609036937", dateupload="1426191700")
+        mock_iter = MagicMock(spec=FlickrWarcIter)
+        # The new photo is listed again on the next page, which also has the last photo and an older photo.
+        mock_iter.__iter__.side_effect = [[IterItem(TYPE_FLICKR_PHOTO_LITE, None, None, None, photo)
+                                           for photo in (new_photo, new_photo, photo_lite1, older_photo)].__iter__()]
+        iter_class.side_effect = [mock_iter]
+
+        self.harvester.process_warc("test.warc.gz")
+
+        self.assertEqual(1, self.harvester.result.stats_summary()["flickr photos"])
+        self.assertEqual("16610484049",
+                         self.harvester.state_store.get_state("flickr_harvester", "131866249@N02.last_photo_id"))
 
 
 @unittest.skipIf(not tests.test_config_available, "Skipping test since test config not available.")
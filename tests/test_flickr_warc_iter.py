@@ -1,6 +1,15 @@
 from __future__ import absolute_import
 import tests
-from flickr_warc_iter import FlickrWarcIter, TYPE_FLICKR_PHOTO
+import os
+import shutil
+import tempfile
+from datetime import datetime
+import pytz
+from mock import patch
+from sfmutils.warc_iter import IterItem
+from flickr_warc_iter import FlickrWarcIter, TYPE_FLICKR_PHOTO, TYPE_FLICKR_PHOTO_LITE, TYPE_FLICKR_SIZES, \
+    DECODERS, build_index, load_index
+from tests.photo import photo_lite1
 
 
 class TestFlickrWarcIter(tests.TestCase):
@@ -16,3 +25,177 @@ class TestFlickrWarcIter(tests.TestCase):
         self.assertEqual("16610484049", photos[0][1])
         # Datetime is aware
         self.assertIsNotNone(photos[0][2].tzinfo)
+
+    def test_processes(self):
+        filepaths = (self.filepaths,
+                     "tests/warcs/1/2016/02/22/14/d8ecf0efa0fa49819f907930bb766f69-20160222143902368-00000-70"
+                     "-551fcc0ef48b-8000.warc.gz",
+                     "tests/warcs/1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                     "-551fcc0ef48b-8000.warc.gz",
+                     self.filepaths)
+        serial_items = list(FlickrWarcIter(filepaths, processes=1).iter(limit_item_types=[TYPE_FLICKR_PHOTO],
+                                                                        dedupe=True))
+        parallel_items = list(FlickrWarcIter(filepaths, processes=2).iter(limit_item_types=[TYPE_FLICKR_PHOTO],
+                                                                          dedupe=True))
+        self.assertTrue(serial_items)
+        self.assertEqual(serial_items, parallel_items)
+
+        # Items are sent back from the workers in chunks, with more files than processes.
+        with patch("flickr_warc_iter.PARALLEL_CHUNK_SIZE", 5):
+            self.assertEqual(list(FlickrWarcIter(filepaths, processes=1).iter()),
+                             list(FlickrWarcIter(filepaths, processes=3).iter()))
+
+    def test_processes_error(self):
+        warc_iter = FlickrWarcIter((self.filepaths, "tests/warcs/missing.warc.gz"), processes=2)
+        with self.assertRaises(IOError):
+            list(warc_iter.iter())
+
+    def test_lite(self):
+        url = ("https://api.flickr.com/services/rest/?user_id=131866249%40N02&format=json&nojsoncallback=1"
+               "&method=flickr.people.getPublicPhotos&page=1&extras=description%2Clicense%2Cdate_upload")
+        warc_iter = FlickrWarcIter(self.filepaths)
+        self.assertTrue(warc_iter._select_record(url))
+        items = list(warc_iter._item_iter(url, {"stat": "ok", "photos": {"pages": 1, "photo": [photo_lite1]}}))
+        self.assertEqual(1, len(items))
+        self.assertEqual(TYPE_FLICKR_PHOTO_LITE, items[0][0])
+        self.assertEqual("16609036938", items[0][1])
+        self.assertIsNotNone(items[0][2].tzinfo)
+
+        # Listing pages without extras are not selected
+        self.assertFalse(warc_iter._select_record(url.split("&extras")[0]))
+        # Nor are listing pages of other harvests with extras
+        self.assertFalse(warc_iter._select_record(url.split("&extras")[0] + "&extras=last_update"))
+
+    def test_prefilter(self):
+        filepath = ("tests/warcs/1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                    "-551fcc0ef48b-8000.warc.gz")
+        item_date_start = datetime(2012, 8, 24, 17, 55, 10, tzinfo=pytz.utc)
+        rejected = []
+        for limit_owner_nsids in (None, ["85779209@N08"], ["23972344@N05"]):
+            warc_iter = FlickrWarcIter(filepath, limit_owner_nsids=limit_owner_nsids, use_index=False)
+            items = list(warc_iter.iter(item_date_start=item_date_start))
+            with patch.object(FlickrWarcIter, "_prefilter", return_value=None):
+                self.assertEqual(items, list(FlickrWarcIter(filepath, limit_owner_nsids=limit_owner_nsids,
+                                                            use_index=False).iter(item_date_start=item_date_start)))
+            rejected.append(dict(warc_iter.rejected))
+        self.assertEqual([{"date": 16}, {"date": 16, "owner": 29}, {"owner": 58}], rejected)
+
+        warc_iter = FlickrWarcIter(filepath, use_index=False)
+        self.assertEqual(29, len(list(warc_iter.iter(limit_item_types=[TYPE_FLICKR_PHOTO]))))
+        # Sizes are rejected without decoding
+        self.assertEqual(29, warc_iter.rejected["item_type"])
+
+    def test_join_sizes(self):
+        filepath = ("tests/warcs/1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                    "-551fcc0ef48b-8000.warc.gz")
+        photos = list(FlickrWarcIter(filepath, use_index=False).iter(limit_item_types=[TYPE_FLICKR_PHOTO]))
+        for limit_owner_nsids in (None, ["85779209@N08"]):
+            items = list(FlickrWarcIter(filepath, limit_owner_nsids=limit_owner_nsids, use_index=False,
+                                        join_sizes=True, join_buffer_size=2).iter())
+            self.assertEqual([photo.id for photo in photos], [item.id for item in items])
+            self.assertTrue(all(item.type == TYPE_FLICKR_PHOTO for item in items))
+            self.assertEqual("Square", items[0].item["sizes"]["size"][0]["label"])
+            self.assertEqual(photos[0].item["dates"], items[0].item["dates"])
+        self.assertFalse(list(FlickrWarcIter(filepath, limit_owner_nsids=["23972344@N05"], use_index=False,
+                                             join_sizes=True).iter()))
+
+    def test_join_unmatched(self):
+        photo1 = IterItem(TYPE_FLICKR_PHOTO, "1", None, None, {"id": "1"})
+        photo2 = IterItem(TYPE_FLICKR_PHOTO, "2", None, None, {"id": "2"})
+        sizes1 = IterItem(TYPE_FLICKR_SIZES, "1", None, None, {"size": []})
+        sizes2 = IterItem(TYPE_FLICKR_SIZES, "2", None, None, {"size": []})
+        warc_iter = FlickrWarcIter(self.filepaths, join_sizes=True, join_buffer_size=1)
+        self.assertEqual([{"id": "1", "sizes": None}, {"id": "2", "sizes": None}, sizes1.item, sizes2.item],
+                         [item.item for item in warc_iter._join([photo1, photo2, sizes1, sizes2])])
+
+        warc_iter = FlickrWarcIter(self.filepaths, join_sizes=True, join_buffer_size=2)
+        self.assertEqual([{"id": "1", "sizes": sizes1.item}, {"id": "2", "sizes": sizes2.item}],
+                         [item.item for item in warc_iter._join([photo1, photo2, sizes1, sizes2])])
+
+        # Unmatched sizes are dropped when limiting by owner
+        warc_iter = FlickrWarcIter(self.filepaths, limit_owner_nsids=["1@N01"], join_sizes=True)
+        self.assertEqual([], list(warc_iter._join([sizes1])))
+
+    def test_decoders(self):
+        items = list(FlickrWarcIter(self.filepaths, decoder="json").iter())
+        for decoder in DECODERS:
+            self.assertEqual(items, list(FlickrWarcIter(self.filepaths, decoder=decoder).iter()))
+        # Unknown decoder falls back to json
+        self.assertEqual("json", FlickrWarcIter(self.filepaths, decoder="unknown").decoder)
+
+    def test_fields(self):
+        items = list(FlickrWarcIter(self.filepaths).iter())
+        projected_items = list(FlickrWarcIter(self.filepaths, fields=("id", "dates")).iter())
+        self.assertEqual(len(items), len(projected_items))
+        for item, projected_item in zip(items, projected_items):
+            self.assertEqual(item[:4], projected_item[:4])
+            if item.type == TYPE_FLICKR_PHOTO:
+                self.assertEqual({"id": item.item["id"], "dates": item.item["dates"]}, projected_item.item)
+            else:
+                self.assertEqual(item.item, projected_item.item)
+
+    def test_shard(self):
+        items = list(FlickrWarcIter(self.filepaths).iter())
+        shard_items = [list(FlickrWarcIter(self.filepaths, shard=(index, 3)).iter()) for index in range(3)]
+        self.assertTrue(all(shard_items))
+        self.assertEqual(sorted(items), sorted(item for items in shard_items for item in items))
+
+        warc_iter = FlickrWarcIter(self.filepaths, shard=(0, 3))
+        list(warc_iter.iter())
+        # Rejected before decoding
+        self.assertEqual(len(items) - len(shard_items[0]), warc_iter.rejected["shard"])
+
+
+class TestFlickrWarcIterIndex(tests.TestCase):
+    def setUp(self):
+        self.working_path = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.working_path, "test.warc.gz")
+        shutil.copy2("tests/warcs/1/2016/02/22/15/c4ec6bc7112f4696b1f9372100ab93bb-20160222154659265-00000-286"
+                     "-551fcc0ef48b-8000.warc.gz", self.filepath)
+
+    def tearDown(self):
+        if os.path.exists(self.working_path):
+            shutil.rmtree(self.working_path)
+
+    def test_index(self):
+        full_scan_items = list(FlickrWarcIter(self.filepath).iter())
+        self.assertIsNone(load_index(self.filepath))
+
+        index = build_index(self.filepath)
+        self.assertEqual(index, load_index(self.filepath))
+        self.assertEqual(("flickr.photos.getInfo", "7852007538", "85779209@N08", 1345830922),
+                         tuple(index["records"][0][1:]))
+        # The listing page doesn't have the extras of a lite harvest, so isn't indexed.
+        self.assertEqual(58, len(index["records"]))
+        self.assertNotIn("flickr.people.getPublicPhotos", [record[1] for record in index["records"]])
+
+        with patch.object(FlickrWarcIter, "_iter_scanned_file") as mock_iter:
+            self.assertEqual(full_scan_items, list(FlickrWarcIter(self.filepath).iter()))
+            # Didn't fall back to full scan
+            mock_iter.assert_not_called()
+
+    def test_index_filters(self):
+        build_index(self.filepath)
+        item_date_start = datetime(2012, 8, 24, 17, 0, tzinfo=pytz.utc)
+        for limit_owner_nsids in (None, ["85779209@N08"], ["23972344@N05"]):
+            self.assertEqual(
+                list(FlickrWarcIter(self.filepath, limit_owner_nsids=limit_owner_nsids, use_index=False).iter(
+                    limit_item_types=[TYPE_FLICKR_PHOTO], item_date_start=item_date_start)),
+                list(FlickrWarcIter(self.filepath, limit_owner_nsids=limit_owner_nsids).iter(
+                    limit_item_types=[TYPE_FLICKR_PHOTO], item_date_start=item_date_start)))
+            self.assertEqual(
+                list(FlickrWarcIter(self.filepath, limit_owner_nsids=limit_owner_nsids, use_index=False,
+                                    join_sizes=True).iter()),
+                list(FlickrWarcIter(self.filepath, limit_owner_nsids=limit_owner_nsids, join_sizes=True).iter()))
+
+    def test_stale_index(self):
+        build_index(self.filepath)
+        stat = os.stat(self.filepath)
+        os.utime(self.filepath, (stat.st_atime, stat.st_mtime + 10))
+
+        self.assertIsNone(load_index(self.filepath))
+        self.assertEqual(29, len(list(FlickrWarcIter(self.filepath).iter(limit_item_types=[TYPE_FLICKR_PHOTO]))))
+
+    def test_build_missing_index(self):
+        list(FlickrWarcIter(self.filepath, build_missing_index=True).iter())
+        self.assertIsNotNone(load_index(self.filepath))
@@ -0,0 +1,40 @@
+from __future__ import absolute_import
+import tests
+from photo_id_set import PhotoIdSet, BITMAP_THRESHOLD, CONTAINER_BITS
+
+
+class TestPhotoIdSet(tests.TestCase):
+    def setUp(self):
+        # Sparse ids, a dense run of ids that become a bitmap, and ids that aren't stored as integers
+        self.photo_ids = [str(16610484049 + i * 7919) for i in range(1000)] + \
+                         [str((5 << CONTAINER_BITS) + i) for i in range(BITMAP_THRESHOLD + 10)] + \
+                         [None, "abc", "007", str(2 ** 64), "\u0661\u0662"]
+
+    def assert_photo_ids(self, photo_id_set):
+        self.assertEqual(len(self.photo_ids), len(photo_id_set))
+        for photo_id in self.photo_ids:
+            self.assertIn(photo_id, photo_id_set)
+        for photo_id in ("7", "16610484050", str((6 << CONTAINER_BITS) + 1), "xyz"):
+            self.assertNotIn(photo_id, photo_id_set)
+        self.assertEqual(sorted(self.photo_ids, key=str), sorted(photo_id_set, key=str))
+
+    def test_add(self):
+        photo_id_set = PhotoIdSet()
+        for photo_id in self.photo_ids:
+            self.assertTrue(photo_id_set.add(photo_id))
+        for photo_id in self.photo_ids:
+            self.assertFalse(photo_id_set.add(photo_id))
+        self.assert_photo_ids(photo_id_set)
+        # Numeric ids are the same as numeric strings
+        self.assertIn(16610484049, photo_id_set)
+        self.assertFalse(photo_id_set.add(16610484049))
+
+    def test_spill(self):
+        with PhotoIdSet(self.photo_ids, max_memory_containers=2) as photo_id_set:
+            self.assertIsNotNone(photo_id_set._spill_file)
+            self.assertEqual(2, len(photo_id_set._containers))
+            self.assertTrue(photo_id_set._spill_index)
+            self.assert_photo_ids(photo_id_set)
+            for photo_id in self.photo_ids:
+                self.assertFalse(photo_id_set.add(photo_id))
+        self.assertIsNone(photo_id_set._spill_file)
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+import tests
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from mock import patch
+from profiling import profiled, profile_enabled
+
+
+def busy_work():
+    return sorted(str(i) for i in range(10000))
+
+
+class TestProfiling(tests.TestCase):
+    def setUp(self):
+        self.output_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_path, ignore_errors=True)
+
+    def test_profiled(self):
+        with profiled("test:1-harvest", self.output_path):
+            busy_work()
+            thread = threading.Thread(target=busy_work)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(["test_1-harvest.prof", "test_1-harvest.txt"], sorted(os.listdir(self.output_path)))
+        stats = pstats.Stats(os.path.join(self.output_path, "test_1-harvest.prof"))
+        busy_work_stats = [stat for func, stat in stats.stats.items() if func[2] == "busy_work"]
+        # Called in this thread and in the other thread
+        self.assertEqual(2, busy_work_stats[0][1])
+        with open(os.path.join(self.output_path, "test_1-harvest.txt")) as f:
+            self.assertIn("Top memory allocations", f.read())
+
+    def test_overlapping(self):
+        outer = profiled("outer", self.output_path)
+        outer.__enter__()
+        inner_done = threading.Event()
+        outer_done = threading.Event()
+
+        def inner_block():
+            with profiled("inner", self.output_path):
+                busy_work()
+                outer_done.wait()
+            inner_done.set()
+
+        thread = threading.Thread(target=inner_block)
+        thread.start()
+        busy_work()
+        # The outer block ends first.
+        outer.__exit__(None, None, None)
+        still_tracing = tracemalloc.is_tracing()
+        outer_done.set()
+        thread.join()
+
+        self.assertTrue(still_tracing)
+        self.assertTrue(inner_done.is_set())
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(["inner.prof", "inner.txt", "outer.prof", "outer.txt"], sorted(os.listdir(self.output_path)))
+
+    def test_not_enabled(self):
+        with profiled("test", self.output_path, enabled=False):
+            busy_work()
+        self.assertEqual([], os.listdir(self.output_path))
+
+    def test_profile_enabled(self):
+        self.assertFalse(profile_enabled({"options": {}}))
+        self.assertTrue(profile_enabled({"options": {"profile": True}}))
+        with patch.dict("os.environ", {"FLICKR_PROFILE": "true"}):
+            self.assertTrue(profile_enabled({}))
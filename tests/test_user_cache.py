@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+import tests
+import os
+import shutil
+import tempfile
+import time
+from mock import patch
+from user_cache import UserCache, shared_user_cache
+
+
+class TestUserCache(tests.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.path, "user_cache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_get_set(self):
+        cache = UserCache()
+        self.assertIsNone(cache.get_nsid("justin.littman"))
+        cache.set_nsid("justin.littman", "131866249@N02")
+        cache.set_person("131866249@N02", {"username": {"_content": "justin.littman"}})
+        self.assertEqual("131866249@N02", cache.get_nsid("justin.littman"))
+        self.assertEqual({"username": {"_content": "justin.littman"}}, cache.get_person("131866249@N02"))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_expires(self):
+        cache = UserCache(ttl_secs=60)
+        cache.set_nsid("justin.littman", "131866249@N02")
+        with patch("user_cache.time.time", return_value=time.time() + 61):
+            self.assertIsNone(cache.get_nsid("justin.littman"))
+        self.assertEqual(0, len(cache))
+
+    def test_no_ttl(self):
+        cache = UserCache(ttl_secs=0)
+        cache.set_nsid("justin.littman", "131866249@N02")
+        self.assertIsNone(cache.get_nsid("justin.littman"))
+
+    def test_evicts(self):
+        cache = UserCache(max_entries=2)
+        cache.set_nsid("user1", "1@N01")
+        cache.set_nsid("user2", "2@N01")
+        # Most recently used
+        cache.get_nsid("user1")
+        cache.set_nsid("user3", "3@N01")
+        self.assertEqual("1@N01", cache.get_nsid("user1"))
+        self.assertIsNone(cache.get_nsid("user2"))
+        self.assertEqual("3@N01", cache.get_nsid("user3"))
+
+    def test_save_load(self):
+        cache = UserCache(self.filepath, ttl_secs=60)
+        cache.set_nsid("justin.littman", "131866249@N02")
+        cache.set_person("131866249@N02", {"username": {"_content": "justin.littman"}})
+        cache.save()
+
+        loaded_cache = UserCache(self.filepath, ttl_secs=60)
+        self.assertEqual("131866249@N02", loaded_cache.get_nsid("justin.littman"))
+        self.assertEqual({"username": {"_content": "justin.littman"}}, loaded_cache.get_person("131866249@N02"))
+        # Expired entries aren't loaded.
+        with patch("user_cache.time.time", return_value=time.time() + 61):
+            self.assertEqual(0, len(UserCache(self.filepath)))
+
+    def test_load_invalid(self):
+        with open(self.filepath, "w") as f:
+            f.write("{")
+        self.assertEqual(0, len(UserCache(self.filepath)))
+
+    def test_shared(self):
+        self.assertIs(shared_user_cache(self.filepath), shared_user_cache(self.filepath))
+        self.assertIsNot(shared_user_cache(self.filepath), shared_user_cache(os.path.join(self.path, "other.json")))
@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Users rarely change their usernames, so entries are kept for a week.
+DEFAULT_TTL_SECS = 7 * 24 * 60 * 60
+# Maximum number of usernames and of people kept. The least recently used are evicted.
+DEFAULT_MAX_ENTRIES = 10000
+
+# Map of filepath to UserCache, so that harvesters in a process share a cache
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def shared_user_cache(filepath, ttl_secs=DEFAULT_TTL_SECS, max_entries=DEFAULT_MAX_ENTRIES):
+    """
+    Returns the process-wide UserCache for the file, creating it if necessary.
+    """
+    with _caches_lock:
+        cache = _caches.get(filepath)
+        if cache is None:
+            cache = _caches[filepath] = UserCache(filepath, ttl_secs=ttl_secs, max_entries=max_entries)
+        return cache
+
+
+class UserCache(object):
+    """
+    Thread-safe cache of username to nsid and of nsid to person (from people.getInfo), with a time to live.
+
+    Entries expire ttl_secs after they were set, after which the caller looks the user up again (e.g., detecting a
+    changed username). When there are more than max_entries usernames or people, the least recently used are evicted.
+
+    If a filepath is provided, the cache is loaded from it and saved to it, so that it lasts across restarts.
+    """
+
+    def __init__(self, filepath=None, ttl_secs=DEFAULT_TTL_SECS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.filepath = filepath
+        self.ttl_secs = ttl_secs
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Maps of key to (expires epoch time, value), least recently used first
+        self._nsids = OrderedDict()
+        self._people = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if filepath and os.path.exists(filepath):
+            self._load()
+
+    def get_nsid(self, username):
+        """
+        Returns the cached nsid of a username or None if not cached or expired.
+        """
+        return self._get(self._nsids, username)
+
+    def set_nsid(self, username, nsid):
+        self._set(self._nsids, username, nsid)
+
+    def get_person(self, nsid):
+        """
+        Returns the cached person of an nsid or None if not cached or expired.
+        """
+        return self._get(self._people, nsid)
+
+    def set_person(self, nsid, person):
+        self._set(self._people, nsid, person)
+
+    def _get(self, entries, key):
+        with self._lock:
+            entry = entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _set(self, entries, key, value):
+        if not self.ttl_secs:
+            return
+        with self._lock:
+            entries[key] = (time.time() + self.ttl_secs, value)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._nsids) + len(self._people)
+
+    def _load(self):
+        try:
+            with open(self.filepath) as f:
+                cache = json.load(f)
+        except ValueError:
+            # Only a cache, so start over.
+            log.warning("User cache %s is not valid JSON, so ignoring", self.filepath)
+            return
+        now = time.time()
+        for entries, name in ((self._nsids, "nsids"), (self._people, "people")):
+            # Saved least recently used first
+            for key, expires, value in cache.get(name, []):
+                if expires > now:
+                    entries[key] = (expires, value)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        log.debug("Loaded %s cached usernames and people from %s", len(self), self.filepath)
+
+    def save(self):
+        """
+        Save the unexpired entries to the file, if any.
+        """
+        if not self.filepath:
+            return
+        now = time.time()
+        with self._lock:
+            cache = {name: [[key, expires, value] for key, (expires, value) in entries.items() if expires > now]
+                     for entries, name in ((self._nsids, "nsids"), (self._people, "people"))}
+        # Replaced atomically, so that a harvester starting up never reads a partially written file.
+        tmp_filepath = "{}.tmp".format(self.filepath)
+        with open(tmp_filepath, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_filepath, self.filepath)